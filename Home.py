@@ -1,5 +1,9 @@
+import warmup
 import streamlit as st
 
+# load the embedding model, prompts and sample db while the user reads this page
+warmup.start_background()
+
 st.set_page_config(
     page_title="Langchain Chatbot",
     page_icon='💬',
@@ -0,0 +1,354 @@
+"""Offline end-to-end benchmark of the six chatbots and the HTTP service.
+
+Every chatbot runs the chain or agent chatbots.build gives the pages and the
+server, against fakes from fakes.py: a chat model streaming at a fixed rate, a
+DuckDuckGo stand-in, a local stub of the r.jina.ai reader, generated PDFs and
+the bundled Chinook.db. Embeddings are hashed bag of words (no model download),
+pass --fastembed to use the real model when it is already cached. Nothing
+touches the network or a GPU.
+
+Each scenario runs in a fresh process, so its peak RSS is its own. Reported:
+time to first token and end-to-end latency per turn, ingestion throughput of
+the documents and website chatbots, and turn latency / throughput of the
+ChatService at increasing numbers of concurrent sessions.
+
+Usage:
+    python benchmarks/bench_chatbots.py --output results.json
+    python benchmarks/bench_chatbots.py --scenarios documents concurrency --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+SCENARIOS = ["basic", "context", "internet", "documents", "sql", "website", "concurrency"]
+QUESTIONS = [
+    "What does the report say about the harbour?",
+    "And what about the vegetables?",
+    "Summarise that in one sentence.",
+    "Which parts mention the wizards?",
+    "How many artists are there?",
+]
+
+
+class TurnTimer(BaseCallbackHandler):
+    """Time to first streamed token, tokens and LLM calls of one turn."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.tokens = 0
+        self.llm_calls = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.llm_calls += 1
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.tokens += 1
+
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99)),
+            "mean": float(np.mean(values)), "max": float(np.max(values))}
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux; children covers the PDF parsing pool
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+def setup(args):
+    """Point chatbots.py at the fakes, returns (chatbots module, llm, fake search, stub server)."""
+    import tools
+    import chatbots
+    from fakes import FakeChatModel, FakeSearch, StubReaderServer
+
+    if not args.fastembed:
+        from embeddings import CachedEmbeddings, EmbeddingService
+        from bench_retrieval import TopicEmbeddings
+        embeddings = CachedEmbeddings(EmbeddingService(TopicEmbeddings()), model_name="topic-hash")
+        chatbots.embedding_model = lambda: embeddings
+
+    search = FakeSearch(latency=args.search_latency)
+    tools._ddg_search = search
+
+    stub = StubReaderServer(latency=args.fetch_latency, paragraphs=args.page_paragraphs).__enter__()
+    os.environ["WEB_READER_URL"] = stub.base_url
+    chatbots.web_fetcher.cache_clear()
+
+    llm = FakeChatModel(first_token_latency=args.first_token_latency, tokens_per_second=args.tokens_per_second,
+                        answer_tokens=args.answer_tokens)
+    return chatbots, llm, search, stub
+
+
+def run_turns(chatbots, chatbot, llm, turns, options=None):
+    from memory import TokenBudgetMemory
+
+    spec = chatbots.CHATBOTS[chatbot]
+    memory = TokenBudgetMemory(llm=llm, **spec["memory"]) if spec["memory"] is not None else None
+    results = []
+    for question in (QUESTIONS * turns)[:turns]:
+        timer = TurnTimer()
+        # built per turn, as the server does
+        chain = chatbots.build(chatbot, llm, memory, options)
+        chain.invoke({spec["input_key"]: question}, {"callbacks": [timer]})
+        end = time.perf_counter()
+        results.append({
+            "ttft": timer.first_token - timer.start if timer.first_token else None,
+            "latency": end - timer.start,
+            "tokens": timer.tokens,
+            "llm_calls": timer.llm_calls,
+        })
+    return {
+        "turns": len(results),
+        "ttft_s": summarize([r["ttft"] for r in results]),
+        "latency_s": summarize([r["latency"] for r in results]),
+        "llm_calls_per_turn": float(np.mean([r["llm_calls"] for r in results])),
+        "tokens_per_turn": float(np.mean([r["tokens"] for r in results])),
+    }
+
+
+def bench_documents(chatbots, llm, args):
+    from fakes import make_pdf
+
+    files = {}
+    for i in range(args.pdfs):
+        data = make_pdf(args.pdf_pages + i)
+        files[chatbots.document_source_key(data)] = (f"report-{i}.pdf", data)
+    pages = sum(args.pdf_pages + i for i in range(args.pdfs))
+
+    start = time.perf_counter()
+    errors = chatbots.ingest_documents(files)
+    ingest_s = time.perf_counter() - start
+    vectordb = chatbots.document_vectordb(list(files))
+    chunks = len(vectordb)
+
+    result = run_turns(chatbots, "documents", llm, args.turns, {"sources": list(files)})
+    result["ingestion"] = {"files": len(files), "pages": pages, "chunks": chunks, "errors": len(errors),
+                           "seconds": ingest_s, "pages_per_s": pages / ingest_s, "chunks_per_s": chunks / ingest_s}
+    return result
+
+
+def bench_website(chatbots, llm, args):
+    websites = tuple(f"https://example.com/page-{i}" for i in range(args.websites))
+    start = time.perf_counter()
+    vectordb = chatbots.website_vectordb(websites)
+    ingest_s = time.perf_counter() - start
+    chunks = len(vectordb)
+
+    result = run_turns(chatbots, "website", llm, args.turns, {"websites": list(websites)})
+    result["ingestion"] = {"pages": len(websites), "chunks": chunks, "seconds": ingest_s,
+                           "pages_per_s": len(websites) / ingest_s, "chunks_per_s": chunks / ingest_s}
+    return result
+
+
+async def _concurrent_turns(service, sessions, question):
+    async def turn(session_id):
+        start = time.perf_counter()
+        first_token = None
+
+        async def emit(event, data):
+            nonlocal first_token
+            if event == "token" and first_token is None:
+                first_token = time.perf_counter()
+
+        await service.run_turn(session_id, question, emit)
+        end = time.perf_counter()
+        return (first_token - start if first_token else None), end - start
+
+    return await asyncio.gather(*(turn(session_id) for session_id in sessions))
+
+
+def bench_concurrency(chatbots, llm, args):
+    import server
+    from sessions import InMemorySessionStore
+
+    async def run():
+        limiter = server.TurnLimiter(max_concurrent=max(args.sessions), max_waiting=max(args.sessions))
+        service = server.ChatService(InMemorySessionStore(), llm_factory=lambda: llm, limiter=limiter)
+        levels = {}
+        for n in args.sessions:
+            sessions = [await service.create_session("context", {}) for _ in range(n)]
+            # one warm-up turn per session, so every level measures a turn with history
+            await _concurrent_turns(service, sessions, QUESTIONS[0])
+            start = time.perf_counter()
+            timings = await _concurrent_turns(service, sessions, QUESTIONS[1])
+            wall = time.perf_counter() - start
+            levels[str(n)] = {
+                "sessions": n,
+                "wall_s": wall,
+                "turns_per_s": n / wall,
+                "ttft_s": summarize([ttft for ttft, _ in timings]),
+                "latency_s": summarize([latency for _, latency in timings]),
+            }
+        return levels
+
+    return {"levels": asyncio.run(run())}
+
+
+def run_scenario(name, args, workdir):
+    """Runs in its own process, returns the scenario's metrics."""
+    # caches and saved corpora go to a scratch folder, the repo's .cache stays untouched
+    os.chdir(workdir)
+    baseline = rss_mb()
+    chatbots, llm, search, stub = setup(args)
+    start = time.perf_counter()
+    try:
+        if name == "documents":
+            result = bench_documents(chatbots, llm, args)
+        elif name == "website":
+            result = bench_website(chatbots, llm, args)
+        elif name == "concurrency":
+            result = bench_concurrency(chatbots, llm, args)
+        else:
+            result = run_turns(chatbots, name, llm, args.turns)
+    finally:
+        stub.__exit__(None, None, None)
+        # reap the PDF parsing pool, so its peak RSS shows up under children
+        import ingestion
+        ingestion.shutdown()
+    result["seconds"] = time.perf_counter() - start
+    result["rss_mb"] = {"baseline": baseline, "end": rss_mb(), "peak": peak_rss_mb()}
+    result["fake_calls"] = {"llm": llm.calls, "search": search.calls, "reader": stub.requests}
+    return result
+
+
+def _child(name, args, workdir, queue):
+    try:
+        queue.put(("ok", run_scenario(name, args, workdir)))
+    except BaseException as e:
+        import traceback
+        queue.put(("error", "".join(traceback.format_exception(e))))
+
+
+def report(name, result):
+    ttft = result.get("ttft_s") or {}
+    latency = result.get("latency_s") or {}
+    line = f"  {name:<12} peak rss {result['rss_mb']['peak']['self']:7.1f} MB"
+    if latency:
+        line += (f"  ttft p50 {ttft.get('p50', float('nan')) * 1000:7.1f} ms"
+                 f"  latency p50 {latency['p50'] * 1000:8.1f} ms  p99 {latency['p99'] * 1000:8.1f} ms"
+                 f"  llm calls/turn {result['llm_calls_per_turn']:.1f}")
+    print(line)
+    if "ingestion" in result:
+        ingestion = result["ingestion"]
+        print(f"  {'':<12} ingestion {ingestion['pages']} pages, {ingestion['chunks']} chunks in "
+              f"{ingestion['seconds']:.2f}s: {ingestion['pages_per_s']:.1f} pages/s, {ingestion['chunks_per_s']:.1f} chunks/s")
+    for level in result.get("levels", {}).values():
+        print(f"  {'':<12} {level['sessions']:4d} sessions  {level['turns_per_s']:7.1f} turns/s  "
+              f"ttft p50 {level['ttft_s']['p50'] * 1000:7.1f} ms  latency p50 {level['latency_s']['p50'] * 1000:8.1f} ms  "
+              f"p99 {level['latency_s']['p99'] * 1000:8.1f} ms")
+
+
+def _flatten(result, prefix=""):
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(baseline, results):
+    """Prints every metric that moved by more than 5% against a previous run."""
+    print(f"Compared with {baseline['meta']['timestamp']} ({baseline['meta'].get('commit') or 'unknown commit'})")
+    for name, result in results.items():
+        old = _flatten(baseline["scenarios"].get(name, {}))
+        for key, value in _flatten(result).items():
+            if key in old and old[key] and abs(value / old[key] - 1) > 0.05:
+                print(f"  {name}.{key:<40} {old[key]:12.4f} -> {value:12.4f}  ({value / old[key] - 1:+.0%})")
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--turns', type=int, default=5, help="turns per chatbot")
+    parser.add_argument('--first-token-latency', type=float, default=0.1, help="seconds before the fake model's first token")
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--answer-tokens', type=int, default=60)
+    parser.add_argument('--search-latency', type=float, default=0.3)
+    parser.add_argument('--fetch-latency', type=float, default=0.2, help="seconds per page of the stub reader")
+    parser.add_argument('--page-paragraphs', type=int, default=20, help="120 word paragraphs per stub web page")
+    parser.add_argument('--websites', type=int, default=4)
+    parser.add_argument('--pdfs', type=int, default=4)
+    parser.add_argument('--pdf-pages', type=int, default=50)
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 8, 32, 128], help="concurrent sessions")
+    parser.add_argument('--fastembed', action='store_true', help="use the real embedding model, must be cached locally")
+    parser.add_argument('--output', help="write results as JSON")
+    parser.add_argument('--compare', help="JSON of a previous run to compare with")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="bench-chatbots-")
+    try:
+        for name in args.scenarios:
+            queue = context.Queue()
+            process = context.Process(target=_child, args=(name, args, workdir, queue))
+            process.start()
+            status, result = queue.get()
+            process.join()
+            if status == "error":
+                print(f"  {name:<12} failed\n{result}")
+                results[name] = {"error": result}
+                continue
+            results[name] = result
+            report(name, result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _commit(), "python": platform.python_version(),
+                 "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": vars(args),
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    if baseline:
+        compare(baseline, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Chunking settings compared on embedding work, index size and retrieval recall.
+
+The corpus is synthetic: markdown web pages from a few sites, each page with
+its site's navigation bar and footer around sections of paragraphs, and PDF
+style text wrapped at 80 columns with hyphenation and a running header on
+every page. Every paragraph holds one fact sentence of rare words; a query
+asks for six of them and counts as found when a retrieved chunk contains the
+whole sentence.
+
+Every source (web page, PDF) gets its own splitter, like in chatbots.py and
+corpus.py, so duplicates are only dropped within a source. Embeddings are
+hashed bag of words (bench_retrieval.TopicEmbeddings), so the embedding time
+mostly reflects the number of chunks; the characters embedded are what a real
+model's cost scales with.
+
+Usage:
+    python benchmarks/bench_chunking.py
+    python benchmarks/bench_chunking.py --pages 400 --pdf-pages 200 --k 4
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import textwrap
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from bench_retrieval import TopicEmbeddings
+from chunking import StructuredSplitter
+from vectorstore import NumpyVectorStore
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+SYLLABLES = "ka lo mi nu pe ra si to vu xe ba de fi go hu ja ke li mo ne".split()
+
+
+def make_vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES, size=int(rng.integers(2, 5)))))
+    return sorted(words)
+
+
+def make_corpus(pages, pdf_pages, sites=5, seed=0):
+    """Documents and (query, fact sentence) pairs."""
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(rng, 4000)
+    # frequent words make up most of the text, facts use the rare ones
+    common, rare = vocabulary[:300], vocabulary[300:]
+
+    def sentence(n):
+        return " ".join(rng.choice(common, size=n)).capitalize() + "."
+
+    facts = []
+
+    def paragraph():
+        fact = list(rng.choice(rare, size=10, replace=False))
+        fact_sentence = " ".join(fact).capitalize() + "."
+        facts.append((" ".join(rng.choice(fact, size=6, replace=False)), fact_sentence))
+        parts = [sentence(int(rng.integers(8, 20))) for _ in range(int(rng.integers(3, 7)))]
+        parts.insert(int(rng.integers(len(parts) + 1)), fact_sentence)
+        return " ".join(parts)
+
+    navbars = [" | ".join(f"[{w}](/{w})" for w in rng.choice(common, size=30)) for _ in range(sites)]
+    footers = [" ".join(rng.choice(common, size=40)) + " Copyright all rights reserved." for _ in range(sites)]
+    documents = []
+    for page in range(pages):
+        site = page % sites
+        body = [navbars[site], f"# {sentence(4)}"]
+        for _ in range(int(rng.integers(2, 5))):
+            body.append(f"## {sentence(3)}")
+            body.extend(paragraph() for _ in range(int(rng.integers(1, 4))))
+        body.append(footers[site])
+        documents.append(Document(page_content="\n\n".join(body), metadata={"source": f"https://site{site}.example/page{page}"}))
+    for page in range(pdf_pages):
+        text = "\n\n".join(paragraph() for _ in range(4))
+        lines = textwrap.wrap(text, 80, break_long_words=True)
+        # hyphenate some line ends, as PDF text extraction returns them
+        lines = [line[:-3] + "-\n" + line[-3:] if i % 7 == 3 and line[-4:].isalpha() else line for i, line in enumerate(lines)]
+        header = f"Annual report of the lighthouse keepers association page {page + 1}"
+        documents.append(Document(page_content=header + "\n" + "\n".join(lines), metadata={"source": "report.pdf", "page": page}))
+    return documents, facts
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(folder) for f in files)
+
+
+def run(name, make_splitter, documents, facts, embedding, k):
+    start = time.perf_counter()
+    sources = {}
+    for document in documents:
+        sources.setdefault(document.metadata["source"], []).append(document)
+    chunks = [chunk for docs in sources.values() for chunk in make_splitter().split_documents(docs)]
+    split_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectors = embedding.embed_documents([c.page_content for c in chunks])
+    embed_seconds = time.perf_counter() - start
+    store = NumpyVectorStore(embedding)
+    store.add_vectors(vectors, chunks)
+    folder = tempfile.mkdtemp()
+    try:
+        store.save(os.path.join(folder, "index"))
+        size = folder_size(folder)
+    finally:
+        shutil.rmtree(folder)
+
+    hits = 0
+    for query, fact_sentence in facts:
+        found = store.similarity_search(query, k=k)
+        # PDF text is wrapped, compare without line breaks and hyphens
+        hits += any(fact_sentence in " ".join(d.page_content.replace("-\n", "").split()) for d in found)
+    characters = sum(len(c.page_content) for c in chunks)
+    print(f"  {name:<36} {len(chunks):7d} {characters / 1e6:8.2f} {split_seconds:7.2f} {embed_seconds:7.2f} "
+          f"{size / 2**20:8.2f} {hits / len(facts):9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=300, help="markdown web pages")
+    parser.add_argument('--pdf-pages', type=int, default=150)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=4)
+    args = parser.parse_args()
+
+    documents, facts = make_corpus(args.pages, args.pdf_pages)
+    rng = np.random.default_rng(1)
+    facts = [facts[i] for i in rng.choice(len(facts), size=min(args.queries, len(facts)), replace=False)]
+    embedding = TopicEmbeddings()
+    size = args.chunk_size
+    print(f"{len(documents)} documents, {sum(len(d.page_content) for d in documents) / 1e6:.2f}M characters, "
+          f"{len(facts)} queries, recall@{args.k}")
+    print(f"  {'':<36} {'chunks':>7} {'M chars':>8} {'split s':>7} {'embed s':>7} {'index MB':>8} {'recall':>9}")
+    configs = [
+        (f"recursive {size}/{size // 5} (previous)", lambda: RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=size // 5)),
+        (f"recursive {size}/{size // 10}", lambda: RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=size // 10)),
+        (f"structured {size}/{size // 10}", lambda: StructuredSplitter(size, size // 10, dedup_threshold=None)),
+        (f"structured {size}/{size // 10} + dedup", lambda: StructuredSplitter(size, size // 10)),
+        (f"structured {size}/0 + dedup", lambda: StructuredSplitter(size, 0)),
+    ]
+    for name, make_splitter in configs:
+        run(name, make_splitter, documents, facts, embedding, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Memory use and recall@k of compact NumpyVectorStore layouts vs DocArrayInMemorySearch.
+
+Each layout is built, saved and loaded the way the documents page does it;
+memory is the Python heap held by the loaded store (tracemalloc). Memory-mapped
+vectors and chunk text are paged in by the OS on demand and shared between
+sessions, they are listed separately as the on-disk size.
+
+Usage:
+    python benchmarks/bench_compact.py --sizes 10000 100000
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vectorstore import NumpyVectorStore
+from bench_vectorstore import MatrixEmbeddings
+
+FILLER = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt "
+          "ut labore et dolore magna aliqua. ") * 8
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(folder) for f in files)
+
+
+def traced(build):
+    tracemalloc.start()
+    store = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store, current
+
+
+def recall(search, queries, truth, k):
+    hits, timings = 0, []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        docs = search(query)
+        timings.append(time.perf_counter() - start)
+        hits += len({int(doc.page_content.split()[-1]) for doc in docs} & set(truth[i]))
+    return hits / (len(queries) * k), np.median(timings)
+
+
+def report(name, heap, disk, recall_at_k, p50, k):
+    disk = f"{disk / 2**20:8.1f} MB" if disk is not None else "       -   "
+    print(f"  {name:<24} heap {heap / 2**20:8.1f} MB  disk {disk}  recall@{k} {recall_at_k:5.3f}  "
+          f"search p50 {p50 * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--docarray-max', type=int, default=20000, help="skip DocArray above this size, it is slow to build")
+    args = parser.parse_args()
+
+    try:
+        from langchain_community.vectorstores import DocArrayInMemorySearch
+    except ImportError:
+        DocArrayInMemorySearch = None
+
+    for n in args.sizes:
+        print(f"{n} chunks of {len(FILLER)} chars, dim {args.dim}")
+        embedding = MatrixEmbeddings(n, args.dim)
+        texts = [f"{FILLER} {i}" for i in range(n)]
+        queries = [f"query {i}" for i in range(args.queries)]
+
+        # exact cosine neighbours as ground truth
+        matrix = embedding.matrix / np.linalg.norm(embedding.matrix, axis=1, keepdims=True)
+        query_vectors = embedding.queries[:args.queries]
+        truth = np.argsort(-(query_vectors @ matrix.T), axis=1)[:, :args.k]
+
+        for dtype in ("float32", "float16", "int8"):
+            folder = tempfile.mkdtemp()
+            try:
+                store = NumpyVectorStore.from_texts(texts, embedding, dtype=dtype)
+                store.save(os.path.join(folder, 'store'))
+                del store
+                loaded, heap = traced(lambda: NumpyVectorStore.load(os.path.join(folder, 'store'), embedding))
+                recall_at_k, p50 = recall(lambda q: loaded.similarity_search(q, k=args.k), queries, truth, args.k)
+                report(f"NumpyVectorStore {dtype}", heap, folder_size(folder), recall_at_k, p50, args.k)
+                del loaded
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+
+        if DocArrayInMemorySearch is None:
+            print("  DocArrayInMemorySearch   skipped (pip install docarray)")
+        elif n > args.docarray_max:
+            print(f"  DocArrayInMemorySearch   skipped (--docarray-max {args.docarray_max})")
+        else:
+            store, heap = traced(lambda: DocArrayInMemorySearch.from_texts(texts, embedding))
+            recall_at_k, p50 = recall(lambda q: store.similarity_search(q, k=args.k), queries, truth, args.k)
+            report("DocArrayInMemorySearch", heap, None, recall_at_k, p50, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Traffic spike against a rate limited LLM backend, with and without the gateway.
+
+`clients` threads send a question at the same time, drawn from `distinct`
+different questions, to a LimitedFakeChatModel (fakes.py) that serves at most
+`capacity` requests at once and fails the rest with a 429. "direct" calls the
+model as before, "gateway" goes through gateway.GatewayChatModel limited to
+the backend's capacity. "fallback" also sends a slow, single-slot "ollama"
+backend's overflow to a faster "openai" one once requests queue up.
+
+Reported per mode: answered and failed requests, requests the backend
+received, its peak concurrency, coalesced and retried requests, and latency
+and time to first token of the answered ones.
+
+Usage:
+    python benchmarks/bench_gateway.py
+    python benchmarks/bench_gateway.py --clients 128 --distinct 16 --capacity 8
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+from langchain_core.messages import HumanMessage
+from langchain_core.callbacks import BaseCallbackHandler
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+
+class FirstToken(BaseCallbackHandler):
+
+    def __init__(self):
+        self.at = None
+        self.tokens = 0
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.at = self.at or time.perf_counter()
+        self.tokens += 1
+
+
+def spike(llm, args):
+    """Fire args.clients requests at once, returns per request (latency, ttft, tokens, error)."""
+    results = [None] * args.clients
+    barrier = threading.Barrier(args.clients)
+
+    def client(i):
+        question = f"Question {i % args.distinct}: what does the report say about the harbour?"
+        first_token = FirstToken()
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            llm.invoke([HumanMessage(content=question)], {"callbacks": [first_token]})
+            error = None
+        except Exception as e:
+            error = type(e).__name__
+        ttft = first_token.at - start if first_token.at else None
+        results[i] = (time.perf_counter() - start, ttft, first_token.tokens, error)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def report(mode, results, backends, stats=None):
+    answered = [r for r in results if r[3] is None]
+    errors = {}
+    for r in results:
+        if r[3] is not None:
+            errors[r[3]] = errors.get(r[3], 0) + 1
+    latencies = [r[0] for r in answered]
+    ttfts = [r[1] for r in answered if r[1] is not None]
+    print(f"{mode}")
+    print(f"  answered {len(answered)}/{len(results)}" + (f", failed {errors}" if errors else "")
+          + (f", tokens per answer {np.mean([r[2] for r in answered]):.0f}" if answered else ""))
+    for name, backend in backends.items():
+        print(f"  backend {name}: {backend.calls + backend.rejected} requests received, peak concurrency {backend.peak}, {backend.rejected} rejected")
+    for s in stats or []:
+        print(f"  gateway {s['name']}: {s['requests']} sent, {s['coalesced']} coalesced, {s['retries']} retries, "
+              f"{s['fallbacks']} fallbacks, {s['rejected']} rejected")
+    if latencies:
+        print(f"  latency p50 {np.percentile(latencies, 50):.2f}s  p95 {np.percentile(latencies, 95):.2f}s  max {max(latencies):.2f}s")
+    if ttfts:
+        print(f"  first token p50 {np.percentile(ttfts, 50):.2f}s  p95 {np.percentile(ttfts, 95):.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=64, help="requests sent at once")
+    parser.add_argument('--distinct', type=int, default=16, help="different questions among them")
+    parser.add_argument('--capacity', type=int, default=4, help="requests the backend serves at once")
+    parser.add_argument('--rate', type=float, default=20, help="gateway requests per second")
+    parser.add_argument('--first-token-latency', type=float, default=0.2)
+    parser.add_argument('--tokens-per-second', type=float, default=200)
+    parser.add_argument('--fallback-queue-depth', type=int, default=4)
+    args = parser.parse_args()
+
+    import gateway
+    from fakes import LimitedFakeChatModel
+
+    def fake(capacity, first_token_latency=args.first_token_latency):
+        return LimitedFakeChatModel(capacity=capacity, first_token_latency=first_token_latency,
+                                    tokens_per_second=args.tokens_per_second)
+
+    print(f"{args.clients} clients, {args.distinct} distinct questions, backend capacity {args.capacity}\n")
+
+    direct = fake(args.capacity)
+    report("direct", spike(direct, args), {"openai": direct})
+
+    backend = gateway.Backend("openai", max_concurrent=args.capacity, rate=args.rate, max_waiting=args.clients)
+    model = fake(args.capacity)
+    report("gateway", spike(gateway.GatewayChatModel(llm=model, backend=backend), args), {"openai": model}, [backend.stats()])
+
+    # a single slot Ollama host, three times slower than OpenAI
+    ollama_backend = gateway.Backend("ollama", max_concurrent=1, max_waiting=args.clients)
+    openai_backend = gateway.Backend("openai", max_concurrent=args.capacity, rate=args.rate, max_waiting=args.clients)
+    ollama, openai = fake(1, 3 * args.first_token_latency), fake(args.capacity)
+    llm = gateway.with_fallback(
+        gateway.GatewayChatModel(llm=ollama, backend=ollama_backend),
+        gateway.GatewayChatModel(llm=openai, backend=openai_backend),
+        queue_depth=args.fallback_queue_depth
+    )
+    report(f"fallback (ollama, overflow to openai past {args.fallback_queue_depth} waiting)", spike(llm, args),
+           {"ollama": ollama, "openai": openai}, [ollama_backend.stats(), openai_backend.stats()])
+
+
+if __name__ == "__main__":
+    main()
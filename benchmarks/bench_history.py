@@ -0,0 +1,108 @@
+"""Rerun cost of the chat history as conversations grow.
+
+Runs a page that only shows the chat history in Streamlit's AppTest and times
+a rerun, as triggered by every keystroke or click, at increasing conversation
+lengths: "windowed" renders through utils.show_chat_history, "full" renders
+every message like the pages used to. Also compares the memory held by a
+Transcript with a list of message dicts of the same conversation.
+
+Usage:
+    python benchmarks/bench_history.py
+    python benchmarks/bench_history.py --lengths 10 100 1000 5000 --reruns 20
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fakes import words
+
+PAGE = """
+import sys
+sys.path.insert(0, {repo!r})
+import streamlit as st
+import utils
+from transcript import Transcript
+
+if "messages" not in st.session_state:
+    messages = Transcript()
+    for i in range({length}):
+        messages.append("user" if i % 2 else "assistant", {content!r})
+    st.session_state["messages"] = messages
+if {windowed!r}:
+    utils.show_chat_history(st.session_state["messages"])
+else:
+    for msg in st.session_state["messages"]:
+        st.chat_message(msg.role).write(msg.content)
+st.chat_input()
+"""
+
+
+def bench_rerun(length, windowed, reruns, content):
+    from streamlit.testing.v1 import AppTest
+
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
+        f.write(PAGE.format(repo=REPO_DIR, length=length, content=content, windowed=windowed))
+    try:
+        app = AppTest.from_file(f.name, default_timeout=600).run()
+        assert not app.exception, app.exception
+        times = []
+        for _ in range(reruns):
+            start = time.perf_counter()
+            app.run()
+            times.append(time.perf_counter() - start)
+        return float(np.median(times)), len(app.chat_message)
+    finally:
+        os.remove(f.name)
+
+
+def bench_memory(length, content):
+    from transcript import Transcript
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    dicts = [{"role": "user" if i % 2 else "assistant", "content": content[:]} for i in range(length)]
+    as_dicts = tracemalloc.get_traced_memory()[0] - before
+    del dicts
+    before = tracemalloc.get_traced_memory()[0]
+    messages = Transcript()
+    for i in range(length):
+        messages.append("user" if i % 2 else "assistant", content[:])
+    as_transcript = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    messages.clear()
+    return as_dicts, as_transcript
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--reruns', type=int, default=10)
+    parser.add_argument('--words', type=int, default=60, help="words per message")
+    args = parser.parse_args()
+
+    content = words(args.words)
+    os.chdir(tempfile.mkdtemp())
+    print(f"rerun, median of {args.reruns}")
+    for length in args.lengths:
+        for windowed in (True, False):
+            seconds, rendered = bench_rerun(length, windowed, args.reruns, content)
+            label = "windowed" if windowed else "full"
+            print(f"  {length:6d} messages  {label:<9} {seconds * 1000:9.1f} ms  {rendered:6d} rendered")
+
+    print("memory")
+    for length in args.lengths:
+        as_dicts, as_transcript = bench_memory(length, content)
+        print(f"  {length:6d} messages  dicts {as_dicts / 1024:9.1f} KiB  transcript {as_transcript / 1024:9.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
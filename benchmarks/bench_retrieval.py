@@ -0,0 +1,112 @@
+"""Compare dense MMR retrieval with HybridRetriever on recall and latency.
+
+The corpus is synthetic: every chunk is about one topic and mentions one part
+number. The fake embedding model only sees topic words, like a dense model that
+does not represent rare codes well, so part number questions test the lexical
+stage and topic questions the dense one.
+
+Usage:
+    python benchmarks/bench_retrieval.py --sizes 1000 10000 50000
+"""
+import os
+import sys
+import time
+import zlib
+import argparse
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lexical import tokenize
+from retrieval import HybridRetriever
+from vectorstore import NumpyVectorStore, SegmentedVectorStore
+
+
+class TopicEmbeddings(Embeddings):
+    """Hashed bag of words over tokens without digits."""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def embed_query(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            if not any(c.isdigit() for c in token):
+                vector[zlib.crc32(token.encode()) % self.dim] += 1
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def _letters(i):
+    # digit free word ids, so the embedding sees topic words
+    return "".join("abcdefghij"[int(d)] for d in str(i))
+
+
+def make_corpus(n, topics=50, words_per_topic=20, seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = [[f"topic{_letters(t)}word{_letters(w)}" for w in range(words_per_topic)] for t in range(topics)]
+    texts, topic_of, codes = [], [], []
+    for i in range(n):
+        topic = int(rng.integers(topics))
+        words = list(rng.choice(vocabulary[topic], size=30))
+        code = f"px-{i:06d}"
+        words.insert(int(rng.integers(len(words))), code)
+        texts.append(" ".join(words))
+        topic_of.append(topic)
+        codes.append(code)
+    return texts, topic_of, codes, vocabulary
+
+
+def evaluate(name, search, queries, expected, k):
+    hits, timings = 0, []
+    for query, target in zip(queries, expected):
+        start = time.perf_counter()
+        documents = search(query)
+        timings.append(time.perf_counter() - start)
+        hits += any(target(doc) for doc in documents[:k])
+    print(f"  {name:<34} recall@{k} {hits / len(queries):6.2f}  p50 {np.median(timings) * 1000:7.2f} ms  "
+          f"p99 {np.percentile(timings, 99) * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--segments', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--fetch-k', type=int, default=10)
+    args = parser.parse_args()
+
+    embedding = TopicEmbeddings()
+    rng = np.random.default_rng(1)
+    for n in args.sizes:
+        texts, topic_of, codes, vocabulary = make_corpus(n)
+        store = SegmentedVectorStore(embedding)
+        for s in range(args.segments):
+            part = range(s, n, args.segments)
+            segment = NumpyVectorStore.from_texts([texts[i] for i in part], embedding,
+                                                  [{"i": i} for i in part])
+            store.add_segment(s, segment)
+        start = time.perf_counter()
+        for segment in store.segments.values():
+            segment.lexical_index
+        print(f"{n} chunks, BM25 index built in {time.perf_counter() - start:.2f}s")
+
+        picks = rng.choice(n, size=args.queries, replace=False)
+        code_queries = [f"which part is {codes[i]}?" for i in picks]
+        code_expected = [lambda doc, i=i: doc.metadata["i"] == i for i in picks]
+        topic_queries = [" ".join(rng.choice(vocabulary[topic_of[i]], size=3)) for i in picks]
+        topic_expected = [lambda doc, t=topic_of[i]: topic_of[doc.metadata["i"]] == t for i in picks]
+
+        dense = lambda q: store.max_marginal_relevance_search(q, k=args.k, fetch_k=args.fetch_k)
+        hybrid = HybridRetriever(vectorstore=store, k=args.k, fetch_k=args.fetch_k).invoke
+        for label, queries, expected in (("part numbers", code_queries, code_expected),
+                                         ("topics", topic_queries, topic_expected)):
+            evaluate(f"dense mmr ({label})", dense, queries, expected, args.k)
+            evaluate(f"hybrid ({label})", hybrid, queries, expected, args.k)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Execution guard of sqldb.CachedSQLDatabase on Chinook.db plus a synthetic large table.
+
+Copies the bundled Chinook.db to a temporary folder and adds an `events`
+table of `rows` rows, then checks the three guards the SQL page relies on:
+
+- row cap: a full `SELECT *` of events returns `max_rows` rows and the
+  truncation note, compared with a plain SQLDatabase on time and peak
+  Python heap (tracemalloc)
+- timeout: a self join of events is cancelled with a QueryGuardError
+  shortly after the statement timeout, and the connection is usable again
+- cost estimate: full scans of events are reported to the
+  report_expensive_queries callback and refused above `max_cost`, indexed
+  Chinook lookups are not
+
+Exits with status 1 if a check fails.
+
+Usage:
+    python benchmarks/bench_sql_guard.py
+    python benchmarks/bench_sql_guard.py --rows 2000000 --timeout 2 --skip-baseline
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import sqldb
+from sqlalchemy import create_engine
+from langchain_community.utilities.sql_database import SQLDatabase
+
+
+def make_database(folder, rows):
+    path = os.path.join(folder, "chinook-large.db")
+    shutil.copy(sqldb.SAMPLE_DB_PATH, path)
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, customer_id INTEGER, kind TEXT, payload TEXT)")
+    connection.executemany(
+        "INSERT INTO events (customer_id, kind, payload) VALUES (?, ?, ?)",
+        ((i % 59 + 1, ("view", "play", "buy")[i % 3], f"event {i} " + "x" * 80) for i in range(rows))
+    )
+    connection.commit()
+    connection.close()
+    return path
+
+
+def measure(run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = run()
+    finally:
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500_000, help="rows of the synthetic events table")
+    parser.add_argument('--max-rows', type=int, default=1000)
+    parser.add_argument('--timeout', type=float, default=1.0, help="statement timeout in seconds")
+    parser.add_argument('--cost-warning', type=int, default=100_000)
+    parser.add_argument('--skip-baseline', action='store_true', help="don't run the unguarded SQLDatabase")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    failures = []
+
+    def check(name, ok, detail):
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}: {detail}")
+        if not ok:
+            failures.append(name)
+
+    try:
+        start = time.perf_counter()
+        path = make_database(folder, args.rows)
+        print(f"Chinook + events ({args.rows:,} rows) built in {time.perf_counter() - start:.1f}s")
+        uri = f"sqlite:///{path}"
+        db = sqldb.CachedSQLDatabase(create_engine(uri), max_rows=args.max_rows, statement_timeout=args.timeout,
+                                     cost_warning=args.cost_warning, result_cache_size=0)
+
+        print("row cap")
+        result, seconds, peak = measure(lambda: db._execute_guarded("SELECT * FROM events", "all", None, None))
+        check("guarded fetch", len(result) == args.max_rows and db._truncated.value,
+              f"{len(result)} rows in {seconds * 1000:.0f} ms, peak heap {peak:.1f} MB")
+        text = db.run("SELECT * FROM events")
+        check("truncation note", text.endswith(f"(Only the first {args.max_rows} rows are shown.)"), f"{len(text):,} characters")
+        if not args.skip_baseline:
+            plain = SQLDatabase(create_engine(uri))
+            text, seconds, peak = measure(lambda: plain.run("SELECT * FROM events"))
+            print(f"       unguarded SQLDatabase: {len(text):,} characters in {seconds * 1000:.0f} ms, peak heap {peak:.1f} MB")
+
+        print("statement timeout")
+        start = time.perf_counter()
+        try:
+            db.run("SELECT COUNT(*) FROM events a, events b WHERE a.payload < b.payload")
+            error = None
+        except sqldb.QueryGuardError as e:
+            error = e
+        seconds = time.perf_counter() - start
+        check("cancelled", error is not None and seconds < args.timeout + 1,
+              f"{type(error).__name__ if error else 'not cancelled'} after {seconds:.2f}s")
+        check("connection reusable", db.run("SELECT COUNT(*) FROM Artist") == "[(275,)]", "Artist count after the cancel")
+
+        print("cost estimate")
+        reported = []
+        with sqldb.report_expensive_queries(lambda command, cost: reported.append((command, cost))):
+            db.run("SELECT kind, COUNT(*) FROM events GROUP BY kind")
+            db.run("SELECT Name FROM Artist WHERE ArtistId = 1")
+            db.run("SELECT * FROM events WHERE id = 42")
+        check("full scan reported", len(reported) == 1 and "events" in reported[0][0],
+              ", ".join(f"{cost:,.0f} for {command!r}" for command, cost in reported) or "nothing reported")
+        db.max_cost = args.rows // 2
+        try:
+            db.run("SELECT * FROM events WHERE payload LIKE '%42%'")
+            error = None
+        except sqldb.QueryGuardError as e:
+            error = e
+        check("refused above max_cost", error is not None, str(error) if error else "not refused")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"{len(failures)} checks failed" if failures else "all checks passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
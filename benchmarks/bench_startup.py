@@ -0,0 +1,104 @@
+"""Cold start cost of the app: module imports, pages, chat model creation and warm-up.
+
+Every measurement runs in a fresh interpreter, repeated --runs times (median
+reported). Pages are executed in Streamlit's bare mode, so only their import
+and module level cost is measured, not a browser session. Point --repo at
+another checkout (e.g. a git worktree of an older commit) to compare.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repo /tmp/baseline --output startup.json
+"""
+import os
+import sys
+import json
+import glob
+import argparse
+import subprocess
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# prints seconds and modules loaded by `code`, after the interpreter itself started
+PROBE = """
+import sys, time, json, warnings, logging
+warnings.filterwarnings("ignore")
+logging.disable(logging.WARNING)
+sys.path.insert(0, ".")
+before = len(sys.modules)
+start = time.perf_counter()
+{code}
+print(json.dumps({{"seconds": time.perf_counter() - start, "modules": len(sys.modules) - before}}))
+"""
+
+CASES = {
+    "import streamlit (Home.py)": "import streamlit",
+    "import utils": "import utils",
+    "import chatbots": "import chatbots",
+    "import clients": "import clients",
+    "openai chat model": "import utils, clients; clients.get_chat_model('openai', 'gpt-4o-mini', api_key='sk-test')",
+    "ollama chat model": "import utils, clients; clients.get_chat_model('ollama', 'llama3.2', base_url='http://localhost:11434')",
+}
+
+
+def probe(repo, code, runs, env):
+    results = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, "-c", PROBE.format(code=code)], cwd=repo, env=env,
+                                   capture_output=True, text=True, timeout=600)
+        if completed.returncode != 0:
+            return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"}
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {"seconds": float(np.median([r["seconds"] for r in results])), "modules": results[-1]["modules"]}
+
+
+def warm_up_steps(repo, env):
+    if not os.path.exists(os.path.join(repo, "warmup.py")):
+        return None
+    completed = subprocess.run([sys.executable, "warmup.py", "--json"], cwd=repo, env=env,
+                               capture_output=True, text=True, timeout=1200)
+    lines = completed.stdout.strip().splitlines()
+    return json.loads(lines[-1]) if lines else {"error": completed.stderr.strip()[-500:]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repo', default=REPO_DIR, help="checkout to measure")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--skip-warmup', action='store_true', help="don't time warmup.py, it may download the model")
+    parser.add_argument('--output', help="write results as JSON")
+    args = parser.parse_args()
+
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    cases = dict(CASES)
+    for page in sorted(glob.glob(os.path.join(args.repo, "pages", "*.py"))):
+        name = os.path.basename(page)
+        # run the page module without __main__, so it builds no chatbot
+        cases[f"page {name}"] = f"import runpy; runpy.run_path({page!r}, run_name='page')"
+
+    results = {}
+    print(f"{args.repo}, median of {args.runs} fresh interpreters")
+    for name, code in cases.items():
+        results[name] = probe(args.repo, code, args.runs, env)
+        if "error" in results[name]:
+            print(f"  {name:<48} failed: {results[name]['error']}")
+        else:
+            print(f"  {name:<48} {results[name]['seconds'] * 1000:8.0f} ms  {results[name]['modules']:5d} modules")
+
+    if not args.skip_warmup:
+        steps = warm_up_steps(args.repo, env)
+        results["warmup"] = steps
+        if steps is None:
+            print("  warm-up                                          not available in this checkout")
+        else:
+            for step, result in steps.items():
+                if isinstance(result, dict):
+                    print(f"  warm-up {step:<40} {result['seconds'] * 1000:8.0f} ms  {result['error'] or ''}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"repo": args.repo, "runs": args.runs, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compare NumpyVectorStore with DocArrayInMemorySearch.
+
+Usage:
+    python benchmarks/bench_vectorstore.py --sizes 1000 10000 100000
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vectorstore import NumpyVectorStore
+
+
+class MatrixEmbeddings(Embeddings):
+    """Returns precomputed random vectors, so only the store is measured."""
+
+    def __init__(self, n, dim, seed=0):
+        rng = np.random.default_rng(seed)
+        self.matrix = rng.standard_normal((n, dim)).astype(np.float32)
+        self.queries = rng.standard_normal((100, dim)).astype(np.float32)
+
+    def embed_documents(self, texts):
+        return [self.matrix[int(t.split()[-1])].tolist() for t in texts]
+
+    def embed_query(self, text):
+        return self.queries[int(text.split()[-1]) % len(self.queries)].tolist()
+
+
+def measure(name, build, queries, k, fetch_k):
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = build()
+    build_s = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = {"similarity": [], "mmr": []}
+    for query in queries:
+        start = time.perf_counter()
+        store.similarity_search(query, k=k)
+        timings["similarity"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        store.max_marginal_relevance_search(query, k=k, fetch_k=fetch_k)
+        timings["mmr"].append(time.perf_counter() - start)
+
+    print(f"  {name:<24} build {build_s:8.2f}s  peak mem {peak / 2**20:8.1f} MB  "
+          f"search p50 {np.median(timings['similarity']) * 1000:8.2f} ms  "
+          f"mmr p50 {np.median(timings['mmr']) * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--fetch-k', type=int, default=4)
+    args = parser.parse_args()
+
+    try:
+        from langchain_community.vectorstores import DocArrayInMemorySearch
+    except ImportError:
+        DocArrayInMemorySearch = None
+
+    for n in args.sizes:
+        print(f"{n} chunks, dim {args.dim}")
+        embedding = MatrixEmbeddings(n, args.dim)
+        texts = [f"chunk {i}" for i in range(n)]
+        queries = [f"query {i}" for i in range(args.queries)]
+        measure("NumpyVectorStore", lambda: NumpyVectorStore.from_texts(texts, embedding), queries, args.k, args.fetch_k)
+        if DocArrayInMemorySearch is None:
+            print("  DocArrayInMemorySearch   skipped (pip install docarray)")
+            continue
+        try:
+            measure("DocArrayInMemorySearch", lambda: DocArrayInMemorySearch.from_texts(texts, embedding), queries, args.k, args.fetch_k)
+        except ImportError as e:
+            print(f"  DocArrayInMemorySearch   skipped ({e})")
+
+
+if __name__ == "__main__":
+    main()
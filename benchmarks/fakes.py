@@ -0,0 +1,235 @@
+"""Offline stand-ins for the chat model, a rate limited backend, DuckDuckGo,
+the r.jina.ai reader and uploaded PDFs.
+"""
+import re
+import time
+import random
+import asyncio
+import threading
+import hashlib
+from pydantic import PrivateAttr
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.language_models.chat_models import BaseChatModel
+
+WORDS = ("the quick brown fox jumps over a lazy dog while seven wizards quietly pack boxes "
+         "of liquor and jugs of mixed vegetables near the old harbour").split()
+
+
+def words(n, offset=0):
+    return " ".join(WORDS[(offset + i) % len(WORDS)] for i in range(n))
+
+
+def prose(n, rng):
+    """`n` words drawn by `rng`, text that never repeats, unlike `words`, so chunk deduplication keeps it."""
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model that streams its answer at a fixed rate.
+
+    Text answers are sent through on_llm_new_token word by word, the first after
+    `first_token_latency` seconds and the rest at `tokens_per_second`, like a
+    provider model with streaming=True. `respond` picks the answer from the
+    prompt so every chatbot's chain or agent runs to completion:
+
+    - with bound tools (SQL agent): a `sql_query` tool call, then a final answer
+    - ReAct prompts (internet agent): one search action, then a final answer
+    - anything else: `answer_tokens` words
+    """
+
+    first_token_latency: float = 0.1
+    tokens_per_second: float = 200.0
+    answer_tokens: int = 60
+    sql_query: str = "SELECT COUNT(*) FROM Artist"
+    streaming: bool = True
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-streaming-chat"
+
+    def respond(self, messages, tools=None):
+        prompt = "\n".join(str(m.content) for m in messages)
+        if tools:
+            if not any(isinstance(m, ToolMessage) for m in messages):
+                return AIMessage(content="", tool_calls=[
+                    {"name": "sql_db_query", "args": {"query": self.sql_query}, "id": f"call_{self.calls}"}
+                ])
+            return AIMessage(content=f"The query returned {messages[-1].content}. " + words(self.answer_tokens - 4))
+        if "Do I need to use a tool?" in prompt:
+            if FakeSearch.MARKER in prompt:
+                return AIMessage(content="Thought: Do I need to use a tool? No\nFinal Answer: " + words(self.answer_tokens))
+            question = prompt.rsplit("New input:", 1)[-1].strip().splitlines()[0]
+            return AIMessage(content=f"Thought: Do I need to use a tool? Yes\nAction: DuckDuckGoSearch\nAction Input: {question}")
+        return AIMessage(content=words(self.answer_tokens, offset=self.calls))
+
+    def _tokens(self, message):
+        return re.findall(r"\S+\s*", message.content)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        message = self.respond(messages, kwargs.get("tools"))
+        time.sleep(self.first_token_latency)
+        if self.streaming and not message.tool_calls:
+            for i, token in enumerate(self._tokens(message)):
+                if i:
+                    time.sleep(1 / self.tokens_per_second)
+                if run_manager:
+                    run_manager.on_llm_new_token(token)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        message = self.respond(messages, kwargs.get("tools"))
+        await asyncio.sleep(self.first_token_latency)
+        if self.streaming and not message.tool_calls:
+            for i, token in enumerate(self._tokens(message)):
+                if i:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                if run_manager:
+                    await run_manager.on_llm_new_token(token)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def get_num_tokens(self, text):
+        return len(text.split())
+
+
+class FakeRateLimitError(Exception):
+    """What an overloaded provider raises, carries a status_code like openai.RateLimitError."""
+
+    status_code = 429
+
+
+class LimitedFakeChatModel(FakeChatModel):
+    """FakeChatModel for a backend serving at most `capacity` requests at once.
+
+    Requests beyond that fail right away with FakeRateLimitError, like the
+    429s of a provider or a single Ollama host that is already busy.
+    """
+
+    capacity: int = 4
+    active: int = 0
+    peak: int = 0
+    rejected: int = 0
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with self._lock:
+            if self.active >= self.capacity:
+                self.rejected += 1
+                raise FakeRateLimitError(f"Rate limit reached, {self.active} requests running")
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class FakeSearch:
+    """Replaces DuckDuckGoSearchRun in tools.py, answers after `latency` seconds."""
+
+    MARKER = "[fake search result]"
+
+    def __init__(self, latency=0.3):
+        self.latency = latency
+        self.calls = 0
+
+    def run(self, query):
+        self.calls += 1
+        time.sleep(self.latency)
+        return f"{self.MARKER} {query}: " + words(80)
+
+
+class StubReaderServer:
+    """Local stand-in for https://r.jina.ai/, serves generated markdown for any url.
+
+    Use `base_url` as WebFetcher's base_url. Pages carry an ETag and answer
+    If-None-Match with a 304 like the real reader.
+
+    Args:
+        latency (float): seconds before each response
+        paragraphs (int): paragraphs of 120 words per page
+    """
+
+    def __init__(self, latency=0.2, paragraphs=20):
+        self.latency = latency
+        self.paragraphs = paragraphs
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                body = stub.page(self.path.lstrip('/')).encode()
+                etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/markdown; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def page(self, url):
+        rng = random.Random(int(hashlib.sha256(url.encode()).hexdigest()[:8], 16))
+        sections = [f"Title: {url}\n\nMarkdown Content:\n"]
+        for i in range(self.paragraphs):
+            sections.append(f"## Section {i}\n\n{prose(120, rng)}\n")
+        return "\n".join(sections)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_pdf(pages, lines_per_page=40, words_per_line=12, seed=0):
+    """Minimal text PDF with `pages` pages that pypdf can extract."""
+    rng = random.Random(f"{seed}-{pages}")
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    font = 3 + 2 * pages
+    for page in range(pages):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {4 + 2 * page} 0 R >>".encode())
+        lines = [f"({_pdf_text(prose(words_per_line, rng))}) Tj T*" for _ in range(lines_per_page)]
+        stream = ("BT /F1 10 Tf 12 TL 40 760 Td " + " ".join(lines) + " ET").encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
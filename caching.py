@@ -0,0 +1,113 @@
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with optional expiry.
+
+    Args:
+        max_entries (int): entries kept, the least recently used one is evicted first
+        ttl (float): seconds an entry stays valid after it was stored
+        idle_ttl (float): seconds an entry stays valid after it was last used
+        on_evict (callable): called as on_evict(key, value) when an entry is dropped
+        on_expire (callable): called as on_expire(key, value) only when an entry
+            is dropped because it expired, not when it makes room for another;
+            e.g. to close a value that callers may still hold until it is idle
+    """
+
+    def __init__(self, max_entries=128, ttl=None, idle_ttl=None, on_evict=None, on_expire=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self.on_expire = on_expire
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def _expired(self, entry, now):
+        _, created, last_used = entry
+        return (self.ttl is not None and now - created > self.ttl) or \
+            (self.idle_ttl is not None and now - last_used > self.idle_ttl)
+
+    def _drop(self, key, expired=False):
+        value, _, _ = self._data.pop(key)
+        if self.on_evict:
+            self.on_evict(key, value)
+        if expired and self.on_expire:
+            self.on_expire(key, value)
+
+    def evict_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, entry in self._data.items() if self._expired(entry, now)]:
+                self._drop(key, expired=True)
+
+    def get(self, key, default=None, count=True):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._drop(key, expired=True)
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return default
+            self._data[key] = (entry[0], entry[1], now)
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            if key in self._data and self._data[key][0] is not value:
+                self._drop(key)
+            self._data[key] = (value, now, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._drop(next(iter(self._data)))
+
+    def get_or_create(self, key, factory):
+        """Return the cached value for `key`, creating it with `factory()` on a miss.
+
+        The factory runs under the cache lock, so keep it cheap.
+        """
+        with self._lock:
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                value = factory()
+                self.set(key, value)
+            return value
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._drop(key)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._data),
+        }
+
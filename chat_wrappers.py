@@ -0,0 +1,31 @@
+"""Base of the chat models that wrap another one, see response_cache.py and gateway.py."""
+import re
+from langchain_core.language_models.chat_models import BaseChatModel
+
+# words with their trailing whitespace, replayed as streamed tokens
+_TOKENS = re.compile(r"\s*\S+\s*|\s+")
+
+
+def replay_tokens(text):
+    """`text` split into the tokens an answer that was not streamed is replayed as."""
+    return _TOKENS.findall(text)
+
+
+class WrappedChatModel(BaseChatModel):
+    """Chat model calling `llm`, which it stands in for in token counts and cache keys."""
+
+    llm: BaseChatModel
+
+    @property
+    def _llm_type(self):
+        return self.llm._llm_type
+
+    @property
+    def _identifying_params(self):
+        return self.llm._identifying_params
+
+    def get_token_ids(self, text):
+        return self.llm.get_token_ids(text)
+
+    def get_num_tokens_from_messages(self, messages, tools=None):
+        return self.llm.get_num_tokens_from_messages(messages)
@@ -0,0 +1,369 @@
+"""Chains, agents and corpora of the six chatbots, without any UI.
+
+Used by the Streamlit pages and by the HTTP service in server.py. Corpora
+(embedded documents and websites) are cached per process and shared by all
+sessions; per session state is limited to the conversation memory and the
+chatbot's options.
+
+Agents, the SQL toolkit, PDF parsing and the embedding model are imported by
+the builders that need them, so a page only loads its own dependencies.
+"""
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tracing
+import functools
+import threading
+from caching import TTLCache
+from prompts import HUB_REFS, load_prompt
+from retrieval import HybridRetriever
+from embeddings import CachedEmbeddings, EmbeddingService
+from vectorstore import NumpyVectorStore, SegmentedVectorStore
+
+from chunking import CHUNKER_VERSION, StructuredSplitter
+from langchain_core.documents import Document
+
+EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+# folder the ONNX weights are downloaded to and loaded from, see warmup.py
+EMBEDDING_MODEL_DIR = os.environ.get("EMBEDDING_MODEL_DIR")
+CHUNK_SIZE = 1000
+# overlap is made of whole paragraphs or lines, see chunking.py
+CHUNK_OVERLAP = 100
+# chunks this similar to one already seen in the same source are dropped
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 0.8)) or None
+# int8 keeps vectors in a quarter of the memory at ~0.98 recall@10,
+# float16 in half but numpy scores it slower
+VECTOR_DTYPE = os.environ.get("VECTOR_DTYPE", "float32")
+# pages read per uploaded PDF, the rest is skipped with a warning; 0 reads all
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 0)) or None
+# saved uploads and page versions, the least recently used are deleted past
+# the size cap or once unused for the max age
+VECTORSTORE_DIR = os.path.join('.cache', 'vectorstores')
+VECTORSTORE_MAX_BYTES = int(os.environ.get("VECTORSTORE_MAX_MB", 2048)) * 2**20
+VECTORSTORE_MAX_AGE = float(os.environ.get("VECTORSTORE_MAX_AGE_DAYS", 30)) * 86400
+
+logger = logging.getLogger('Langchain-Chatbot')
+
+# input and output key of each chatbot's chain, and the memory matching them
+CHATBOTS = {
+    "basic": {"input_key": "input", "output_key": "response", "memory": None},
+    "context": {"input_key": "input", "output_key": "response", "memory": {}},
+    "internet": {"input_key": "input", "output_key": "output", "memory": {"memory_key": "chat_history"}},
+    "documents": {"input_key": "question", "output_key": "answer",
+                  "memory": {"memory_key": "chat_history", "output_key": "answer", "return_messages": True}},
+    "sql": {"input_key": "input", "output_key": "output", "memory": None},
+    "website": {"input_key": "question", "output_key": "answer",
+                "memory": {"memory_key": "chat_history", "output_key": "answer", "return_messages": True}},
+}
+
+
+# the warm-up thread and the first request may ask at the same time, load once
+_model_lock = threading.RLock()
+
+
+@functools.lru_cache(maxsize=None)
+def _embedding_service():
+    from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+
+    # one model for all sessions; queries are micro-batched, document batches
+    # run on a pool of EMBEDDING_BULK_WORKERS threads (or processes)
+    use_processes = os.environ.get("EMBEDDING_BULK_POOL", "thread") == "process"
+    model_factory = functools.partial(FastEmbedEmbeddings, model_name=EMBEDDING_MODEL, cache_dir=EMBEDDING_MODEL_DIR)
+    return EmbeddingService(
+        model_factory(),
+        bulk_workers=int(os.environ.get("EMBEDDING_BULK_WORKERS", 2)),
+        use_processes=use_processes,
+        model_factory=model_factory if use_processes else None
+    )
+
+
+def embedding_service():
+    with _model_lock:
+        return _embedding_service()
+
+
+@functools.lru_cache(maxsize=None)
+def _embedding_model():
+    return CachedEmbeddings(embedding_service(), model_name=EMBEDDING_MODEL)
+
+
+def embedding_model():
+    with _model_lock:
+        return _embedding_model()
+
+
+def conversation_chain(llm, memory=None):
+    from langchain.chains import ConversationChain
+
+    if memory is None:
+        return ConversationChain(llm=llm, verbose=False)
+    return ConversationChain(llm=llm, memory=memory, verbose=False)
+
+
+def internet_agent(llm, memory):
+    from tools import search_tool
+    from langchain.agents import AgentExecutor, create_react_agent
+
+    # Define tool, searches are cached across sessions
+    tools = [search_tool()]
+
+    # Get the prompt - vendored in assets/prompts, can modify this
+    prompt = load_prompt("react-chat", HUB_REFS["react-chat"])
+
+    # Setup LLM and Agent
+    agent = create_react_agent(llm, tools, prompt)
+    return AgentExecutor(agent=agent, tools=tools, memory=memory, verbose=False)
+
+
+def retrieval_chain(llm, vectordb, memory):
+    from langchain.chains import ConversationalRetrievalChain
+
+    # Define retriever, keyword (BM25) and vector hits are fused before MMR
+    retriever = HybridRetriever(
+        vectorstore=vectordb,
+        k=2,
+        fetch_k=10
+    )
+
+    # Setup QA chain
+    return ConversationalRetrievalChain.from_llm(
+        llm=llm,
+        retriever=retriever,
+        memory=memory,
+        return_source_documents=True,
+        verbose=False
+    )
+
+
+def sql_agent(llm, db):
+    from langchain_core.caches import BaseCache  # noqa: F401, needed by model_rebuild
+    from langchain_core.callbacks import Callbacks  # noqa: F401, needed by model_rebuild
+    from langchain_community.agent_toolkits import create_sql_agent
+    from langchain_community.tools.sql_database.tool import QuerySQLCheckerTool
+
+    # the SQL toolkit's checker tool is not fully defined under pydantic 2.10+
+    QuerySQLCheckerTool.model_rebuild()
+    return create_sql_agent(
+        llm=llm,
+        db=db,
+        top_k=10,
+        verbose=False,
+        agent_type="openai-tools",
+        handle_parsing_errors=True,
+        handle_sql_errors=True
+    )
+
+
+def text_splitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, dedup_threshold=DEDUP_THRESHOLD):
+    # one per source, its segment is saved and shared on its own
+    return StructuredSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, dedup_threshold=dedup_threshold)
+
+
+def document_source_key(content, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, dtype=VECTOR_DTYPE):
+    # uploads are identified by content, not by filename
+    return (hashlib.sha256(content).hexdigest(), chunk_size, chunk_overlap, dtype, f"{CHUNKER_VERSION}/{DEDUP_THRESHOLD}")
+
+
+def document_source_folder(source_key):
+    return os.path.join(VECTORSTORE_DIR, hashlib.sha256(repr(source_key).encode()).hexdigest())
+
+
+def _touch(folder):
+    # the folder's mtime is its last use, see sweep_vectorstores
+    try:
+        os.utime(folder)
+    except OSError:
+        pass
+
+
+_sweep_lock = threading.Lock()
+_last_sweep = None
+
+
+def sweep_vectorstores(max_bytes=VECTORSTORE_MAX_BYTES, max_age=VECTORSTORE_MAX_AGE, min_idle=3600, interval=60):
+    """Delete saved vector stores unused for `max_age`, then the least recently used past `max_bytes`.
+
+    Stores used within `min_idle` seconds are kept, sessions holding them
+    touch them on every turn. Runs at most once per `interval` seconds.
+
+    Returns:
+        int: stores deleted
+    """
+    global _last_sweep
+    with _sweep_lock:
+        if (_last_sweep is not None and time.monotonic() - _last_sweep < interval) or not os.path.isdir(VECTORSTORE_DIR):
+            return 0
+        _last_sweep = time.monotonic()
+        folders = []
+        for name in os.listdir(VECTORSTORE_DIR):
+            folder = os.path.join(VECTORSTORE_DIR, name)
+            try:
+                size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(folder) for f in files)
+                folders.append((os.stat(folder).st_mtime, size, folder))
+            except OSError:
+                continue  # deleted by another process meanwhile
+        now, total, deleted = time.time(), sum(size for _, size, _ in folders), 0
+        for last_used, size, folder in sorted(folders):
+            if now - last_used < min_idle:
+                break
+            if now - last_used > max_age or total > max_bytes:
+                shutil.rmtree(folder, ignore_errors=True)
+                total -= size
+                deleted += 1
+        if deleted:
+            logger.info(f"Deleted {deleted} unused vector stores, {total / 2**20:.0f} MB left")
+        tracing.count("vectorstores.evicted", deleted)
+        return deleted
+
+
+def ingest_documents(files, on_progress=None, on_truncated=None):
+    """Parse, embed and save PDFs that are not on disk yet.
+
+    Args:
+        files (dict): source key -> (filename, pdf bytes)
+        on_progress (callable): called as on_progress(source_key, pages_done, total_pages)
+        on_truncated (callable): called as on_truncated(source_key, total_pages)
+            for files of which only the first PDF_MAX_PAGES pages are read
+
+    Returns:
+        dict: source key -> error message for files that could not be read
+    """
+    from ingestion import ingest_pdfs
+
+    # all files of one call share the splitter settings of the first one
+    _, chunk_size, chunk_overlap, dtype, _ = next(iter(files))
+    # keyed by content, two uploads may have the same filename
+    vectordbs = {source_key: NumpyVectorStore(embedding_model(), dtype=dtype) for source_key in files}
+    errors = ingest_pdfs(files, functools.partial(text_splitter, chunk_size, chunk_overlap), vectordbs,
+                         max_pages=PDF_MAX_PAGES, on_progress=on_progress, on_truncated=on_truncated)
+    for source_key in files:
+        if source_key not in errors:
+            vectordbs[source_key].save(document_source_folder(source_key))
+    sweep_vectorstores()
+    return errors
+
+
+# saved segments are memory-mapped and shared by all sessions
+_document_segments = TTLCache(max_entries=100, idle_ttl=3600)
+
+
+def document_vectordb(source_keys, vectordb=None):
+    """SegmentedVectorStore with one segment per saved source, updated in place when given."""
+    vectordb = vectordb if vectordb is not None else SegmentedVectorStore(embedding_model())
+    for source_key in list(vectordb.segments):
+        if source_key not in source_keys:
+            vectordb.remove_segment(source_key)
+    for source_key in source_keys:
+        folder = document_source_folder(source_key)
+        _touch(folder)
+        if source_key not in vectordb.segments and os.path.exists(folder):
+            vectordb.add_segment(source_key, _load_segment(folder))
+    return vectordb
+
+
+def _load_segment(folder):
+    return _document_segments.get_or_create(folder, lambda: NumpyVectorStore.load(folder, embedding_model()))
+
+
+# corpora built with corpus.py, reloaded when their manifest changes
+_corpora = TTLCache(max_entries=16, idle_ttl=3600)
+
+
+def corpus_vectordb(name):
+    """SegmentedVectorStore of the named corpus, its segments memory-mapped and shared by all sessions."""
+    import corpus
+
+    manifest_path = os.path.join(corpus.corpus_folder(name), 'manifest.json')
+    version = os.stat(manifest_path).st_mtime_ns if os.path.exists(manifest_path) else None
+    return _corpora.get_or_create(
+        (name, version), lambda: corpus.load(name, embedding_model(), EMBEDDING_MODEL, load_segment=_load_segment)
+    )
+
+
+# split and embedded websites, shared by all sessions for an hour, and saved
+# by content so an unchanged page is not embedded again after that
+_website_segments = TTLCache(max_entries=256, ttl=3600)
+
+
+@functools.lru_cache(maxsize=None)
+def web_fetcher():
+    from webfetch import WebFetcher
+
+    return WebFetcher(base_url=os.environ.get("WEB_READER_URL", "https://r.jina.ai/"))
+
+
+def website_segment(url, content):
+    folder = document_source_folder((url,) + document_source_key(content.encode()))
+    if os.path.exists(folder):
+        _touch(folder)
+        return _load_segment(folder)
+
+    # Split documents and store in vector db, repeated blocks of the page are dropped
+    with tracing.span("split"):
+        splits = text_splitter().split_documents([Document(page_content=content, metadata={"source": url})])
+    segment = NumpyVectorStore(embedding_model(), dtype=VECTOR_DTYPE)
+    segment.add_texts([doc.page_content for doc in splits], [doc.metadata for doc in splits])
+    segment.save(folder)
+    return segment
+
+
+def website_vectordb(websites, vectordb=None):
+    """SegmentedVectorStore with one segment per website, updated in place when given."""
+    vectordb = vectordb if vectordb is not None else SegmentedVectorStore(embedding_model())
+    for url in list(vectordb.segments):
+        if url not in websites:
+            vectordb.remove_segment(url)
+
+    new_segments = {url: _website_segments.get(url) for url in websites if url not in vectordb.segments}
+    missing = [url for url, segment in new_segments.items() if segment is None]
+    tracing.count("cache.website.hit", len(new_segments) - len(missing))
+    tracing.count("cache.website.miss", len(missing))
+    if missing:
+        # Scrape and load documents
+        with tracing.span("load.web", pages=len(missing)):
+            contents = web_fetcher().fetch_all(missing)
+        for url in missing:
+            if not contents[url].strip():
+                # fetch failed and nothing cached, try again next turn instead of keeping it empty
+                logger.warning(f"No content fetched for {url}")
+                del new_segments[url]
+                continue
+            new_segments[url] = website_segment(url, contents[url])
+            _website_segments.set(url, new_segments[url])
+        sweep_vectorstores()
+    for url, segment in new_segments.items():
+        vectordb.add_segment(url, segment)
+    return vectordb
+
+
+def build(chatbot, llm, memory=None, options=None):
+    """Chain or agent of `chatbot` for one turn.
+
+    Args:
+        chatbot (str): one of CHATBOTS
+        llm (BaseChatModel): chat model
+        memory (BaseMemory): conversation memory built with CHATBOTS[chatbot]["memory"]
+        options (dict): "sources" (document source keys) or "corpus" (name of
+            a corpus.py corpus) for documents, "websites" (canonical urls) for
+            website, "db_uri" for sql
+    """
+    options = options or {}
+    if chatbot == "basic":
+        return conversation_chain(llm)
+    if chatbot == "context":
+        return conversation_chain(llm, memory)
+    if chatbot == "internet":
+        return internet_agent(llm, memory)
+    if chatbot == "documents" and options.get("corpus"):
+        return retrieval_chain(llm, corpus_vectordb(options["corpus"]), memory)
+    if chatbot == "documents":
+        sources = [tuple(key) for key in options.get("sources", [])]
+        return retrieval_chain(llm, document_vectordb(sources), memory)
+    if chatbot == "sql":
+        import sqldb
+        return sql_agent(llm, sqldb.get_database(options.get("db_uri", sqldb.SAMPLE_DB)))
+    if chatbot == "website":
+        return retrieval_chain(llm, website_vectordb(tuple(options.get("websites", []))), memory)
+    raise ValueError(f"Unknown chatbot: {chatbot}")
@@ -0,0 +1,228 @@
+"""Structure aware chunking with duplicate removal, applied before embedding.
+
+Markdown (websites from the reader, .md sources) is cut at headings and blank
+lines, fenced code blocks are kept whole, and a chunk continuing a section
+starts with the section's heading. PDF page text is de-hyphenated and cut at
+line ends. These blocks are packed into chunks of up to `chunk_size`
+characters; the overlap is made of whole trailing blocks, and only a block
+longer than a chunk is cut by RecursiveCharacterTextSplitter.
+
+Chunks that one splitter has already produced, exactly or nearly (MinHash of
+word shingles), are dropped. One splitter is used per source (an uploaded
+file, a corpus file, a web page), so a PDF's running headers and a page's
+repeated blocks are embedded once, while every source's saved segment still
+holds all of its text whatever else was ingested alongside.
+"""
+import re
+import zlib
+import hashlib
+import tracing
+import threading
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# part of the corpus settings, chunks of another version are not reused
+CHUNKER_VERSION = "structured-2"
+
+_WORD = re.compile(r"\w+")
+_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_HYPHENATED = re.compile(r"(\w)-\n(\w)")
+_PRIME = (1 << 31) - 1
+
+
+class MinHashDeduplicator:
+    """Remembers texts and tells whether a new one repeats one of them.
+
+    Exact repeats are found by a hash of the normalised words, near repeats by
+    MinHash signatures of word `shingle_size`-grams in an LSH index of `bands`
+    bands, confirmed when the estimated Jaccard similarity is >= `threshold`.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, shingle_size=5, seed=1):
+        rng = np.random.default_rng(seed)
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        self._exact = set()
+        self._signatures = []
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def signature(self, words):
+        n = self.shingle_size
+        shingles = [" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))]
+        hashes = np.array([zlib.crc32(s.encode()) % _PRIME for s in shingles], dtype=np.uint64)
+        return ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def seen(self, text):
+        """True if `text` repeats a remembered text, else remember it and return False."""
+        words = _WORD.findall(text.casefold())
+        digest = hashlib.sha1(" ".join(words).encode()).digest()
+        # too short for shingles to tell texts apart, only exact repeats count
+        signature = self.signature(words) if len(words) >= 2 * self.shingle_size else None
+        with self._lock:
+            if digest in self._exact:
+                return True
+            if signature is not None:
+                keys = [(band, rows.tobytes()) for band, rows in enumerate(np.split(signature, self.bands))]
+                candidates = {i for key in keys for i in self._buckets.get(key, ())}
+                if any(np.mean(self._signatures[i] == signature) >= self.threshold for i in candidates):
+                    return True
+                for key in keys:
+                    self._buckets.setdefault(key, []).append(len(self._signatures))
+                self._signatures.append(signature)
+            self._exact.add(digest)
+            return False
+
+
+def _is_markdown(document):
+    source = str(document.metadata.get("source", ""))
+    return source.startswith("http") or source.lower().endswith((".md", ".markdown"))
+
+
+def markdown_blocks(text):
+    """(headings, block, is_heading) of a markdown text; headings is the section path of the block."""
+    headings, blocks, lines, fence = [], [], [], None
+
+    def flush():
+        if lines and "".join(lines).strip():
+            blocks.append((tuple(headings), "\n".join(lines).strip("\n"), False))
+        lines.clear()
+
+    for line in text.splitlines():
+        fence_match = _FENCE.match(line)
+        if fence is not None:
+            lines.append(line)
+            if fence_match and fence_match.group(1) == fence:
+                fence = None
+                flush()
+            continue
+        if fence_match:
+            flush()
+            fence = fence_match.group(1)
+            lines.append(line)
+            continue
+        heading = _HEADING.match(line)
+        if heading:
+            flush()
+            level = len(heading.group(1))
+            del headings[level - 1:]
+            headings.extend([""] * (level - 1 - len(headings)))
+            headings.append(heading.group(2))
+            blocks.append((tuple(headings), line.strip(), True))
+        elif not line.strip():
+            flush()
+        else:
+            lines.append(line)
+    flush()
+    return blocks
+
+
+def text_blocks(text):
+    """Lines of PDF (or plain) text, with words hyphenated across lines joined."""
+    text = _HYPHENATED.sub(r"\1\2", text)
+    return [((), line.strip(), False) for line in text.splitlines() if line.strip()]
+
+
+class StructuredSplitter:
+    """Text splitter for `ingestion.ingest_pdfs` and friends, see the module docstring.
+
+    Args:
+        chunk_size (int): characters per chunk at most
+        chunk_overlap (int): characters of trailing blocks repeated at the start of the next chunk
+        dedup_threshold (float): estimated Jaccard similarity from which a chunk
+            counts as a repeat and is dropped, None keeps every chunk
+    """
+
+    def __init__(self, chunk_size=1000, chunk_overlap=100, dedup_threshold=0.8):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.deduplicator = MinHashDeduplicator(dedup_threshold) if dedup_threshold else None
+        self.duplicates = 0
+        self._fallback_overlap = min(chunk_overlap, chunk_size // 2)
+        self._fallback = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=self._fallback_overlap)
+
+    def split_text(self, text, markdown=False):
+        """[(chunk text, section)] of `text`."""
+        blocks = markdown_blocks(text) if markdown else text_blocks(text)
+        separator = "\n\n" if markdown else "\n"
+        chunks, current, size, section = [], [], 0, ()
+        # section of the chunk's first block
+        chunk_section = section
+
+        def flush():
+            # a heading alone says nothing, its section's text carries it
+            if current and not (len(current) == 1 and _HEADING.match(current[0])):
+                chunks.append((separator.join(current), chunk_section))
+
+        for headings, block, is_heading in blocks:
+            if is_heading or headings != section:
+                # a new section starts a new chunk, unless the current one is still small
+                if current and size > self.chunk_size // 3:
+                    flush()
+                    current, size = [], 0
+                section = headings
+            if len(block) > self.chunk_size:
+                # the pieces start with the heading themselves
+                while current and _HEADING.match(current[-1]):
+                    current.pop()
+                flush()
+                heading = _heading_line(section) if not is_heading else None
+                budget = self.chunk_size - len(heading or "") - len(separator)
+                if heading and budget <= 2 * self._fallback_overlap:
+                    # a heading that long leaves no room for text, the pieces go without it
+                    heading = None
+                splitter = self._fallback
+                if heading:
+                    splitter = RecursiveCharacterTextSplitter(chunk_size=budget, chunk_overlap=min(self._fallback_overlap, budget // 2))
+                for piece in splitter.split_text(block):
+                    chunks.append(((heading + separator + piece) if heading else piece, section))
+                current, size = [], 0
+                continue
+            if size + len(block) + len(separator) > self.chunk_size and current:
+                flush()
+                overlap = []
+                if not is_heading:
+                    # whole trailing blocks as overlap, after the heading of the section
+                    for previous in reversed(current):
+                        if sum(len(b) for b in overlap) + len(previous) > self.chunk_overlap:
+                            break
+                        overlap.insert(0, previous)
+                    heading = _heading_line(section)
+                    if heading and (not overlap or overlap[0] != heading):
+                        overlap = [heading] + [b for b in overlap if b != heading]
+                current, size, chunk_section = overlap, sum(len(b) + len(separator) for b in overlap), section
+            if not current:
+                chunk_section = section
+            current.append(block)
+            size += len(block) + len(separator)
+        flush()
+        return chunks
+
+    def split_documents(self, documents):
+        chunks = []
+        duplicates = 0
+        for document in documents:
+            markdown = _is_markdown(document)
+            for text, section in self.split_text(document.page_content, markdown):
+                if self.deduplicator is not None and self.deduplicator.seen(text):
+                    duplicates += 1
+                    continue
+                metadata = dict(document.metadata)
+                if section:
+                    metadata["section"] = " > ".join(h for h in section if h)
+                chunks.append(Document(page_content=text, metadata=metadata))
+        if duplicates:
+            self.duplicates += duplicates
+            tracing.count("chunks.duplicate", duplicates)
+        return chunks
+
+
+def _heading_line(section):
+    if not section:
+        return None
+    return "#" * len(section) + " " + section[-1]
@@ -0,0 +1,108 @@
+import hashlib
+import httpx
+import gateway
+from datetime import datetime
+from caching import TTLCache
+
+
+def key_fingerprint(api_key):
+    """Short, non-reversible id of an api key, safe to use in cache keys and logs."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16] if api_key else None
+
+
+def _close_client(key, entry):
+    _, http_clients = entry
+    for http_client in http_clients:
+        http_client.close()
+
+
+# one chat model (and its keep-alive connection pool) per provider/model/key/endpoint,
+# closed once it has not been used for 15 minutes; one dropped to make room
+# may still be streaming or held by an agent, its pool is left to the gc
+_chat_models = TTLCache(max_entries=256, idle_ttl=900, on_expire=_close_client)
+_fallback_models = TTLCache(max_entries=64, idle_ttl=900)
+_openai_models = TTLCache(max_entries=1024, ttl=600)
+
+
+def _http_client():
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=10, keepalive_expiry=60),
+        timeout=httpx.Timeout(60, connect=10)
+    )
+
+
+def _create_chat_model(provider, model, api_key, base_url):
+    llm, http_clients = _create_provider_model(provider, model, api_key, base_url)
+    # requests of all sessions share the backend's limits, see gateway.py
+    backend = gateway.get_backend(provider, base_url, key_fingerprint(api_key))
+    return gateway.GatewayChatModel(llm=llm, backend=backend), http_clients
+
+
+def _create_provider_model(provider, model, api_key, base_url):
+    # providers are imported on first use, only the selected one gets loaded
+    if provider == "ollama":
+        from langchain_community.chat_models import ChatOllama
+
+        # ChatOllama posts through requests itself, there is no pool to hand over
+        return ChatOllama(model=model, base_url=base_url), []
+    if provider == "openai":
+        from langchain_openai import ChatOpenAI
+
+        http_client = _http_client()
+        llm = ChatOpenAI(
+            model_name=model,
+            temperature=0,
+            streaming=True,
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client
+        )
+        return llm, [http_client]
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+def get_chat_model(provider, model, api_key=None, base_url=None, fallback=None):
+    """Shared chat model for (provider, model, key fingerprint, base_url).
+
+    Models are stateless between calls, so every session using the same
+    backend reuses one client and its pooled keep-alive connections. They are
+    wrapped in a gateway.GatewayChatModel that limits and coalesces requests.
+
+    Args:
+        fallback (tuple): (provider, model, api_key, base_url) of the model
+            requests overflow to, see gateway.with_fallback
+    """
+    _chat_models.evict_expired()
+    key = (provider, model, key_fingerprint(api_key), base_url)
+    llm, _ = _chat_models.get_or_create(key, lambda: _create_chat_model(provider, model, api_key, base_url))
+    if fallback is None:
+        return llm
+
+    # the same object on every call, pages key their agents by it
+    fallback_llm = get_chat_model(*fallback)
+    fallback_key = (key, fallback[:2] + (key_fingerprint(fallback[2]),) + tuple(fallback[3:]), gateway.FALLBACK_QUEUE_DEPTH)
+    combined = _fallback_models.get(fallback_key)
+    if combined is None or combined.llm is not llm.llm or combined.fallback is not fallback_llm:
+        # either model was replaced since, e.g. after its client expired
+        combined = gateway.with_fallback(llm, fallback_llm)
+        _fallback_models.set(fallback_key, combined)
+    return combined
+
+
+def list_openai_models(api_key):
+    """GPT model ids available to `api_key`, oldest first, cached for 10 minutes."""
+    fingerprint = key_fingerprint(api_key)
+    models = _openai_models.get(fingerprint)
+    if models is None:
+        import openai
+
+        http_client = _http_client()
+        try:
+            client = openai.OpenAI(api_key=api_key, http_client=http_client)
+            available_models = [{"id": i.id, "created":datetime.fromtimestamp(i.created)} for i in client.models.list() if str(i.id).startswith("gpt")]
+        finally:
+            http_client.close()
+        available_models = sorted(available_models, key=lambda x: x["created"])
+        models = [i["id"] for i in available_models]
+        _openai_models.set(fingerprint, models)
+    return models
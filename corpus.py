@@ -0,0 +1,290 @@
+"""Named document corpora, ingested once and loaded by every session.
+
+A corpus is a folder in CORPORA_DIR (default .cache/corpora):
+
+    <name>/manifest.json      chunking settings, embedding model, vector dtype
+                              and per source its sha256, size, mtime, chunks
+    <name>/segments/<key>/    one saved NumpyVectorStore per source
+
+Build or update it offline with this module's CLI; sources whose content and
+settings are unchanged keep their segment and are not parsed or embedded
+again. Pages and the server load a corpus with its segments memory-mapped,
+see chatbots.corpus_vectordb.
+
+Usage:
+    python corpus.py ingest handbook docs/ policies/*.pdf
+    python corpus.py ingest handbook docs/ --prune --chunk-size 800
+    python corpus.py list
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import numpy as np
+from vectorstore import NumpyVectorStore, SegmentedVectorStore
+
+CORPORA_DIR = os.environ.get("CORPORA_DIR", os.path.join('.cache', 'corpora'))
+SOURCE_SUFFIXES = ('.pdf', '.md', '.txt')
+MANIFEST_VERSION = 1
+
+
+def corpus_folder(name, root=None):
+    if not name or os.path.basename(name) != name or name.startswith('.'):
+        raise ValueError(f"Invalid corpus name: {name!r}")
+    return os.path.join(root or CORPORA_DIR, name)
+
+
+def list_corpora(root=None):
+    root = root or CORPORA_DIR
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.exists(os.path.join(root, name, 'manifest.json')))
+
+
+def read_manifest(name, root=None):
+    """Manifest of corpus `name`, or None when it was never ingested."""
+    try:
+        with open(os.path.join(corpus_folder(name, root), 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(folder, manifest):
+    # replaced atomically, loaders never see a half written manifest
+    tmp_path = os.path.join(folder, f'manifest.json.tmp-{os.getpid()}')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(folder, 'manifest.json'))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _segment_key(sha256, settings):
+    return hashlib.sha256(json.dumps([sha256, settings], sort_keys=True).encode()).hexdigest()[:32]
+
+
+def find_sources(paths):
+    """Files to ingest under `paths`, as paths relative to the working directory."""
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                sources.extend(os.path.join(folder, f) for f in sorted(files) if f.lower().endswith(SOURCE_SUFFIXES))
+        elif os.path.isfile(path):
+            sources.append(path)
+        else:
+            raise FileNotFoundError(path)
+    return list(dict.fromkeys(os.path.relpath(source) for source in sources))
+
+
+def _ingest_texts(sources, make_splitter, vectordbs):
+    from langchain_core.documents import Document
+
+    errors = {}
+    for source in sources:
+        try:
+            with open(source, encoding='utf-8', errors='replace') as f:
+                docs = [Document(page_content=f.read(), metadata={"source": source})]
+            chunks = make_splitter().split_documents(docs)
+            if chunks:
+                vectors = vectordbs[source].embeddings.embed_documents([c.page_content for c in chunks])
+                vectordbs[source].add_vectors(vectors, chunks)
+        except Exception as e:
+            errors[source] = str(e)
+    return errors
+
+
+def ingest(name, paths, embedding, model_name, chunk_size, chunk_overlap, dtype="float32", dedup_threshold=0.8,
+           prune=False, rehash=False, batch_files=16, root=None, on_source=None):
+    """Add new and changed files under `paths` to corpus `name`.
+
+    A source is skipped when the manifest already has it with the same
+    content (sha256, trusted while size and mtime match unless `rehash`) and
+    the corpus settings are unchanged. Changing a setting re-ingests every
+    source. PDFs are parsed in the ingestion process pool, `batch_files` at a
+    time, and the manifest is saved after every batch so an interrupted run
+    resumes where it stopped. Chunks repeating one seen earlier in the same
+    source are dropped, see chunking.StructuredSplitter.
+
+    Args:
+        prune (bool): drop sources of the manifest that are not under `paths`
+        on_source (callable): called as on_source(source, status) with status
+            "unchanged", "added", "updated", "removed" or the error message
+
+    Returns:
+        dict: the saved manifest
+    """
+    from ingestion import ingest_pdfs
+    from chunking import CHUNKER_VERSION, StructuredSplitter
+
+    folder = corpus_folder(name, root)
+    os.makedirs(os.path.join(folder, 'segments'), exist_ok=True)
+    settings = {"embedding_model": model_name, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "dtype": dtype,
+                "chunker": CHUNKER_VERSION, "dedup_threshold": dedup_threshold}
+    previous = read_manifest(name, root) or {"sources": {}}
+    manifest = {"version": MANIFEST_VERSION, "name": name, **settings, "sources": {}}
+    on_source = on_source or (lambda source, status: None)
+
+    sources = find_sources(paths)
+    # sources kept as they are, or in a previous manifest but not under `paths`
+    for source, entry in previous["sources"].items():
+        if source not in sources and not prune:
+            manifest["sources"][source] = entry
+
+    todo = {}
+    for source in sources:
+        stat = os.stat(source)
+        entry = previous["sources"].get(source)
+        unchanged_file = entry and not rehash and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+        sha256 = entry["sha256"] if unchanged_file else _sha256(source)
+        key = _segment_key(sha256, settings)
+        new_entry = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "segment": key}
+        if entry and entry["segment"] == key and os.path.exists(os.path.join(folder, 'segments', key)):
+            manifest["sources"][source] = {**entry, **new_entry}
+            on_source(source, "unchanged")
+        elif os.path.exists(os.path.join(folder, 'segments', key)):
+            # saved by an interrupted run, or the same content under another path
+            chunks = len(np.load(os.path.join(folder, 'segments', key, 'ids.npy'), mmap_mode='r'))
+            manifest["sources"][source] = {**new_entry, "chunks": chunks, "ingested": time.time()}
+            on_source(source, "updated" if entry else "added")
+        else:
+            todo[source] = (new_entry, "updated" if entry else "added")
+
+    def make_splitter():
+        return StructuredSplitter(chunk_size, chunk_overlap, dedup_threshold)
+
+    todo_sources = list(todo)
+    for start in range(0, len(todo_sources), batch_files):
+        batch = todo_sources[start:start + batch_files]
+        vectordbs = {source: NumpyVectorStore(embedding, dtype=dtype) for source in batch}
+        pdfs = [s for s in batch if s.lower().endswith('.pdf')]
+        errors = {}
+        if pdfs:
+            files = {}
+            for source in pdfs:
+                with open(source, 'rb') as f:
+                    files[source] = (source, f.read())
+            errors.update(ingest_pdfs(files, make_splitter, vectordbs))
+        errors.update(_ingest_texts([s for s in batch if s not in pdfs], make_splitter, vectordbs))
+
+        for source in batch:
+            if source in errors:
+                # a file that can't be read anymore keeps its last good segment
+                if source in previous["sources"]:
+                    manifest["sources"][source] = previous["sources"][source]
+                on_source(source, errors[source])
+                continue
+            entry, status = todo[source]
+            segment_folder = os.path.join(folder, 'segments', entry["segment"])
+            if not os.path.exists(segment_folder):
+                vectordbs[source].save(segment_folder)
+            manifest["sources"][source] = {**entry, "chunks": len(vectordbs[source]), "ingested": time.time()}
+            on_source(source, status)
+        # sources still to do keep their previous segment meanwhile
+        pending = {s: previous["sources"][s] for s in todo_sources[start + batch_files:] if s in previous["sources"]}
+        _write_manifest(folder, {**manifest, "sources": {**pending, **manifest["sources"]}, "updated": time.time()})
+
+    for source in previous["sources"]:
+        if source not in manifest["sources"]:
+            on_source(source, "removed")
+    manifest["updated"] = time.time()
+    _write_manifest(folder, manifest)
+
+    # segments no source points to anymore, e.g. of changed files or settings
+    in_use = {entry["segment"] for entry in manifest["sources"].values()}
+    for key in os.listdir(os.path.join(folder, 'segments')):
+        if key not in in_use:
+            shutil.rmtree(os.path.join(folder, 'segments', key), ignore_errors=True)
+    return manifest
+
+
+def load(name, embedding, model_name, root=None, load_segment=None):
+    """SegmentedVectorStore of corpus `name`, one memory-mapped segment per source.
+
+    Args:
+        model_name (str): model the caller embeds queries with, must be
+            the one the corpus was embedded with
+        load_segment (callable): called as load_segment(folder) to open a
+            segment, e.g. through a cache shared with other corpora
+    """
+    manifest = read_manifest(name, root)
+    if manifest is None:
+        raise ValueError(f"Unknown corpus: {name}")
+    if manifest["embedding_model"] != model_name:
+        raise ValueError(f"Corpus {name} was embedded with {manifest['embedding_model']}, ingest it again with {model_name}")
+    folder = corpus_folder(name, root)
+    load_segment = load_segment or (lambda segment_folder: NumpyVectorStore.load(segment_folder, embedding))
+    vectordb = SegmentedVectorStore(embedding)
+    for source, entry in manifest["sources"].items():
+        if entry.get("chunks"):
+            vectordb.add_segment(source, load_segment(os.path.join(folder, 'segments', entry["segment"])))
+    return vectordb
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default=CORPORA_DIR, help="folder holding the corpora")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help="add new and changed files to a corpus")
+    ingest_parser.add_argument('name')
+    ingest_parser.add_argument('paths', nargs='+', help=f"files or folders, folders are searched for {', '.join(SOURCE_SUFFIXES)}")
+    ingest_parser.add_argument('--chunk-size', type=int, help="defaults to the corpus' setting, else chatbots.CHUNK_SIZE")
+    ingest_parser.add_argument('--chunk-overlap', type=int)
+    ingest_parser.add_argument('--dtype', choices=["float32", "float16", "int8"])
+    ingest_parser.add_argument('--dedup-threshold', type=float, help="similarity from which a chunk counts as a repeat, 0 keeps all")
+    ingest_parser.add_argument('--prune', action='store_true', help="drop sources that are not under paths")
+    ingest_parser.add_argument('--rehash', action='store_true', help="hash every file, even if size and mtime are unchanged")
+    commands.add_parser('list', help="show the corpora and their sources")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name in list_corpora(args.root):
+            manifest = read_manifest(name, args.root)
+            chunks = sum(entry.get("chunks", 0) for entry in manifest["sources"].values())
+            print(f"{name}: {len(manifest['sources'])} sources, {chunks} chunks, {manifest['embedding_model']}, "
+                  f"chunk size {manifest['chunk_size']}/{manifest['chunk_overlap']}, {manifest['dtype']}, "
+                  f"dedup {manifest.get('dedup_threshold') or 'off'}")
+        return
+
+    import chatbots
+
+    previous = read_manifest(args.name, args.root) or {}
+    statuses = {}
+
+    def on_source(source, status):
+        statuses[source] = status
+        print(f"  {status:<10} {source}" if status in ("unchanged", "added", "updated", "removed") else f"  failed     {source}: {status}")
+
+    start = time.perf_counter()
+    ingest(
+        args.name, args.paths, chatbots.embedding_model(), chatbots.EMBEDDING_MODEL,
+        chunk_size=args.chunk_size or previous.get("chunk_size", chatbots.CHUNK_SIZE),
+        chunk_overlap=args.chunk_overlap if args.chunk_overlap is not None else previous.get("chunk_overlap", chatbots.CHUNK_OVERLAP),
+        dtype=args.dtype or previous.get("dtype", chatbots.VECTOR_DTYPE),
+        dedup_threshold=(args.dedup_threshold if args.dedup_threshold is not None
+                         else previous.get("dedup_threshold", chatbots.DEDUP_THRESHOLD)) or None,
+        prune=args.prune, rehash=args.rehash, root=args.root, on_source=on_source
+    )
+    failed = [s for s, status in statuses.items() if status not in ("unchanged", "added", "updated", "removed")]
+    counts = {status: sum(1 for s in statuses.values() if s == status) for status in ("added", "updated", "unchanged", "removed")}
+    print(f"{args.name}: " + ", ".join(f"{n} {status}" for status, n in counts.items()) + f", {len(failed)} failed "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    import ingestion
+    ingestion.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import os
+import time
+import queue
+import sqlite3
+import hashlib
+import tracing
+import contextlib
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """Embedding model wrapper with a persistent, content addressed cache.
+
+    Vectors are keyed by (model name, sha256 of the chunk text). Metadata lives
+    in SQLite and the vectors in a memory-mapped float32 matrix with one row per
+    entry. Only cache misses are sent to the wrapped model, in batches. Once the
+    cache holds `max_entries` vectors, the least recently used rows are reused.
+    """
+
+    def __init__(self, embeddings, model_name, cache_dir='.cache/embeddings', max_entries=200_000, batch_size=256):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+
+        self.folder = os.path.join(cache_dir, model_name.replace('/', '__'))
+        os.makedirs(self.folder, exist_ok=True)
+        self._lock = threading.Lock()
+        # the cache is shared with other processes (app, server.py, corpus.py),
+        # rows are allocated and read in BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(os.path.join(self.folder, 'index.db'), timeout=30,
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._transaction():
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, row INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)")
+        self._matrix = None
+        with self._transaction():
+            self._open_matrix()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # takes the database write lock, so no other process allocates or evicts rows meanwhile
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _open_matrix(self, dim=None):
+        matrix_path = os.path.join(self.folder, 'vectors.f32')
+        stored_dim = self._get_meta('dim')
+        stored_capacity = self._get_meta('capacity')
+        if stored_dim is None:
+            if dim is None:
+                return
+        elif stored_capacity == str(self.max_entries) and os.path.exists(matrix_path):
+            self._matrix = np.memmap(matrix_path, dtype=np.float32, mode='r+', shape=(self.max_entries, int(stored_dim)))
+            return
+        else:
+            dim = dim or int(stored_dim)
+
+        # first use, or the cache was created with a different size - start over
+        self._conn.execute("DELETE FROM vectors")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [('model', self.model_name), ('dim', str(dim)), ('capacity', str(self.max_entries))]
+        )
+        self._matrix = np.memmap(matrix_path, dtype=np.float32, mode='w+', shape=(self.max_entries, dim))
+
+    @staticmethod
+    def _hash(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _lookup(self, hashes):
+        rows = {}
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i+500]
+            query = "SELECT hash, row FROM vectors WHERE hash IN ({})".format(','.join('?'*len(part)))
+            rows.update(self._conn.execute(query, part).fetchall())
+        if rows:
+            now = time.time()
+            self._conn.executemany("UPDATE vectors SET last_used = ? WHERE hash = ?", [(now, h) for h in rows])
+        return rows
+
+    def _store(self, hashes, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._matrix is None:
+            self._open_matrix(dim=vectors.shape[1])
+
+        # keep only what fits, the newest vectors win
+        hashes, vectors = hashes[-self.max_entries:], vectors[-self.max_entries:]
+        existing = self._lookup(hashes)
+        new_hashes = [h for h in hashes if h not in existing]
+
+        # take free rows first, then evict least recently used entries;
+        # rows in use are always 0..n-1, evicted rows are reused right away
+        size = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM vectors").fetchone()[0]
+        free = min(self.max_entries - size, len(new_hashes))
+        rows = list(range(size, size + free))
+        evict_count = len(new_hashes) - free
+        if evict_count:
+            evicted = self._conn.execute(
+                "SELECT hash, row FROM vectors ORDER BY last_used LIMIT ?", (evict_count,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM vectors WHERE hash = ?", [(h,) for h, _ in evicted])
+            rows.extend(row for _, row in evicted)
+
+        now = time.time()
+        assigned = dict(existing)
+        assigned.update(zip(new_hashes, rows))
+        for h, vector in zip(hashes, vectors):
+            self._matrix[assigned[h]] = vector
+        self._matrix.flush()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO vectors (hash, row, last_used) VALUES (?, ?, ?)",
+            [(h, assigned[h], now) for h in dict.fromkeys(hashes)]
+        )
+
+    def embed_documents(self, texts):
+        hashes = [self._hash(text) for text in texts]
+        unique = list(dict.fromkeys(hashes))
+
+        found = {}
+        with self._lock, self._transaction():
+            if self._matrix is None:
+                # another process may have created the cache since
+                self._open_matrix()
+            if self._matrix is not None:
+                for h, row in self._lookup(unique).items():
+                    found[h] = np.array(self._matrix[row])
+        missing = [h for h in unique if h not in found]
+        hits = sum(1 for h in hashes if h in found)
+        self.hits += hits
+        self.misses += len(missing)
+        tracing.count("cache.embeddings.hit", hits)
+        tracing.count("cache.embeddings.miss", len(missing))
+
+        # embed cache misses only, in batches
+        text_by_hash = dict(zip(hashes, texts))
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i+self.batch_size]
+            with tracing.span("embed", texts=len(batch)):
+                vectors = self.embeddings.embed_documents([text_by_hash[h] for h in batch])
+            with self._lock, self._transaction():
+                self._store(batch, vectors)
+            found.update(zip(batch, np.asarray(vectors, dtype=np.float32)))
+
+        return [found[h].tolist() for h in hashes]
+
+    def embed_query(self, text):
+        with tracing.span("embed.query"):
+            return self.embeddings.embed_query(text)
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+
+# embedding model of a bulk worker process, see EmbeddingService
+_worker_model = None
+
+
+def _init_worker(model_factory):
+    global _worker_model
+    _worker_model = model_factory()
+
+
+def _embed_in_worker(texts):
+    return _worker_model.embed_documents(texts)
+
+
+class EmbeddingService(Embeddings):
+    """Embedding model shared by all sessions, with micro-batched queries.
+
+    Queries submitted from any thread are collected for up to `max_wait`
+    seconds, or until `max_batch_size` are waiting, and embedded in one call.
+    Document batches (ingestion) run on a pool of `bulk_workers` threads, or
+    processes when `use_processes` is set; every process then loads its own
+    model with `model_factory()`, which has to be picklable.
+
+    `submit_query` and `submit_documents` return futures, `embed_query` and
+    `embed_documents` wait for them.
+    """
+
+    def __init__(self, embeddings, max_batch_size=64, max_wait=0.005, bulk_workers=2,
+                 use_processes=False, model_factory=None):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._batch_sizes = deque(maxlen=1000)
+        self._latencies = deque(maxlen=1000)
+        self._stats_lock = threading.Lock()
+        if use_processes:
+            self._bulk = ProcessPoolExecutor(bulk_workers, initializer=_init_worker, initargs=(model_factory,))
+        else:
+            self._bulk = ThreadPoolExecutor(bulk_workers, thread_name_prefix="embedding-bulk")
+        self._use_processes = use_processes
+        self._worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+        self._worker.start()
+
+    def submit_query(self, text):
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def submit_documents(self, texts):
+        if self._use_processes:
+            return self._bulk.submit(_embed_in_worker, list(texts))
+        return self._bulk.submit(self.embeddings.embed_documents, list(texts))
+
+    def embed_query(self, text):
+        return self.submit_query(text).result()
+
+    def embed_documents(self, texts):
+        return self.submit_documents(texts).result()
+
+    def _embed_queries(self, texts):
+        model = getattr(self.embeddings, "model", None)
+        if hasattr(model, "query_embed"):
+            # FastEmbed embeds a list of queries in one call
+            return [vector.tolist() for vector in model.query_embed(texts)]
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                vectors = self._embed_queries([text for text, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            now = time.perf_counter()
+            for (_, future, submitted), vector in zip(batch, vectors):
+                future.set_result(vector)
+            with self._stats_lock:
+                self._batch_sizes.append(len(batch))
+                self._latencies.extend(now - submitted for _, _, submitted in batch)
+
+    def stats(self):
+        """Queue depth, query batch sizes and p50/p99 query latency (ms) over the last 1000 queries."""
+        with self._stats_lock:
+            batch_sizes = list(self._batch_sizes)
+            latencies = np.array(self._latencies) * 1000
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batches": len(batch_sizes),
+            "mean_batch_size": float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+            "max_batch_size": max(batch_sizes, default=0),
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
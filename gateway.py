@@ -0,0 +1,324 @@
+"""Admission control in front of the shared LLM backends.
+
+Every chat model from clients.get_chat_model is wrapped in a GatewayChatModel
+tied to the Backend of its provider, endpoint and key, shared by all sessions:
+
+- at most `max_concurrent` requests run on a backend, `max_waiting` more
+  queue for a slot and the rest are rejected with GatewayOverloaded
+- requests are started at most at `rate` per second (token bucket)
+- identical requests in flight are sent once, every caller gets the answer,
+  streamed tokens included
+- rate limit, server and connection errors are retried with jittered
+  exponential backoff, as long as no token was streamed yet
+- a model given a fallback (`with_fallback`) sends requests there while
+  `fallback_queue_depth` requests already wait for its own backend
+
+Limits are read from the environment per provider, e.g. LLM_MAX_CONCURRENT_OLLAMA,
+LLM_RATE_OPENAI (requests per second), LLM_MAX_WAITING_OPENAI. Set
+LLM_FALLBACK_QUEUE_DEPTH to let Ollama overflow to OpenAI.
+"""
+import os
+import copy
+import json
+import time
+import random
+import hashlib
+import tracing
+import weakref
+import threading
+from typing import Any, Optional
+from contextlib import contextmanager
+from streamlit.logger import get_logger
+from chat_wrappers import WrappedChatModel, replay_tokens
+from langchain_core.language_models.chat_models import BaseChatModel
+
+logger = get_logger('Langchain-Chatbot')
+
+# status codes worth another try, as sent by OpenAI and Ollama
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRY_ERRORS = {"APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+                 "ConnectError", "ConnectTimeout", "ReadTimeout", "RemoteProtocolError"}
+
+_DEFAULT_LIMITS = {
+    "openai": {"max_concurrent": 16, "rate": 8.0, "max_waiting": 256},
+    "ollama": {"max_concurrent": 2, "rate": None, "max_waiting": 32},
+}
+FALLBACK_QUEUE_DEPTH = int(os.environ["LLM_FALLBACK_QUEUE_DEPTH"]) if os.environ.get("LLM_FALLBACK_QUEUE_DEPTH") else None
+
+
+class GatewayOverloaded(RuntimeError):
+    """Raised when a backend's queue is full or a request waited too long for a slot."""
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average and bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting for it at most `timeout` seconds; False if it didn't come."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+class Backend:
+    """Concurrency, rate and queue limits of one LLM backend, shared by all its models."""
+
+    def __init__(self, name, max_concurrent=8, rate=None, burst=None, max_waiting=64, queue_timeout=120,
+                 max_retries=3, backoff_base=0.5, backoff_cap=20):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.waiting = 0
+        self.running = 0
+        self.counters = dict.fromkeys(("requests", "coalesced", "retries", "rejected", "fallbacks"), 0)
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+        tracing.count(f"gateway.{name}")
+
+    @contextmanager
+    def slot(self):
+        """Wait for a free slot and a rate token, or raise GatewayOverloaded."""
+        with self._lock:
+            full = self.waiting >= self.max_waiting
+            if not full:
+                self.waiting += 1
+        if full:
+            self.count("rejected")
+            raise GatewayOverloaded(f"Too many requests waiting for {self.name}")
+        try:
+            with tracing.span("gateway.queue", backend=self.name):
+                deadline = time.monotonic() + self.queue_timeout
+                if not self._slots.acquire(timeout=self.queue_timeout):
+                    self.count("rejected")
+                    raise GatewayOverloaded(f"No free slot on {self.name} after {self.queue_timeout}s")
+                if self._bucket and not self._bucket.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                    self._slots.release()
+                    self.count("rejected")
+                    raise GatewayOverloaded(f"Rate limit of {self.name} exceeded for {self.queue_timeout}s")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        with self._lock:
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._slots.release()
+
+    def backoff(self, attempt):
+        # full jitter, so clients rejected together don't retry together
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def join(self, key):
+        """(flight, leader) for request `key`; the leader sends it, the others wait for its answer."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        self.count("requests" if leader else "coalesced")
+        return flight, leader
+
+    def land(self, key, flight, result=None, error=None):
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.finish(result, error)
+
+    def stats(self):
+        with self._lock:
+            return {"name": self.name, "running": self.running, "waiting": self.waiting,
+                    "max_concurrent": self.max_concurrent, **self.counters}
+
+
+class _Flight:
+    """One request in flight: its streamed tokens so far and, once done, its result."""
+
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self._cond = threading.Condition()
+
+    def add_token(self, token):
+        with self._cond:
+            self.tokens.append(token)
+            self._cond.notify_all()
+
+    def finish(self, result, error):
+        with self._cond:
+            self.result, self.error, self.done = result, error, True
+            self._cond.notify_all()
+
+    def follow(self, on_token):
+        """Pass the tokens to `on_token` as they arrive, then return the result."""
+        sent = 0
+        while True:
+            with self._cond:
+                while sent >= len(self.tokens) and not self.done:
+                    self._cond.wait()
+                tokens, done = self.tokens[sent:], self.done
+            for token in tokens:
+                on_token(token)
+            sent += len(tokens)
+            if done and sent >= len(self.tokens):
+                break
+        if self.error is not None:
+            raise self.error
+        # every caller's run sets its own ids and metadata on the messages
+        return copy.deepcopy(self.result)
+
+
+class _TeeRunManager:
+    """Run manager that also hands the streamed tokens to the callers waiting on a flight."""
+
+    def __init__(self, run_manager, flight):
+        self._run_manager = run_manager
+        self._flight = flight
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._flight.add_token(token)
+        self._run_manager.on_llm_new_token(token, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._run_manager, name)
+
+
+def is_retryable(error):
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status in RETRY_STATUS or type(error).__name__ in _RETRY_ERRORS or isinstance(error, (ConnectionError, TimeoutError))
+
+
+class GatewayChatModel(WrappedChatModel):
+    """Chat model that sends `llm`'s requests through `backend`, see the module docstring."""
+
+    backend: Any
+    fallback: Optional[BaseChatModel] = None
+    fallback_queue_depth: Optional[int] = None
+
+    def bind_tools(self, tools, **kwargs):
+        # tools in the wrapped model's format, passed through as request kwargs
+        return self.bind(**self.llm.bind_tools(tools, **kwargs).kwargs)
+
+    def _request_key(self, messages, stop, kwargs):
+        request = [self.llm._get_llm_string(stop=stop, **kwargs),
+                   [m.model_dump(exclude={"id"}) for m in messages], sorted(kwargs)]
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _overflowing(self, kwargs):
+        return self.fallback is not None and self.fallback_queue_depth is not None and "tools" not in kwargs \
+            and self.backend.waiting >= self.fallback_queue_depth
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self._request_key(messages, stop, kwargs)
+        flight, leader = self.backend.join(key)
+        if not leader:
+            on_token = run_manager.on_llm_new_token if run_manager else (lambda token: None)
+            return flight.follow(on_token)
+
+        tee = _TeeRunManager(run_manager, flight) if run_manager else None
+        result, error = None, None
+        try:
+            if self._overflowing(kwargs):
+                self.backend.count("fallbacks")
+                logger.debug(f"{self.backend.name} has {self.backend.waiting} requests waiting, using the fallback model")
+                result = self.fallback._generate(messages, stop=stop, run_manager=tee, **kwargs)
+            else:
+                result = self._send(messages, stop, tee, flight, kwargs)
+            if tee is None and len(result.generations) == 1 and isinstance(result.generations[0].message.content, str):
+                # nobody streamed, let the followers replay the answer
+                for token in replay_tokens(result.generations[0].message.content):
+                    flight.add_token(token)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.backend.land(key, flight, result, error)
+        return result
+
+    def _send(self, messages, stop, run_manager, flight, kwargs):
+        attempt = 0
+        while True:
+            try:
+                with self.backend.slot():
+                    return self.llm._generate_with_cache(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except GatewayOverloaded:
+                raise
+            except Exception as e:
+                # a partly streamed answer can't be taken back
+                if attempt >= self.backend.max_retries or flight.tokens or not is_retryable(e):
+                    raise
+                delay = self.backend.backoff(attempt)
+                attempt += 1
+                self.backend.count("retries")
+                logger.warning(f"{self.backend.name} failed with {type(e).__name__}, retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+
+
+def _limits(provider):
+    limits = dict(_DEFAULT_LIMITS.get(provider, {"max_concurrent": 8, "rate": None, "max_waiting": 64}))
+    suffix = provider.upper()
+    if os.environ.get(f"LLM_MAX_CONCURRENT_{suffix}"):
+        limits["max_concurrent"] = int(os.environ[f"LLM_MAX_CONCURRENT_{suffix}"])
+    if os.environ.get(f"LLM_RATE_{suffix}"):
+        limits["rate"] = float(os.environ[f"LLM_RATE_{suffix}"]) or None
+    if os.environ.get(f"LLM_MAX_WAITING_{suffix}"):
+        limits["max_waiting"] = int(os.environ[f"LLM_MAX_WAITING_{suffix}"])
+    return limits
+
+
+# a backend lives as long as a model using it, so user keys don't pile up
+_backends = weakref.WeakValueDictionary()
+_backends_lock = threading.Lock()
+
+
+def get_backend(provider, base_url=None, key_fingerprint=None):
+    """Backend shared by every model of `provider` on `base_url` with the same key."""
+    name = ":".join(part for part in (provider, base_url, key_fingerprint) if part)
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            backend = _backends[name] = Backend(name, **_limits(provider))
+        return backend
+
+
+def backend_stats():
+    with _backends_lock:
+        backends = list(_backends.values())
+    return [backend.stats() for backend in backends]
+
+
+def with_fallback(llm, fallback, queue_depth=None):
+    """Copy of gateway model `llm` that overflows to `fallback` once its queue is `queue_depth` deep."""
+    queue_depth = queue_depth if queue_depth is not None else FALLBACK_QUEUE_DEPTH
+    return llm.model_copy(update={"fallback": fallback, "fallback_queue_depth": queue_depth})
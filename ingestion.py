@@ -0,0 +1,208 @@
+import os
+import io
+import tracing
+import threading
+import traceback
+from pypdf import PdfReader
+from multiprocessing import shared_memory
+from langchain_core.documents import Document
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+        return _executor
+
+
+def _reset_executor(broken):
+    # a worker died, every later task would fail on the old pool
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False)
+
+
+def shutdown():
+    """Stop the PDF parsing processes, e.g. at the end of a script."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def _read_pdf(shm_name, size):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+
+def count_pages(shm_name, size):
+    return len(PdfReader(io.BytesIO(_read_pdf(shm_name, size))).pages)
+
+
+def extract_pages(shm_name, size, start, stop):
+    """Extract the text of pages [start, stop) of a PDF held in shared memory."""
+    reader = PdfReader(io.BytesIO(_read_pdf(shm_name, size)))
+    return [(page_num, reader.pages[page_num].extract_text()) for page_num in range(start, stop)]
+
+
+def _add_batch(vectordbs, chunks):
+    # embed the (key, chunk) batch at once, then hand each file its own chunks
+    vectors = next(iter(vectordbs.values())).embeddings.embed_documents([c.page_content for _, c in chunks])
+    for key in dict.fromkeys(key for key, _ in chunks):
+        own = [i for i, (k, _) in enumerate(chunks) if k == key]
+        vectordbs[key].add_vectors([vectors[i] for i in own], [chunks[i][1] for i in own])
+
+
+def _timed(iterator, span_name):
+    # time spent waiting for each item, e.g. for the pool to finish parsing
+    while True:
+        with tracing.span(span_name):
+            item = next(iterator, None)
+        if item is None:
+            return
+        yield item
+
+
+def _run_tasks(tasks, errors):
+    """Run (key, fn, args) tasks on the pool and yield (key, result, error) as they finish.
+
+    When a worker dies, e.g. in a PDF that crashes the parser, the pool is
+    rebuilt and the tasks that were still pending run again one at a time, so
+    only the file that kills a worker fails. Tasks of keys in `errors` are not
+    run again.
+    """
+    executor = get_executor()
+    futures = {executor.submit(fn, *args): (key, fn, args) for key, fn, args in tasks}
+    suspects = []
+    for future in as_completed(futures):
+        key, fn, args = futures[future]
+        try:
+            result, error = future.result(), None
+        except BrokenProcessPool:
+            suspects.append((key, fn, args))
+            continue
+        except Exception as e:
+            result, error = None, e
+        yield key, result, error
+
+    if suspects:
+        _reset_executor(executor)
+    for key, fn, args in suspects:
+        if key in errors:
+            continue
+        executor = get_executor()
+        try:
+            result, error = executor.submit(fn, *args).result(), None
+        except BrokenProcessPool:
+            _reset_executor(executor)
+            result, error = None, RuntimeError("the PDF parser crashed on this file")
+        except Exception as e:
+            result, error = None, e
+        yield key, result, error
+
+
+def ingest_pdfs(files, make_splitter, vectordbs, pages_per_task=25, max_pages=None, batch_size=64,
+                on_progress=None, on_truncated=None):
+    """Parse PDFs in a process pool and stream their chunks into per-file stores.
+
+    Each file is split into page ranges that are parsed in parallel, with the
+    ranges of all files interleaved so one huge upload does not hold up the
+    others. Pages are split and embedded in batches as soon as they arrive. A
+    file that can't be parsed, or crashes the parser, fails alone.
+
+    Args:
+        files (dict): key -> (filename, pdf bytes); files are told apart by
+            key, the filename is only their chunks' "source"
+        make_splitter (callable): returns the splitter applied to every page of
+            one file, e.g. chatbots.text_splitter
+        vectordbs (dict): key -> NumpyVectorStore the file's chunks are added to
+        pages_per_task (int): pages parsed per process pool task
+        max_pages (int): pages read per file, None reads all
+        batch_size (int): chunks embedded per batch
+        on_progress (callable): called as on_progress(key, pages_done, total_pages)
+        on_truncated (callable): called as on_truncated(key, total_pages) for
+            files with more than `max_pages` pages, of which the rest is skipped
+
+    Returns:
+        dict: key -> error message for files that could not be read
+    """
+    errors = {}
+    buffers = {}
+    try:
+        # one shared memory block per file, so page ranges don't copy the whole PDF
+        for key, (_, data) in files.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+            buffers[key] = (shm, len(data))
+            shm.buf[:len(data)] = data
+
+        page_counts = {}
+        tasks = [(key, count_pages, (shm.name, size)) for key, (shm, size) in buffers.items()]
+        for key, total, error in _timed(_run_tasks(tasks, errors), "load.pdf"):
+            if error is not None:
+                traceback.print_exception(error)
+                errors[key] = str(error)
+                continue
+            page_counts[key] = total if max_pages is None else min(total, max_pages)
+            if total > page_counts[key] and on_truncated:
+                on_truncated(key, total)
+
+        # round-robin the page ranges of all files
+        ranges = {key: [(s, min(s + pages_per_task, n)) for s in range(0, n, pages_per_task)] for key, n in page_counts.items()}
+        tasks = []
+        while any(ranges.values()):
+            for key in ranges:
+                if ranges[key]:
+                    start, stop = ranges[key].pop(0)
+                    shm, size = buffers[key]
+                    tasks.append((key, extract_pages, (shm.name, size, start, stop)))
+
+        pages_done = dict.fromkeys(page_counts, 0)
+        for key, total in page_counts.items():
+            if on_progress:
+                on_progress(key, 0, total)
+
+        splitters = {}
+        pending = []
+        for key, pages, error in _timed(_run_tasks(tasks, errors), "load.pdf"):
+            if key in errors:
+                continue
+            if error is not None:
+                traceback.print_exception(error)
+                errors[key] = str(error)
+                continue
+
+            filename = files[key][0]
+            docs = [Document(page_content=text, metadata={"source": filename, "page": page_num}) for page_num, text in pages]
+            with tracing.span("split"):
+                if key not in splitters:
+                    splitters[key] = make_splitter()
+                pending.extend((key, chunk) for chunk in splitters[key].split_documents(docs))
+            while len(pending) >= batch_size:
+                _add_batch(vectordbs, pending[:batch_size])
+                pending = pending[batch_size:]
+
+            pages_done[key] += len(pages)
+            if on_progress:
+                on_progress(key, pages_done[key], page_counts[key])
+
+        # chunks of files that failed later on are dropped with them
+        pending = [(key, chunk) for key, chunk in pending if key not in errors]
+        if pending:
+            _add_batch(vectordbs, pending)
+    finally:
+        for shm, _ in buffers.values():
+            shm.close()
+            shm.unlink()
+    return errors
@@ -0,0 +1,125 @@
+import os
+import re
+import json
+import numpy as np
+from collections import Counter
+
+# words, also keeping codes like "e-1042", "v2.3.1" or "part_no" in one token
+_TOKEN = re.compile(r"\w(?:[\w.\-]*\w)?")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """Compact inverted index of a list of texts for BM25 scoring.
+
+    Postings are stored term by term in flat numpy arrays (CSR layout): the
+    documents containing term `t` are `doc_ids[offsets[t]:offsets[t + 1]]` with
+    their term frequencies in `term_freqs`. Saved indexes are memory-mapped.
+    """
+
+    def __init__(self, terms, offsets, doc_ids, term_freqs, doc_lengths):
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @property
+    def total_length(self):
+        return int(self.doc_lengths.sum())
+
+    @classmethod
+    def from_texts(cls, texts):
+        counts = [Counter(tokenize(text)) for text in texts]
+        terms = sorted(set().union(*counts)) if counts else []
+        term_ids = {term: i for i, term in enumerate(terms)}
+        size = sum(len(c) for c in counts)
+        term_index = np.empty(size, dtype=np.int32)
+        doc_ids = np.empty(size, dtype=np.int32)
+        term_freqs = np.empty(size, dtype=np.float32)
+        position = 0
+        for doc_id, doc_counts in enumerate(counts):
+            n = len(doc_counts)
+            term_index[position:position + n] = [term_ids[t] for t in doc_counts]
+            doc_ids[position:position + n] = doc_id
+            term_freqs[position:position + n] = list(doc_counts.values())
+            position += n
+
+        # group postings by term, documents stay in order within a term
+        order = np.argsort(term_index, kind='stable')
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_index, minlength=len(terms)), out=offsets[1:])
+        doc_lengths = np.array([sum(c.values()) for c in counts], dtype=np.int32)
+        return cls(terms, offsets, doc_ids[order], term_freqs[order], doc_lengths)
+
+    def document_frequency(self, term):
+        t = self.term_ids.get(term)
+        return 0 if t is None else int(self.offsets[t + 1] - self.offsets[t])
+
+    def postings(self, term):
+        t = self.term_ids.get(term)
+        if t is None:
+            return None, None
+        start, stop = self.offsets[t], self.offsets[t + 1]
+        return self.doc_ids[start:stop], self.term_freqs[start:stop]
+
+    def scores(self, idf, avg_length, k1=1.5, b=0.75):
+        """BM25 score of every document, for a query given as {term: idf}.
+
+        idf and the average document length are passed in, so scores of
+        several indexes (segments) are computed with corpus wide statistics.
+        """
+        scores = np.zeros(len(self), dtype=np.float32)
+        norm = k1 * (1 - b + b * self.doc_lengths / max(avg_length, 1e-9))
+        for term, weight in idf.items():
+            docs, tf = self.postings(term)
+            if docs is None:
+                continue
+            scores[docs] += weight * tf * (k1 + 1) / (tf + norm[docs])
+        return scores
+
+    def save(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'terms.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.terms, f)
+        for name in ('offsets', 'doc_ids', 'term_freqs', 'doc_lengths'):
+            np.save(os.path.join(folder, f'{name}.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, 'terms.json'), encoding='utf-8') as f:
+            terms = json.load(f)
+        arrays = [np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r')
+                  for name in ('offsets', 'doc_ids', 'term_freqs', 'doc_lengths')]
+        return cls(terms, *arrays)
+
+
+def bm25_search(indexes, query, k):
+    """Top `k` BM25 hits of `query` over several indexes, as (score, index position, document) tuples."""
+    terms = set(tokenize(query))
+    n_docs = sum(len(index) for index in indexes)
+    if not terms or not n_docs:
+        return []
+    avg_length = sum(index.total_length for index in indexes) / n_docs
+    idf = {}
+    for term in terms:
+        df = sum(index.document_frequency(term) for index in indexes)
+        if df:
+            idf[term] = float(np.log(1 + (n_docs - df + 0.5) / (df + 0.5)))
+
+    hits = []
+    for position, index in enumerate(indexes):
+        scores = index.scores(idf, avg_length)
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        hits.extend((float(scores[i]), position, int(i)) for i in matched)
+    hits.sort(key=lambda hit: -hit[0])
+    return hits[:k]
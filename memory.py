@@ -0,0 +1,111 @@
+from pydantic import PrivateAttr
+from streamlit.logger import get_logger
+from langchain_core.caches import BaseCache  # noqa: F401, needed by model_rebuild
+from langchain_core.callbacks import Callbacks  # noqa: F401, needed by model_rebuild
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+logger = get_logger('Langchain-Chatbot')
+
+
+class TokenBudgetMemory(ConversationSummaryBufferMemory):
+    """Conversation memory that keeps the history under a token budget.
+
+    The last `keep_last_turns` turns are always kept verbatim. Older turns are
+    kept while the history fits in `max_token_limit` tokens, after that they are
+    rolled into a running summary (`summarize=True`) or dropped. Token counts
+    are computed once per message, not for the whole history on every turn.
+
+    `prompt_tokens` holds the history tokens sent with each turn's prompt.
+    """
+
+    max_token_limit: int = 2000
+    keep_last_turns: int = 3
+    summarize: bool = True
+    _token_counts: list = PrivateAttr(default_factory=list)
+    _history_tokens: int = PrivateAttr(default=0)
+    _summary_tokens: int = PrivateAttr(default=0)
+    _approximate: bool = PrivateAttr(default=False)
+    _prompt_tokens: list = PrivateAttr(default_factory=list)
+
+    def _count_tokens(self, messages):
+        if not self._approximate:
+            try:
+                return self.llm.get_num_tokens_from_messages(messages)
+            except Exception:
+                # no tokenizer for this model (or offline), estimate from now on
+                self._approximate = True
+        return sum(len(str(m.content)) // 4 + 4 for m in messages)
+
+    @property
+    def history_tokens(self):
+        """Tokens of summary plus verbatim messages that go into the next prompt."""
+        return self._history_tokens + self._summary_tokens
+
+    @property
+    def prompt_tokens(self):
+        return list(self._prompt_tokens)
+
+    def load_memory_variables(self, inputs):
+        variables = super().load_memory_variables(inputs)
+        self._prompt_tokens.append(self.history_tokens)
+        logger.info("Turn {}: {} history tokens in prompt".format(len(self._prompt_tokens), self.history_tokens))
+        return variables
+
+    def _count_new_messages(self):
+        messages = self.chat_memory.messages
+        if len(self._token_counts) > len(messages):
+            # history was changed from outside, recount
+            self._token_counts.clear()
+            self._history_tokens = 0
+        for message in messages[len(self._token_counts):]:
+            count = self._count_tokens([message])
+            self._token_counts.append(count)
+            self._history_tokens += count
+
+    def _pop_over_budget(self):
+        self._count_new_messages()
+        messages = self.chat_memory.messages
+        pruned = []
+        min_messages = 2 * self.keep_last_turns
+        while self.history_tokens > self.max_token_limit and len(messages) > min_messages:
+            # whole turns, a question without its answer is of little use
+            for _ in range(min(2, len(messages) - min_messages)):
+                pruned.append(messages.pop(0))
+                self._history_tokens -= self._token_counts.pop(0)
+        return pruned if self.summarize else []
+
+    def _set_summary(self, summary):
+        self.moving_summary_buffer = summary
+        self._summary_tokens = self._count_tokens([self.summary_message_cls(content=summary)]) if summary else 0
+
+    def prune(self):
+        pruned = self._pop_over_budget()
+        if pruned:
+            self._set_summary(self.predict_new_summary(pruned, self.moving_summary_buffer))
+
+    async def aprune(self):
+        pruned = self._pop_over_budget()
+        if pruned:
+            self._set_summary(await self.apredict_new_summary(pruned, self.moving_summary_buffer))
+
+    def to_state(self):
+        """JSON serialisable summary and messages, see `load_state`."""
+        return {"summary": self.moving_summary_buffer, "messages": messages_to_dict(self.chat_memory.messages)}
+
+    def load_state(self, state):
+        self.clear()
+        self.chat_memory.add_messages(messages_from_dict(state.get("messages", [])))
+        self._count_new_messages()
+        self._set_summary(state.get("summary", ""))
+
+    def clear(self):
+        super().clear()
+        self._token_counts.clear()
+        self._history_tokens = 0
+        self._summary_tokens = 0
+        self._prompt_tokens.clear()
+
+
+# resolve the forward references left open by langchain's memory classes
+TokenBudgetMemory.model_rebuild()
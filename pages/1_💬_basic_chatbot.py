@@ -1,9 +1,8 @@
 import utils
 import streamlit as st
+import chatbots
 from streaming import StreamHandler
 
-from langchain.chains import ConversationChain
-
 st.set_page_config(page_title="Chatbot", page_icon="💬")
 st.header('Basic Chatbot')
 st.write('Allows users to interact with the LLM')
@@ -13,10 +12,10 @@ class BasicChatbot:
 
     def __init__(self):
         utils.sync_st_session()
-        self.llm = utils.configure_llm()
+        self.llm = utils.configure_llm(response_cache=True)
     
     def setup_chain(self):
-        chain = ConversationChain(llm=self.llm, verbose=False)
+        chain = chatbots.conversation_chain(self.llm)
         return chain
     
     @utils.enable_chat_history
@@ -32,7 +31,7 @@ class BasicChatbot:
                     {"callbacks": [st_cb]}
                 )
                 response = result["response"]
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                st.session_state.messages.append("assistant", response)
                 utils.print_qa(BasicChatbot, user_query, response)
 
 if __name__ == "__main__":
@@ -1,10 +1,8 @@
 import utils
 import streamlit as st
+import chatbots
 from streaming import StreamHandler
 
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-
 st.set_page_config(page_title="Context aware chatbot", page_icon="⭐")
 st.header('Context aware chatbot')
 st.write('Enhancing Chatbot Interactions through Context Awareness')
@@ -14,12 +12,12 @@ class ContextChatbot:
 
     def __init__(self):
         utils.sync_st_session()
-        self.llm = utils.configure_llm()
+        self.llm = utils.configure_llm(response_cache=True)
     
-    @st.cache_resource
-    def setup_chain(_self):
-        memory = ConversationBufferMemory()
-        chain = ConversationChain(llm=_self.llm, memory=memory, verbose=False)
+    def setup_chain(self):
+        # memory belongs to this session, not to every user of the process
+        memory = utils.conversation_memory(self.llm, **chatbots.CHATBOTS["context"]["memory"])
+        chain = chatbots.conversation_chain(self.llm, memory)
         return chain
     
     @utils.enable_chat_history
@@ -35,7 +33,7 @@ class ContextChatbot:
                     {"callbacks": [st_cb]}
                 )
                 response = result["response"]
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                st.session_state.messages.append("assistant", response)
                 utils.print_qa(ContextChatbot, user_query, response)
 
 if __name__ == "__main__":
@@ -1,13 +1,8 @@
 import utils
+import chatbots
 import streamlit as st
 
-from langchain import hub
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain_community.tools import DuckDuckGoSearchRun
 from langchain_community.callbacks import StreamlitCallbackHandler
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain_core.tools import Tool
 
 st.set_page_config(page_title="ChatNet", page_icon="🌐")
 st.header('Chatbot with Internet Access')
@@ -20,41 +15,27 @@ class InternetChatbot:
         utils.sync_st_session()
         self.llm = utils.configure_llm()
 
-    # @st.cache_resource(show_spinner='Connecting..')
-    def setup_agent(_self):
-        # Define tool
-        ddg_search = DuckDuckGoSearchRun()
-        tools = [
-            Tool(
-                name="DuckDuckGoSearch",
-                func=ddg_search.run,
-                description="Useful for when you need to answer questions about current events. You should ask targeted questions",
-            )
-        ]
-
-        # Get the prompt - can modify this
-        prompt = hub.pull("hwchase17/react-chat")
-
-        # Setup LLM and Agent
-        memory = ConversationBufferMemory(memory_key="chat_history")
-        agent = create_react_agent(_self.llm, tools, prompt)
-        agent_executor = AgentExecutor(agent=agent, tools=tools, memory=memory, verbose=False)
-        return agent_executor, memory
+    def setup_agent(self):
+        # one per session, rebuilt when another LLM is selected or its client
+        # expired; the executor keeps its llm alive so the id can't be reused
+        memory = utils.conversation_memory(self.llm, **chatbots.CHATBOTS["internet"]["memory"])
+        agent_executor = utils.page_resource("agent", lambda: chatbots.internet_agent(self.llm, memory), version=id(self.llm))
+        return agent_executor
 
     @utils.enable_chat_history
     def main(self):
-        agent_executor, memory = self.setup_agent()
+        agent_executor = self.setup_agent()
         user_query = st.chat_input(placeholder="Ask me anything!")
         if user_query:
             utils.display_msg(user_query, 'user')
             with st.chat_message("assistant"):
                 st_cb = StreamlitCallbackHandler(st.container())
                 result = agent_executor.invoke(
-                    {"input": user_query, "chat_history": memory.chat_memory.messages},
+                    {"input": user_query},
                     {"callbacks": [st_cb]}
                 )
                 response = result["output"]
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                st.session_state.messages.append("assistant", response)
                 st.write(response)
                 utils.print_qa(InternetChatbot, user_query, response)
 
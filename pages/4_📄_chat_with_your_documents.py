@@ -1,13 +1,10 @@
 import os
 import utils
+import corpus
+import chatbots
 import streamlit as st
 from streaming import StreamHandler
-
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import DocArrayInMemorySearch
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from vectorstore import SegmentedVectorStore
 
 
 st.set_page_config(page_title="ChatPDF", page_icon="📄")
@@ -19,72 +16,80 @@ class CustomDocChatbot:
 
     def __init__(self):
         utils.sync_st_session()
-        self.llm = utils.configure_llm()
-        self.embedding_model = utils.configure_embedding_model()
-
-    def save_file(self, file):
-        folder = 'tmp'
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        
-        file_path = f'./{folder}/{file.name}'
-        with open(file_path, 'wb') as f:
-            f.write(file.getvalue())
-        return file_path
-
-    @st.spinner('Analyzing documents..')
-    def setup_qa_chain(self, uploaded_files):
-        # Load documents
-        docs = []
-        for file in uploaded_files:
-            file_path = self.save_file(file)
-            loader = PyPDFLoader(file_path)
-            docs.extend(loader.load())
-        
-        # Split documents and store in vector db
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        splits = text_splitter.split_documents(docs)
-        vectordb = DocArrayInMemorySearch.from_documents(splits, self.embedding_model)
-
-        # Define retriever
-        retriever = vectordb.as_retriever(
-            search_type='mmr',
-            search_kwargs={'k':2, 'fetch_k':4}
-        )
-
-        # Setup memory for contextual conversation        
-        memory = ConversationBufferMemory(
-            memory_key='chat_history',
-            output_key='answer',
-            return_messages=True
-        )
-
-        # Setup LLM and QA chain
-        qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=retriever,
-            memory=memory,
-            return_source_documents=True,
-            verbose=False
-        )
-        return qa_chain
+        self.llm = utils.configure_llm(response_cache=True)
+
+    def ingest_documents(self, files):
+        with st.status('Analyzing documents..', expanded=True) as status:
+            # one progress bar per file, updated as its pages get parsed and embedded
+            progress_bars = {source_key: st.progress(0.0, text=file.name) for source_key, file in files.items()}
+            def on_progress(source_key, pages_done, total_pages):
+                progress_bars[source_key].progress(
+                    pages_done / max(total_pages, 1),
+                    text=f"{files[source_key].name} - {pages_done}/{total_pages} pages"
+                )
+
+            def on_truncated(source_key, total_pages):
+                st.warning(f"Only the first {chatbots.PDF_MAX_PAGES} of {total_pages} pages of "
+                           f"{files[source_key].name} are searched", icon="⚠️")
+
+            errors = chatbots.ingest_documents(
+                {source_key: (file.name, file.getvalue()) for source_key, file in files.items()},
+                on_progress=on_progress,
+                on_truncated=on_truncated
+            )
+            for source_key, error in errors.items():
+                st.warning(f"Skipped {files[source_key].name}: {error}", icon="⚠️")
+            status.update(label='Documents analyzed', state='error' if errors else 'complete', expanded=bool(errors))
+
+        utils.page_resource("failed_sources", set).update(errors)
+
+    def setup_vectordb(self, uploaded_files):
+        # one segment per file, so adding or removing a file leaves the others untouched
+        vectordb = utils.page_resource("vectordb", lambda: SegmentedVectorStore(utils.configure_embedding_model()))
+        failed_sources = utils.page_resource("failed_sources", set)
+
+        files = {chatbots.document_source_key(file.getvalue()): file for file in uploaded_files}
+
+        # only files never seen by any session get parsed and embedded
+        new_files = {
+            source_key: file for source_key, file in files.items()
+            if source_key not in vectordb.segments
+            and source_key not in failed_sources
+            and not os.path.exists(chatbots.document_source_folder(source_key))
+        }
+        if new_files:
+            self.ingest_documents(new_files)
+
+        # saved segments are memory-mapped and shared by all sessions
+        return chatbots.document_vectordb(list(files), vectordb)
+
+    def get_memory(self):
+        # kept across reruns of this session
+        return utils.conversation_memory(self.llm, **chatbots.CHATBOTS["documents"]["memory"])
+
+    def setup_qa_chain(self, vectordb, memory):
+        return chatbots.retrieval_chain(self.llm, vectordb, memory)
 
     @utils.enable_chat_history
     def main(self):
 
-        # User Inputs
-        uploaded_files = st.sidebar.file_uploader(label='Upload PDF files', type=['pdf'], accept_multiple_files=True)
-        if not uploaded_files:
-            st.error("Please upload PDF documents to continue!")
-            st.stop()
+        # User Inputs, corpora ingested with corpus.py are offered next to uploads
+        corpora = corpus.list_corpora()
+        corpus_name = st.sidebar.selectbox(label='Documents', options=["Upload PDF files", *corpora]) if corpora else None
+        if corpus_name in corpora:
+            # memory-mapped and shared by all sessions, nothing is embedded here
+            vectordb = chatbots.corpus_vectordb(corpus_name)
+        else:
+            uploaded_files = st.sidebar.file_uploader(label='Upload PDF files', type=['pdf'], accept_multiple_files=True)
+            if not uploaded_files:
+                st.error("Please upload PDF documents to continue!")
+                st.stop()
+            vectordb = self.setup_vectordb(uploaded_files)
+        qa_chain = self.setup_qa_chain(vectordb, self.get_memory())
 
         user_query = st.chat_input(placeholder="Ask me anything!")
 
-        if uploaded_files and user_query:
-            qa_chain = self.setup_qa_chain(uploaded_files)
+        if user_query:
 
             utils.display_msg(user_query, 'user')
 
@@ -95,14 +100,16 @@ class CustomDocChatbot:
                     {"callbacks": [st_cb]}
                 )
                 response = result["answer"]
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                st.session_state.messages.append("assistant", response)
                 utils.print_qa(CustomDocChatbot, user_query, response)
 
                 # to show references
                 for idx, doc in enumerate(result['source_documents'],1):
                     filename = os.path.basename(doc.metadata['source'])
-                    page_num = doc.metadata['page']
-                    ref_title = f":blue[Reference {idx}: *{filename} - page.{page_num}*]"
+                    page_num = doc.metadata.get('page')
+                    # text and markdown sources of a corpus have no pages
+                    location = f"{filename} - page.{page_num}" if page_num is not None else filename
+                    ref_title = f":blue[Reference {idx}: *{location}*]"
                     with st.popover(ref_title):
                         st.caption(doc.page_content)
 
@@ -1,17 +1,12 @@
 import os
 import utils
-import requests
-import traceback
+import contextlib
+import chatbots
 import validators
 import streamlit as st
+from webfetch import canonical_url
 from streaming import StreamHandler
-
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
-
-from langchain_core.documents.base import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import DocArrayInMemorySearch
+from vectorstore import SegmentedVectorStore
 
 st.set_page_config(page_title="ChatWebsite", page_icon="🔗")
 st.header('Chat with Website')
@@ -22,67 +17,19 @@ class ChatbotWeb:
 
     def __init__(self):
         utils.sync_st_session()
-        self.llm = utils.configure_llm()
-        self.embedding_model = utils.configure_embedding_model()
-
-    def scrape_website(self, url):
-        content = ""
-        try:
-            base_url = "https://r.jina.ai/"
-            final_url = base_url + url
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:88.0) Gecko/20100101 Firefox/88.0'
-                }
-            response = requests.get(final_url, headers=headers)
-            content = response.text
-        except Exception as e:
-            traceback.print_exc()
-        return content
-
-    @st.cache_resource(show_spinner='Analyzing webpage', ttl=3600)
-    def setup_vectordb(_self, websites):
-        # Scrape and load documents
-        docs = []
-        for url in websites:
-            docs.append(Document(
-                page_content=_self.scrape_website(url),
-                metadata={"source":url}
-                )
-            )
+        self.llm = utils.configure_llm(response_cache=True)
 
-        # Split documents and store in vector db
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        splits = text_splitter.split_documents(docs)
-        vectordb = DocArrayInMemorySearch.from_documents(splits, _self.embedding_model)
-        return vectordb
+    def setup_vectordb(self, websites):
+        # one segment per website, so adding or removing a site leaves the others untouched
+        vectordb = utils.page_resource("vectordb", lambda: SegmentedVectorStore(utils.configure_embedding_model()))
+        new_websites = any(url not in vectordb.segments for url in websites)
+        with st.spinner('Analyzing webpage') if new_websites else contextlib.nullcontext():
+            return chatbots.website_vectordb(websites, vectordb)
 
     def setup_qa_chain(self, vectordb):
-
-        # Define retriever
-        retriever = vectordb.as_retriever(
-            search_type='mmr',
-            search_kwargs={'k':2, 'fetch_k':4}
-        )
-
-        # Setup memory for contextual conversation        
-        memory = ConversationBufferMemory(
-            memory_key='chat_history',
-            output_key='answer',
-            return_messages=True
-        )
-
-        # Setup QA chain
-        qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=retriever,
-            memory=memory,
-            return_source_documents=True,
-            verbose=False
-        )
-        return qa_chain
+        # Setup memory for contextual conversation, kept across reruns of this session
+        memory = utils.conversation_memory(self.llm, **chatbots.CHATBOTS["website"]["memory"])
+        return chatbots.retrieval_chain(self.llm, vectordb, memory)
 
     @utils.enable_chat_history
     def main(self):
@@ -104,14 +51,22 @@ class ChatbotWeb:
 
         if st.sidebar.button("Clear", type="primary"):
             st.session_state["websites"] = []
-        
-        websites = list(set(st.session_state["websites"]))
+            utils.release_page_resources("vectordb")
+
+        # canonical order, so the same set of sites always maps to the same segments
+        websites = tuple(sorted({canonical_url(url) for url in st.session_state["websites"]}))
 
         if not websites:
             st.error("Please enter website url to continue!")
             st.stop()
         else:
-            st.sidebar.info("Websites - \n - {}".format('\n - '.join(websites)))
+            st.sidebar.write("Websites")
+            for url in websites:
+                col1, col2 = st.sidebar.columns([6, 1])
+                col1.caption(url)
+                if col2.button("✖", key=f"remove_{url}", help="Remove website"):
+                    st.session_state["websites"] = [i for i in st.session_state["websites"] if canonical_url(i) != url]
+                    st.rerun()
 
             vectordb = self.setup_vectordb(websites)
             qa_chain = self.setup_qa_chain(vectordb)
@@ -128,7 +83,7 @@ class ChatbotWeb:
                         {"callbacks": [st_cb]}
                     )
                     response = result["answer"]
-                    st.session_state.messages.append({"role": "assistant", "content": response})
+                    st.session_state.messages.append("assistant", response)
                     utils.print_qa(ChatbotWeb, user_query, response)
 
                     # to show references
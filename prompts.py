@@ -0,0 +1,26 @@
+import tracing
+import functools
+from pathlib import Path
+from langchain_core.prompts import PromptTemplate
+
+PROMPTS_DIR = Path(__file__).parent / "assets" / "prompts"
+# vendored prompts and the hub reference each was copied from
+HUB_REFS = {"react-chat": "hwchase17/react-chat"}
+
+
+@functools.lru_cache(maxsize=None)
+def load_prompt(name, hub_ref):
+    """Load a vendored prompt from assets/prompts, falling back to the LangChain hub.
+
+    Args:
+        name (str): file name without extension, e.g. 'react-chat'
+        hub_ref (str): hub reference the file was vendored from, e.g. 'hwchase17/react-chat'
+    """
+    path = PROMPTS_DIR / f"{name}.txt"
+    if path.exists():
+        with tracing.span("load.prompt", source="file"):
+            return PromptTemplate.from_template(path.read_text(encoding="utf-8"))
+
+    from langchain import hub
+    with tracing.span("load.prompt", source="hub"):
+        return hub.pull(hub_ref)
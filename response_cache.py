@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import hashlib
+import tracing
+import threading
+import numpy as np
+from typing import Any
+from streamlit.logger import get_logger
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from chat_wrappers import WrappedChatModel, replay_tokens
+
+logger = get_logger('Langchain-Chatbot')
+
+
+def _normalize(text):
+    return " ".join(str(text).split()).casefold()
+
+
+class ResponseCache:
+    """Persistent cache of LLM answers with an exact and a semantic tier.
+
+    The prompt is split into a scope, i.e. the model settings and every message
+    but the last one (system prompt, retrieved context), and the question in the
+    last message. An answer is reused when scope and normalised question match
+    exactly, or, when `embeddings` is given and the prompt has a separate
+    context, when the scope matches and the question embedding has a cosine
+    similarity of at least `similarity_threshold` with a cached one.
+
+    Entries are stored in SQLite, expire `ttl` seconds after they were written
+    and the least recently used ones are dropped beyond `max_entries`.
+    """
+
+    def __init__(self, path='.cache/responses.db', embeddings=None, similarity_threshold=0.95,
+                 ttl=24 * 3600, max_entries=10_000):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, scope TEXT NOT NULL, embedding BLOB, answer TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def _keys(llm_string, messages):
+        context = "\n".join(f"{m.type}: {_normalize(m.content)}" for m in messages[:-1])
+        scope = hashlib.sha256(f"{llm_string}\0{context}".encode('utf-8')).hexdigest()
+        question = _normalize(messages[-1].content) if messages else ""
+        key = hashlib.sha256(f"{scope}\0{question}".encode('utf-8')).hexdigest()
+        return scope, question, key
+
+    def _embed(self, messages, question):
+        # without a separate context the question is the whole prompt, e.g. a
+        # conversation transcript, where near matches are not safe to reuse
+        if self.embeddings is None or len(messages) < 2:
+            return None
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, llm_string, messages):
+        """Cached answer for `messages`, or None. Also returns what `update` needs on a miss."""
+        scope, question, key = self._keys(llm_string, messages)
+        min_created = time.time() - self.ttl if self.ttl else 0
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer FROM responses WHERE key = ? AND created >= ?", (key, min_created)
+            ).fetchone()
+        if row:
+            self.exact_hits += 1
+            self._touch(key)
+            return row[0], None
+
+        embedding = self._embed(messages, question)
+        if embedding is not None:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, embedding, answer FROM responses WHERE scope = ? AND embedding IS NOT NULL AND created >= ?",
+                    (scope, min_created)
+                ).fetchall()
+            if rows:
+                matrix = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+                scores = matrix @ embedding
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    self.semantic_hits += 1
+                    self._touch(rows[best][0])
+                    return rows[best][2], None
+        self.misses += 1
+        return None, (scope, key, embedding)
+
+    def _touch(self, key):
+        with self._lock:
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+
+    def update(self, entry, answer):
+        scope, key, embedding = entry
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, scope, embedding, answer, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, embedding.tobytes() if embedding is not None else None, answer, now, now)
+            )
+            if self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+
+class CachedChatModel(WrappedChatModel):
+    """Chat model that answers from a ResponseCache before calling `llm`.
+
+    Cached answers are replayed word by word through the callbacks, so
+    streaming handlers render them just like a live answer.
+    """
+
+    response_cache: Any
+
+    @property
+    def _llm_type(self):
+        return f"cached-{self.llm._llm_type}"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        llm_string = self.llm._get_llm_string(stop=stop, **kwargs)
+        with tracing.span("response_cache"):
+            answer, entry = self.response_cache.lookup(llm_string, messages)
+        tracing.count("cache.response.hit" if answer is not None else "cache.response.miss")
+        if answer is not None:
+            logger.info("Answered from response cache")
+            if run_manager:
+                for token in replay_tokens(answer):
+                    run_manager.on_llm_new_token(token)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+        # the wrapped model streams into the same callbacks, as if called directly
+        result = self.llm._generate_with_cache(messages, stop=stop, run_manager=run_manager, **kwargs)
+        generations = result.generations
+        if len(generations) == 1 and isinstance(generations[0].message.content, str) \
+                and generations[0].message.content and not getattr(generations[0].message, "tool_calls", None):
+            self.response_cache.update(entry, generations[0].message.content)
+        return result
@@ -0,0 +1,75 @@
+import tracing
+import numpy as np
+from typing import Any
+from lexical import bm25_search
+from vectorstore import _mmr_select, _normalize
+from langchain_core.retrievers import BaseRetriever
+
+
+class HybridRetriever(BaseRetriever):
+    """BM25 + dense retriever over a NumpyVectorStore or SegmentedVectorStore.
+
+    The top `fetch_k` BM25 hits and the top `fetch_k` dense hits are fused with
+    reciprocal rank fusion. Only the best `fetch_k` fused candidates go to the
+    MMR pass, so exact keywords (part numbers, error codes) that the embedding
+    misses still make it into the result without widening the dense search.
+
+    The lexical stage prefilters the MMR candidates, not the dense scoring:
+    a matrix product over all vectors is cheap next to MMR, and limiting it to
+    BM25 hits would lose the paraphrased matches the embedding is there for.
+    """
+
+    vectorstore: Any
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    rrf_k: int = 60
+
+    def _segments(self):
+        segments = getattr(self.vectorstore, "segments", None)
+        segments = list(segments.values()) if segments is not None else [self.vectorstore]
+        return [segment for segment in segments if len(segment)]
+
+    def _dense_search(self, segments, embedding):
+        hits = []
+        for position, segment in enumerate(segments):
+            top, scores = segment._top_k(embedding, self.fetch_k)
+            hits.extend((float(score), position, int(i)) for i, score in zip(top, scores))
+        hits.sort(key=lambda hit: -hit[0])
+        return hits[:self.fetch_k]
+
+    def fuse(self, *rankings):
+        """Reciprocal rank fusion of hit lists, as {(segment position, document): score}."""
+        fused = {}
+        for hits in rankings:
+            for rank, (_, position, i) in enumerate(hits):
+                fused[(position, i)] = fused.get((position, i), 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        return fused
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        segments = self._segments()
+        if not segments:
+            return []
+        with tracing.span("retrieve.bm25"):
+            lexical = bm25_search([segment.lexical_index for segment in segments], query, self.fetch_k)
+        with tracing.span("retrieve.dense"):
+            embedding = _normalize(self.vectorstore.embeddings.embed_query(query))
+            dense = self._dense_search(segments, embedding)
+        fused = self.fuse(lexical, dense)
+
+        with tracing.span("retrieve.mmr"):
+            candidates = sorted(fused, key=fused.get, reverse=True)[:self.fetch_k]
+            candidate_vectors = np.stack([segments[position].get_vectors(i) for position, i in candidates])
+            # the fused order mapped onto the candidates' cosine range, the
+            # scale MMR's redundancy term is measured on
+            fused_scores = np.array([fused[c] for c in candidates], dtype=np.float32)
+            similarities = candidate_vectors @ embedding
+            spread = fused_scores[0] - fused_scores[-1]
+            relative = (fused_scores - fused_scores[-1]) / spread if spread else np.ones_like(fused_scores)
+            low, high = float(similarities.min()), float(similarities.max())
+            if high - low < 1e-6:
+                # the embedding can't tell them apart, e.g. a query of codes only
+                low, high = 0.0, 1.0
+            query_scores = low + relative * (high - low)
+            selected = _mmr_select(query_scores, candidate_vectors, self.k, self.lambda_mult)
+        return [segments[candidates[j][0]].documents[candidates[j][1]] for j in selected]
@@ -0,0 +1,444 @@
+"""Headless HTTP API for the chatbots, with token streaming over SSE or WebSocket.
+
+Usage:
+    python server.py --port 8000 --sessions sqlite:///.cache/sessions.db
+
+    POST   /sessions                  {"chatbot": "website", "options": {"websites": ["https://..."]}}
+                                      {"chatbot": "documents", "options": {"corpus": "handbook"}}, see corpus.py
+    GET    /sessions/<id>             chatbot, options and conversation
+    DELETE /sessions/<id>
+    POST   /sessions/<id>/messages    {"input": "..."}, answered as a text/event-stream
+    WS     /sessions/<id>/ws          send {"input": "..."}, receive {"event": ..., "data": ...}
+    POST   /documents?filename=a.pdf  PDF as request body, returns a source for the documents chatbot
+    GET    /health
+    GET    /metrics                   Prometheus metrics, see tracing.py
+
+Events are "token" (streamed answer text), "step" (agent tool calls),
+"warning" (expensive SQL), "answer" (final answer, sources and per stage
+timings in ms), "error" and, for SSE, "done". Set TRACE_FILE to also append
+every turn's spans to a JSONL file. The LLM is configured with LLM_PROVIDER (openai or ollama),
+LLM_MODEL, OPENAI_API_KEY and OLLAMA_ENDPOINT; the limits of each backend are
+set as described in gateway.py.
+"""
+import os
+import json
+import asyncio
+import argparse
+import validators
+import tornado.web
+import tornado.websocket
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from tornado.iostream import StreamClosedError
+from streamlit.logger import get_logger
+from langchain_core.callbacks import BaseCallbackHandler
+
+import sqldb
+import corpus
+import clients
+import gateway
+import tracing
+import warmup
+import chatbots
+from memory import TokenBudgetMemory
+from webfetch import canonical_url
+from sessions import open_session_store, new_session_id
+
+logger = get_logger('Langchain-Chatbot')
+
+# agents stream their reasoning, only their tool calls and final answer are sent
+_TOKEN_STREAMING = {"basic", "context", "documents", "website"}
+
+
+class ServiceError(Exception):
+    status = 500
+
+
+class SessionNotFound(ServiceError):
+    status = 404
+
+
+class SessionBusy(ServiceError):
+    status = 429
+
+
+class Overloaded(ServiceError):
+    status = 503
+
+
+class TurnLimiter:
+    """Admission control for chat turns.
+
+    At most `max_concurrent` turns run at once and `max_waiting` more wait for
+    a slot; beyond that requests are rejected right away instead of queueing
+    without bound. Each session runs at most `per_session` turns at a time.
+    """
+
+    def __init__(self, max_concurrent=32, max_waiting=128, per_session=1):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.per_session = per_session
+        self.waiting = 0
+        self.running = 0
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._sessions = {}
+
+    @asynccontextmanager
+    async def slot(self, session_id):
+        if self._sessions.get(session_id, 0) >= self.per_session:
+            raise SessionBusy("This session is still answering the previous message")
+        if self.waiting >= self.max_waiting:
+            raise Overloaded("Too many requests, try again shortly")
+        self._sessions[session_id] = self._sessions.get(session_id, 0) + 1
+        try:
+            self.waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+            self.running += 1
+            try:
+                yield
+            finally:
+                self.running -= 1
+                self._slots.release()
+        finally:
+            self._sessions[session_id] -= 1
+            if not self._sessions[session_id]:
+                del self._sessions[session_id]
+
+    def stats(self):
+        return {"running": self.running, "waiting": self.waiting, "max_concurrent": self.max_concurrent}
+
+
+class EventQueueHandler(BaseCallbackHandler):
+    """Forwards chain events to an asyncio queue, from any thread."""
+
+    def __init__(self, loop, queue, stream_tokens=True):
+        self.loop = loop
+        self.queue = queue
+        self.stream_tokens = stream_tokens
+
+    def put(self, event, data):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (event, data))
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.stream_tokens and token:
+            self.put("token", token)
+
+    def on_agent_action(self, action, **kwargs):
+        self.put("step", {"tool": action.tool, "input": action.tool_input})
+
+
+def llm_from_env():
+    provider = os.environ.get("LLM_PROVIDER", "openai")
+    if provider == "ollama":
+        fallback = None
+        if gateway.FALLBACK_QUEUE_DEPTH is not None and os.environ.get("OPENAI_API_KEY"):
+            fallback = ("openai", os.environ.get("LLM_FALLBACK_MODEL", "gpt-4o-mini"), os.environ["OPENAI_API_KEY"])
+        return clients.get_chat_model("ollama", os.environ.get("LLM_MODEL", "llama3.2"), base_url=os.environ["OLLAMA_ENDPOINT"],
+                                      fallback=fallback)
+    return clients.get_chat_model("openai", os.environ.get("LLM_MODEL", "gpt-4o-mini"), api_key=os.environ.get("OPENAI_API_KEY"))
+
+
+def _sources(result):
+    return [{"content": doc.page_content, **doc.metadata} for doc in result.get("source_documents", [])]
+
+
+class ChatService:
+    """Runs chat turns against the chains in chatbots.py, with state in a session store."""
+
+    def __init__(self, store, llm_factory=llm_from_env, limiter=None, allow_db_uri=False):
+        self.store = store
+        self.llm_factory = llm_factory
+        self.limiter = limiter or TurnLimiter()
+        self.allow_db_uri = allow_db_uri
+
+    def validate_options(self, chatbot, options):
+        if chatbot not in chatbots.CHATBOTS:
+            raise ValueError(f"Unknown chatbot: {chatbot}")
+        if chatbot == "website":
+            websites = options.get("websites") or []
+            if not websites or not all(isinstance(u, str) and u.startswith('http') and validators.url(u) for u in websites):
+                raise ValueError("website needs a list of valid urls in options.websites")
+            return {"websites": sorted({canonical_url(u) for u in websites})}
+        if chatbot == "documents" and options.get("corpus"):
+            if options["corpus"] not in corpus.list_corpora():
+                raise ValueError(f"Unknown corpus: {options['corpus']}")
+            return {"corpus": options["corpus"]}
+        if chatbot == "documents":
+            sources = [list(s) for s in options.get("sources") or []]
+            if not sources or not all(os.path.exists(chatbots.document_source_folder(tuple(s))) for s in sources):
+                raise ValueError("documents needs sources returned by POST /documents in options.sources")
+            return {"sources": sources}
+        if chatbot == "sql":
+            db_uri = options.get("db_uri", sqldb.SAMPLE_DB)
+            if db_uri != sqldb.SAMPLE_DB and not self.allow_db_uri:
+                raise ValueError("Only the sample database is enabled on this server")
+            return {"db_uri": db_uri}
+        return {}
+
+    async def create_session(self, chatbot, options):
+        options = self.validate_options(chatbot, options or {})
+        session_id = new_session_id()
+        await asyncio.to_thread(self.store.put, session_id, {"chatbot": chatbot, "options": options, "memory": {}})
+        return session_id
+
+    async def get_session(self, session_id):
+        state = await asyncio.to_thread(self.store.get, session_id)
+        if state is None:
+            raise SessionNotFound(f"Unknown session: {session_id}")
+        return state
+
+    async def run_turn(self, session_id, text, emit):
+        """Answer `text` in the session, calling `await emit(event, data)` as the answer is produced."""
+        await self.get_session(session_id)
+        async with self.limiter.slot(session_id):
+            # read again, the previous turn may have finished while waiting
+            state = await self.get_session(session_id)
+            chatbot = state["chatbot"]
+            spec = chatbots.CHATBOTS[chatbot]
+            llm = self.llm_factory()
+            memory = None
+            if spec["memory"] is not None:
+                memory = TokenBudgetMemory(llm=llm, **spec["memory"])
+                memory.load_state(state.get("memory", {}))
+
+            with tracing.trace(chatbot, session=session_id) as turn:
+                # building may fetch websites or load corpora, keep it off the event loop
+                chain = await asyncio.to_thread(chatbots.build, chatbot, llm, memory, state["options"])
+                queue = asyncio.Queue()
+                handler = EventQueueHandler(asyncio.get_running_loop(), queue, chatbot in _TOKEN_STREAMING)
+                on_expensive = lambda sql, cost: handler.put("warning", {"sql": sql, "estimated_cost": cost})
+                with sqldb.report_expensive_queries(on_expensive):
+                    task = asyncio.ensure_future(chain.ainvoke({spec["input_key"]: text}, {"callbacks": [handler]}))
+                try:
+                    while not task.done() or not queue.empty():
+                        getter = asyncio.ensure_future(queue.get())
+                        await asyncio.wait({task, getter}, return_when=asyncio.FIRST_COMPLETED)
+                        if getter.done():
+                            await emit(*getter.result())
+                        else:
+                            getter.cancel()
+                    try:
+                        result = task.result()
+                    except gateway.GatewayOverloaded as e:
+                        # the LLM backend is saturated, answered like a full turn queue
+                        raise Overloaded(str(e)) from e
+                finally:
+                    # the client went away or the turn failed, don't leave the chain running
+                    task.cancel()
+
+            if memory is not None:
+                state["memory"] = memory.to_state()
+                # a session deleted during the turn stays deleted
+                if not await asyncio.to_thread(self.store.update, session_id, state):
+                    logger.info(f"Session {session_id} was deleted during the turn, its memory is not saved")
+            timings = {name: round(seconds * 1000, 1) for name, (_, seconds) in turn.breakdown().items()}
+            await emit("answer", {"answer": result[spec["output_key"]], "sources": _sources(result), "timings": timings})
+
+    async def ingest_document(self, filename, content):
+        source_key = chatbots.document_source_key(content)
+        if not os.path.exists(chatbots.document_source_folder(source_key)):
+            with tracing.trace("documents", ingest=filename):
+                errors = await asyncio.to_thread(
+                    chatbots.ingest_documents, {source_key: (filename, content)},
+                    on_truncated=lambda _, total: logger.warning(
+                        f"Only the first {chatbots.PDF_MAX_PAGES} of {total} pages of {filename} are searched")
+                )
+            if errors:
+                raise ValueError(errors[source_key])
+        return list(source_key)
+
+
+class BaseHandler(tornado.web.RequestHandler):
+
+    @property
+    def service(self):
+        return self.application.settings["service"]
+
+    def json_body(self):
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Body is not valid JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Body must be a JSON object")
+        return body
+
+    def write_json(self, data, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(data))
+
+    def write_error(self, status_code, **kwargs):
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps({"error": self._reason}))
+
+    def fail(self, error):
+        status = error.status if isinstance(error, ServiceError) else 400
+        if status in (429, 503):
+            self.set_header("Retry-After", "1")
+        raise tornado.web.HTTPError(status, reason=str(error))
+
+
+class SessionsHandler(BaseHandler):
+
+    async def post(self):
+        body = self.json_body()
+        try:
+            session_id = await self.service.create_session(body.get("chatbot"), body.get("options"))
+        except ValueError as e:
+            self.fail(e)
+        self.write_json({"session_id": session_id}, status=201)
+
+
+class SessionHandler(BaseHandler):
+
+    async def get(self, session_id):
+        try:
+            state = await self.service.get_session(session_id)
+        except ServiceError as e:
+            self.fail(e)
+        messages = [{"role": m["type"], "content": m["data"]["content"]} for m in state.get("memory", {}).get("messages", [])]
+        self.write_json({"chatbot": state["chatbot"], "options": state["options"], "messages": messages})
+
+    async def delete(self, session_id):
+        await asyncio.to_thread(self.service.store.delete, session_id)
+        self.set_status(204)
+        self.finish()
+
+
+class MessagesHandler(BaseHandler):
+    """Answers one message as a server-sent event stream."""
+
+    async def post(self, session_id):
+        text = self.json_body().get("input")
+        if not isinstance(text, str) or not text.strip():
+            raise tornado.web.HTTPError(400, reason="input is required")
+
+        async def emit(event, data):
+            if not self._headers_written:
+                self.set_header("Content-Type", "text/event-stream")
+                self.set_header("Cache-Control", "no-cache")
+            self.write(f"event: {event}\ndata: {json.dumps(data)}\n\n")
+            # waits for the client to take the data, slow readers slow the turn down
+            await self.flush()
+
+        try:
+            await self.service.run_turn(session_id, text, emit)
+            await emit("done", {})
+        except StreamClosedError:
+            return
+        except ServiceError as e:
+            if not self._headers_written:
+                self.fail(e)
+            await emit("error", {"message": str(e)})
+        except Exception as e:
+            logger.exception("Turn failed")
+            if not self._headers_written:
+                raise
+            await emit("error", {"message": str(e)})
+        self.finish()
+
+
+class ChatSocketHandler(tornado.websocket.WebSocketHandler):
+    """Answers messages of one session over a WebSocket, one at a time."""
+
+    @property
+    def service(self):
+        return self.application.settings["service"]
+
+    def open(self, session_id):
+        self.session_id = session_id
+
+    async def emit(self, event, data):
+        await self.write_message(json.dumps({"event": event, "data": data}))
+
+    async def on_message(self, message):
+        # tornado delivers the next message once this one is answered
+        try:
+            text = json.loads(message).get("input")
+        except (ValueError, AttributeError):
+            text = None
+        if not isinstance(text, str) or not text.strip():
+            await self.emit("error", {"status": 400, "message": "input is required"})
+            return
+        try:
+            await self.service.run_turn(self.session_id, text, self.emit)
+        except tornado.websocket.WebSocketClosedError:
+            return
+        except ServiceError as e:
+            await self.emit("error", {"status": e.status, "message": str(e)})
+        except Exception as e:
+            logger.exception("Turn failed")
+            await self.emit("error", {"status": 500, "message": str(e)})
+
+
+class DocumentsHandler(BaseHandler):
+
+    async def post(self):
+        filename = self.get_query_argument("filename", "document.pdf")
+        if not self.request.body:
+            raise tornado.web.HTTPError(400, reason="PDF content is required")
+        try:
+            source = await self.service.ingest_document(filename, self.request.body)
+        except ValueError as e:
+            raise tornado.web.HTTPError(422, reason=str(e))
+        self.write_json({"source": source}, status=201)
+
+
+class HealthHandler(BaseHandler):
+
+    def get(self):
+        self.write_json({"status": "ok", **self.service.limiter.stats(), "backends": gateway.backend_stats()})
+
+
+class MetricsHandler(BaseHandler):
+    """Stage latencies, token counts and cache hit counts in Prometheus text format."""
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish(tracing.METRICS.render())
+
+
+def make_app(service):
+    return tornado.web.Application([
+        (r"/health", HealthHandler),
+        (r"/metrics", MetricsHandler),
+        (r"/sessions", SessionsHandler),
+        (r"/sessions/(\w+)", SessionHandler),
+        (r"/sessions/(\w+)/messages", MessagesHandler),
+        (r"/sessions/(\w+)/ws", ChatSocketHandler),
+        (r"/documents", DocumentsHandler),
+    ], service=service)
+
+
+async def serve(args):
+    # retrievers and tools without async support run in the default executor
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max(32, 2 * args.max_concurrent)))
+    limiter = TurnLimiter(args.max_concurrent, args.max_waiting, args.per_session)
+    service = ChatService(open_session_store(args.sessions), limiter=limiter, allow_db_uri=args.allow_db_uri)
+    if args.warmup:
+        # accept connections only once the first turn won't load the model
+        await asyncio.to_thread(warmup.warm_up)
+    make_app(service).listen(args.port, args.host)
+    logger.info(f"Serving on http://{args.host}:{args.port}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--sessions', default='memory', help='"memory" or sqlite:///path/to/sessions.db')
+    parser.add_argument('--max-concurrent', type=int, default=32, help='turns answered at once')
+    parser.add_argument('--max-waiting', type=int, default=128, help='turns waiting for a slot before requests are rejected')
+    parser.add_argument('--per-session', type=int, default=1, help='turns running at once per session')
+    parser.add_argument('--allow-db-uri', action='store_true', help='let sql sessions connect to any database uri')
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false', help='skip loading models before listening, see warmup.py')
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from caching import TTLCache
+
+
+class InMemorySessionStore:
+    """Sessions of this process, dropped after `idle_ttl` seconds without use."""
+
+    def __init__(self, max_entries=10_000, idle_ttl=24 * 3600):
+        self._sessions = TTLCache(max_entries=max_entries, idle_ttl=idle_ttl)
+        # an update must not bring back a session deleted in between
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        state = self._sessions.get(session_id)
+        # callers get their own copy, like from any other store
+        return json.loads(json.dumps(state)) if state is not None else None
+
+    def put(self, session_id, state):
+        self._sessions.set(session_id, json.loads(json.dumps(state)))
+
+    def update(self, session_id, state):
+        """Replace the state of an existing session, False if it was deleted or expired."""
+        with self._lock:
+            if self._sessions.get(session_id, count=False) is None:
+                return False
+            self.put(session_id, state)
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id)
+
+
+class SQLiteSessionStore:
+    """Sessions as JSON in a SQLite file, shared by all server processes on a host."""
+
+    def __init__(self, path='.cache/sessions.db', idle_ttl=24 * 3600):
+        self.idle_ttl = idle_ttl
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)")
+        self._conn.commit()
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM sessions WHERE id = ? AND updated >= ?", (session_id, time.time() - self.idle_ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, session_id, state):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, state, updated) VALUES (?, ?, ?)", (session_id, json.dumps(state), now)
+            )
+            self._conn.execute("DELETE FROM sessions WHERE updated < ?", (now - self.idle_ttl,))
+            self._conn.commit()
+
+    def update(self, session_id, state):
+        """Replace the state of an existing session, False if it was deleted or expired."""
+        now = time.time()
+        with self._lock:
+            # one statement, a delete from another process can't slip in between
+            cursor = self._conn.execute(
+                "UPDATE sessions SET state = ?, updated = ? WHERE id = ? AND updated >= ?",
+                (json.dumps(state), now, session_id, now - self.idle_ttl)
+            )
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+
+
+def open_session_store(url):
+    """Session store for "memory" or "sqlite:///path/to/sessions.db"."""
+    if url == "memory":
+        return InMemorySessionStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    raise ValueError(f"Unknown session store: {url}")
+
+
+def new_session_id():
+    return uuid.uuid4().hex
@@ -0,0 +1,290 @@
+import re
+import json
+import time
+import sqlite3
+import tracing
+import weakref
+import threading
+import contextvars
+from pathlib import Path
+from caching import TTLCache
+from contextlib import contextmanager
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+from langchain_community.utilities.sql_database import SQLDatabase
+
+SAMPLE_DB = 'USE_SAMPLE_DB'
+SAMPLE_DB_PATH = (Path(__file__).parent / "assets/Chinook.db").absolute()
+
+_READ_ONLY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+# REPLACE only as a statement (REPLACE INTO), replace() is a string function
+_WRITE = re.compile(r"\b(insert|update|delete|merge|replace\s+into|create|alter|drop|truncate|grant|revoke|attach|pragma|vacuum)\b", re.IGNORECASE)
+_TABLE_ALIAS = re.compile(r"\b(?:from|join)\s+[\"`]?(\w+)[\"`]?(?:\s+(?:as\s+)?(?!on\b|where\b|join\b|inner\b|left\b|group\b|order\b|limit\b)(\w+))?", re.IGNORECASE)
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(command):
+    """Collapse whitespace and drop the trailing semicolon, leaving quoted literals untouched."""
+    parts = _QUOTED.split(command.strip().rstrip(';').strip())
+    return "".join(part if i % 2 else " ".join(part.split()) for i, part in enumerate(parts))
+
+
+def is_read_only(command):
+    unquoted = "".join(_QUOTED.split(command)[::2])
+    return bool(_READ_ONLY.match(unquoted)) and not _WRITE.search(unquoted)
+
+
+class QueryGuardError(SQLAlchemyError):
+    """Raised when a statement is cancelled by the execution guard.
+
+    It is a SQLAlchemyError, so the SQL agent's run_no_throw reports it back to
+    the model as an error message instead of failing the whole turn.
+    """
+
+
+# per session callback, called as callback(command, estimate) for expensive statements
+_expensive_query_callback = contextvars.ContextVar("expensive_query_callback", default=None)
+
+
+@contextmanager
+def report_expensive_queries(callback):
+    """Within this block, statements whose estimated cost exceeds the warning level are reported to `callback`."""
+    token = _expensive_query_callback.set(callback)
+    try:
+        yield
+    finally:
+        _expensive_query_callback.reset(token)
+
+
+# how SQLDatabase points a connection at its `schema`, for the dialects that need it
+_SET_SCHEMA = {
+    "postgresql": ("SET search_path TO %s", True),
+    "snowflake": ("ALTER SESSION SET search_path = %s", True),
+    "bigquery": ("SET @@dataset_id=?", True),
+    "trino": ("USE ?", True),
+    "duckdb": ("SET search_path TO {}", False),
+    "oracle": ("ALTER SESSION SET CURRENT_SCHEMA = {}", False),
+}
+
+
+@contextmanager
+def _statement_timeout(connection, seconds):
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        # abort from sqlite's progress handler, this also covers fetching rows
+        raw_connection = connection.connection.driver_connection
+        deadline = time.monotonic() + seconds
+        raw_connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        try:
+            yield
+        finally:
+            raw_connection.set_progress_handler(None, 10000)
+        return
+    if dialect == "postgresql":
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(seconds * 1000)}")
+    elif dialect == "mysql":
+        connection.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {int(seconds * 1000)}")
+    yield
+
+
+class CachedSQLDatabase(SQLDatabase):
+    """SQLDatabase that caches schema introspection and guards agent queries.
+
+    Table names and table info are computed once, until `invalidate` is called.
+    Results of read-only queries are kept in an LRU cache keyed by the
+    normalised SQL, so repeated `sql_db_query` calls don't hit the database.
+
+    Statements run under a statement timeout (sqlite, postgresql and mysql) and
+    rows are fetched in batches up to `max_rows`, so a runaway query can't
+    materialise a whole table. Read-only statements are EXPLAINed first; costs
+    above `cost_warning` are reported and above `max_cost` refused.
+    """
+
+    def __init__(self, *args, result_cache_size=256, result_ttl=300, max_rows=1000, fetch_batch_size=200,
+                 statement_timeout=30, cost_warning=100_000, max_cost=None, **kwargs):
+        # set up first, SQLDatabase.__init__ already lists the tables
+        self._schema_cache = {}
+        self._schema_lock = threading.RLock()
+        self.results = TTLCache(max_entries=result_cache_size, ttl=result_ttl)
+        self.max_rows = max_rows
+        self.fetch_batch_size = fetch_batch_size
+        self.statement_timeout = statement_timeout
+        self.cost_warning = cost_warning
+        self.max_cost = max_cost
+        self._truncated = threading.local()
+        super().__init__(*args, **kwargs)
+
+    def _cached_schema(self, key, compute):
+        with self._schema_lock:
+            if key not in self._schema_cache:
+                self._schema_cache[key] = compute()
+            return self._schema_cache[key]
+
+    def get_usable_table_names(self):
+        return self._cached_schema("table_names", lambda: list(super(CachedSQLDatabase, self).get_usable_table_names()))
+
+    def get_table_info(self, table_names=None):
+        key = ("table_info", tuple(sorted(table_names)) if table_names else None)
+        return self._cached_schema(key, lambda: super(CachedSQLDatabase, self).get_table_info(table_names))
+
+    def estimate_cost(self, command):
+        """EXPLAIN based cost estimate of a read-only statement, None if the dialect isn't supported.
+
+        For sqlite this is the number of rows in the tables the plan scans without
+        an index, for postgresql and mysql the planner's total cost.
+        """
+        dialect = self._engine.dialect.name
+        try:
+            with self._engine.connect() as connection:
+                self._use_schema(connection)
+                if dialect == "sqlite":
+                    plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {command}").fetchall()
+                    cost = 0
+                    # the plan names tables by their alias
+                    aliases = {alias: table for table, alias in _TABLE_ALIAS.findall(command) if alias}
+                    for row in plan:
+                        match = re.match(r"SCAN (?:TABLE )?(\w+)(.*)", row[-1])
+                        if match and "INDEX" not in match.group(2):
+                            table = aliases.get(match.group(1), match.group(1))
+                            cost += self._sqlite_table_rows(connection, table)
+                    return cost
+                if dialect == "postgresql":
+                    plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {command}").scalar()
+                    plan = json.loads(plan) if isinstance(plan, str) else plan
+                    return plan[0]["Plan"]["Total Cost"]
+                if dialect == "mysql":
+                    plan = json.loads(connection.exec_driver_sql(f"EXPLAIN FORMAT=JSON {command}").scalar())
+                    return float(plan["query_block"]["cost_info"]["query_cost"])
+        except (SQLAlchemyError, KeyError, ValueError, TypeError):
+            return None
+        return None
+
+    @staticmethod
+    def _sqlite_table_rows(connection, table):
+        try:
+            # max(rowid) is an index lookup, unlike count(*)
+            return connection.exec_driver_sql(f'SELECT MAX(rowid) FROM "{table}"').scalar() or 0
+        except SQLAlchemyError:
+            # an alias, a view or a table without rowid
+            return 0
+
+    def _check_cost(self, command):
+        if not isinstance(command, str) or not is_read_only(command):
+            return
+        if self.cost_warning is None and self.max_cost is None:
+            return
+        cost = self.estimate_cost(command)
+        if cost is None:
+            return
+        if self.max_cost is not None and cost > self.max_cost:
+            raise QueryGuardError(f"Query refused: estimated cost {cost:,.0f} exceeds the limit of {self.max_cost:,.0f}. Add filters or a LIMIT.")
+        callback = _expensive_query_callback.get()
+        if callback and self.cost_warning is not None and cost > self.cost_warning:
+            callback(command, cost)
+
+    def _use_schema(self, connection):
+        # what SQLDatabase._execute does before every statement
+        if self._schema is None or self.dialect not in _SET_SCHEMA:
+            return
+        statement, parametrised = _SET_SCHEMA[self.dialect]
+        if parametrised:
+            connection.exec_driver_sql(statement, (self._schema,))
+        else:
+            connection.exec_driver_sql(statement.format(self._schema))
+
+    def _execute(self, command, fetch="all", *, parameters=None, execution_options=None):
+        with tracing.span("sql.explain"):
+            self._check_cost(command)
+        if fetch == "cursor":
+            # the caller reads the cursor, rows can't be capped here
+            return super()._execute(command, fetch, parameters=parameters, execution_options=execution_options)
+        with tracing.span("sql.execute"):
+            return self._execute_guarded(command, fetch, parameters, execution_options)
+
+    def _execute_guarded(self, command, fetch, parameters, execution_options):
+        if isinstance(command, str):
+            command = text(command)
+        limit = 1 if fetch == "one" else self.max_rows
+        rows = []
+        self._truncated.value = False
+        started = time.monotonic()
+        try:
+            with self._engine.begin() as connection:
+                self._use_schema(connection)
+                with _statement_timeout(connection, self.statement_timeout):
+                    execution_options = {**(execution_options or {}), "stream_results": True}
+                    cursor = connection.execute(command, parameters or {}, execution_options=execution_options)
+                    if not cursor.returns_rows:
+                        return []
+                    # fetch in batches and stop at the cap, the rest is never materialised
+                    while len(rows) < limit:
+                        batch = cursor.fetchmany(min(self.fetch_batch_size, limit - len(rows)))
+                        if not batch:
+                            break
+                        rows.extend(row._asdict() for row in batch)
+                    self._truncated.value = fetch == "all" and len(rows) == limit and cursor.fetchone() is not None
+                    cursor.close()
+        except OperationalError as e:
+            if time.monotonic() - started >= self.statement_timeout:
+                raise QueryGuardError(f"Query cancelled after the {self.statement_timeout}s statement timeout. Add filters or a LIMIT.") from e
+            raise
+        return rows
+
+    def run(self, command, fetch="all", include_columns=False, *, parameters=None, execution_options=None):
+        cacheable = isinstance(command, str) and fetch != "cursor" and not parameters and is_read_only(command)
+        key = (normalize_sql(command), fetch, include_columns) if cacheable else None
+        result = self.results.get(key) if cacheable else None
+        if cacheable:
+            tracing.count("cache.sql.hit" if result is not None else "cache.sql.miss")
+        if result is None:
+            result = super().run(command, fetch, include_columns, parameters=parameters, execution_options=execution_options)
+            if fetch != "cursor" and getattr(self._truncated, "value", False):
+                result += f"\n(Only the first {self.max_rows} rows are shown.)"
+            if cacheable:
+                self.results.set(key, result)
+        return result
+
+    def invalidate(self):
+        """Forget cached schema and query results, e.g. after the database changed."""
+        with self._schema_lock:
+            self._schema_cache.clear()
+        self.results.clear()
+
+
+def _create_database(db_uri):
+    if db_uri == SAMPLE_DB:
+        # a creator makes sqlalchemy assume an in-memory database and one
+        # connection per thread, which it closes under other threads once
+        # more than five have used it; the engine is shared by all sessions
+        creator = lambda: sqlite3.connect(f"file:{SAMPLE_DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+        engine = create_engine("sqlite:///", creator=creator, poolclass=QueuePool)
+    else:
+        engine = create_engine(db_uri, pool_pre_ping=True)
+    db = CachedSQLDatabase(engine)
+    # evicted databases may still be used by sessions, the pool is closed once none holds it
+    weakref.finalize(db, engine.dispose)
+    return db
+
+
+# one pooled engine and schema cache per database uri, shared by all sessions
+_databases = TTLCache(max_entries=32, idle_ttl=3600)
+
+
+def get_database(db_uri):
+    """Shared CachedSQLDatabase for `db_uri`, or the bundled Chinook.db for SAMPLE_DB."""
+    db = _databases.get(db_uri)
+    if db is None:
+        # reflection can be slow, so it runs outside the cache lock
+        db = _create_database(db_uri)
+        _databases.set(db_uri, db)
+    return db
+
+
+def invalidate_database(db_uri):
+    """Drop cached schema and results of `db_uri`; schema is reflected again on next use."""
+    db = _databases.get(db_uri, count=False)
+    if db is not None:
+        # sessions still holding the old instance stop serving stale results too
+        db.invalidate()
+    _databases.pop(db_uri)
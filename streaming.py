@@ -1,11 +1,76 @@
+import time
+from streamlit.logger import get_logger
 from langchain_core.callbacks import BaseCallbackHandler
 
+logger = get_logger('Langchain-Chatbot')
+
 class StreamHandler(BaseCallbackHandler):
-    
-    def __init__(self, container, initial_text=""):
+    """Renders streamed tokens into a Streamlit container.
+
+    Tokens are buffered and the container is re-rendered at most every
+    `flush_interval` seconds or `flush_tokens` tokens, instead of once per token.
+    """
+
+    def __init__(self, container, initial_text="", flush_interval=0.05, flush_tokens=20):
         self.container = container
         self.text = initial_text
+        self.flush_interval = flush_interval
+        self.flush_tokens = flush_tokens
+        self._pending = []
+        self._last_flush = time.perf_counter()
+        self.start_time = None
+        self.first_token_time = None
+        self.end_time = None
+        self.token_count = 0
+
+    def flush(self):
+        if self._pending:
+            self.text += "".join(self._pending)
+            self._pending = []
+            self.container.markdown(self.text)
+        self._last_flush = time.perf_counter()
+
+    def _on_start(self):
+        self.start_time = time.perf_counter()
+        self.first_token_time = None
+        self.end_time = None
+        self.token_count = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._on_start()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._on_start()
 
     def on_llm_new_token(self, token: str, **kwargs):
-        self.text += token
-        self.container.markdown(self.text)
\ No newline at end of file
+        now = time.perf_counter()
+        if self.first_token_time is None:
+            self.first_token_time = now
+        self.token_count += 1
+        self._pending.append(token)
+        if len(self._pending) >= self.flush_tokens or now - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def on_llm_end(self, response, **kwargs):
+        self.flush()
+        self.end_time = time.perf_counter()
+        stats = self.stats()
+        if stats["time_to_first_token"] is not None:
+            logger.info("Streamed {} tokens, time to first token {:.3f}s, {:.1f} tokens/sec".format(
+                self.token_count, stats["time_to_first_token"], stats["tokens_per_sec"] or 0))
+
+    def on_llm_error(self, error, **kwargs):
+        self.flush()
+        self.end_time = time.perf_counter()
+
+    def stats(self):
+        """Time to first token (s) and generation speed (tokens/s) of the last call."""
+        if self.start_time is None or self.first_token_time is None:
+            return {"tokens": self.token_count, "time_to_first_token": None, "tokens_per_sec": None}
+        end = self.end_time or time.perf_counter()
+        generation_time = end - self.first_token_time
+        return {
+            "tokens": self.token_count,
+            "time_to_first_token": self.first_token_time - self.start_time,
+            "tokens_per_sec": self.token_count / generation_time if generation_time > 0 else None,
+        }
@@ -0,0 +1,33 @@
+import tracing
+from caching import TTLCache
+from langchain_core.tools import Tool
+from langchain_community.tools import DuckDuckGoSearchRun
+
+# agent loops often repeat a search, results are reused for an hour across sessions
+_search_cache = TTLCache(max_entries=1024, ttl=3600)
+_ddg_search = None
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split()).strip(" ?!.\"'")
+
+
+def web_search(query):
+    global _ddg_search
+    key = normalize_query(query)
+    result = _search_cache.get(key)
+    tracing.count("cache.search.hit" if result is not None else "cache.search.miss")
+    if result is None:
+        if _ddg_search is None:
+            _ddg_search = DuckDuckGoSearchRun()
+        result = _ddg_search.run(query)
+        _search_cache.set(key, result)
+    return result
+
+
+def search_tool():
+    return Tool(
+        name="DuckDuckGoSearch",
+        func=web_search,
+        description="Useful for when you need to answer questions about current events. You should ask targeted questions",
+    )
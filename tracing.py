@@ -0,0 +1,336 @@
+"""Per-turn timing spans, token counts and cache hit rates.
+
+A `trace` covers one chat turn (a Streamlit rerun or a server turn). Inside it,
+every LangChain run gets a TracingCallbackHandler through a configure hook, so
+retriever, LLM and tool timings are recorded without passing callbacks around.
+Code outside LangChain runs (loading, splitting, embedding, indexing, SQL)
+marks its own spans with `span` and counts cache hits with `count`.
+
+Finished traces update the process wide METRICS, shown in Prometheus text
+format by `METRICS.render()`, and are appended to the JSONL file in
+TRACE_FILE by a background writer when that is set.
+"""
+import os
+import json
+import time
+import queue
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from streamlit.logger import get_logger
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+logger = get_logger('Langchain-Chatbot')
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metrics:
+    """Counters and latency histograms in Prometheus text format."""
+
+    def __init__(self, prefix="chatbot"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            buckets, total, count = self._histograms.get(key, ([0] * (len(_BUCKETS) + 1), 0.0, 0))
+            buckets[bisect.bisect_left(_BUCKETS, seconds)] += 1
+            self._histograms[key] = (buckets, total + seconds, count + 1)
+
+    @staticmethod
+    def _labels(labels, **extra):
+        pairs = list(labels) + list(extra.items())
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(b), t, c) for key, (b, t, c) in self._histograms.items()}
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{self.prefix}_{name}{self._labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {self.prefix}_{name} histogram")
+            for (n, labels), (buckets, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(_BUCKETS + ("+Inf",), buckets):
+                    cumulative += bucket
+                    lines.append(f"{self.prefix}_{name}_bucket{self._labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{self.prefix}_{name}_sum{self._labels(labels)} {total}")
+                lines.append(f"{self.prefix}_{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class JsonlWriter:
+    """Appends records to a JSONL file from a background thread.
+
+    `write` never blocks: when `max_pending` records are already waiting the
+    record is dropped and counted in the traces_dropped_total metric.
+    """
+
+    def __init__(self, path, max_pending=10_000):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            METRICS.inc("traces_dropped_total")
+
+    def _run(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                record = self._queue.get()
+                try:
+                    f.write(json.dumps(record, default=str) + "\n")
+                except Exception:
+                    logger.exception("Could not write trace")
+                # flush once the queue is drained, not per record
+                if self._queue.empty():
+                    f.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _jsonl_writer():
+    global _writer
+    path = os.environ.get("TRACE_FILE")
+    if not path:
+        return None
+    with _writer_lock:
+        if _writer is None or _writer.path != path:
+            _writer = JsonlWriter(path)
+    return _writer
+
+
+class Trace:
+    """Spans and counters of one turn; spans are (name, start offset, seconds, attributes)."""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end, **attrs):
+        with self._lock:
+            self.spans.append((name, start - self._start, end - start, attrs))
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def breakdown(self):
+        """{span name: (calls, total seconds)} in order of first occurrence."""
+        totals = {}
+        for name, _, seconds, _ in sorted(self.spans, key=lambda s: s[1]):
+            calls, total = totals.get(name, (0, 0.0))
+            totals[name] = (calls + 1, total + seconds)
+        return totals
+
+    def cache_hit_rates(self):
+        """{cache name: hit rate} of the caches used in this turn."""
+        rates = {}
+        for name in self.counters:
+            if name.startswith("cache.") and name.endswith((".hit", ".miss")):
+                cache = name[len("cache."):].rsplit(".", 1)[0]
+                hits = self.counters.get(f"cache.{cache}.hit", 0)
+                total = hits + self.counters.get(f"cache.{cache}.miss", 0)
+                if total:
+                    rates[cache] = hits / total
+        return rates
+
+    def to_dict(self):
+        return {
+            "trace": self.name,
+            **self.attrs,
+            "started": self.started,
+            "duration": self.duration,
+            "spans": [{"name": n, "start": round(s, 6), "seconds": round(d, 6), **a} for n, s, d, a in self.spans],
+            "counters": self.counters,
+        }
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_tracing_handler = contextvars.ContextVar("tracing_handler", default=None)
+# every LangChain run started while a trace is active reports to its handler
+register_configure_hook(_tracing_handler, inheritable=True)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(name, **attrs):
+    """Trace the block as one turn of chatbot `name`; yields the Trace."""
+    turn = Trace(name, **attrs)
+    trace_token = _current_trace.set(turn)
+    handler_token = _tracing_handler.set(TracingCallbackHandler(turn))
+    try:
+        yield turn
+    finally:
+        _tracing_handler.reset(handler_token)
+        _current_trace.reset(trace_token)
+        turn.duration = time.perf_counter() - turn._start
+        # reruns that did nothing worth timing are not exported
+        if turn.spans:
+            _export(turn)
+
+
+def _export(turn):
+    METRICS.observe("turn_seconds", turn.duration, chatbot=turn.name)
+    for name, _, seconds, _ in turn.spans:
+        METRICS.observe("span_seconds", seconds, chatbot=turn.name, span=name)
+    for name, value in turn.counters.items():
+        if name.startswith("cache."):
+            cache, result = name[len("cache."):].rsplit(".", 1)
+            METRICS.inc("cache_requests_total", value, chatbot=turn.name, cache=cache, result=result)
+        else:
+            METRICS.inc(name.replace(".", "_") + "_total", value, chatbot=turn.name)
+    writer = _jsonl_writer()
+    if writer is not None:
+        writer.write(turn.to_dict())
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as span `name` of the current trace, if any."""
+    turn = _current_trace.get()
+    if turn is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        turn.add_span(name, start, time.perf_counter(), **attrs)
+
+
+def count(name, value=1):
+    """Add `value` to counter `name` of the current trace, e.g. count("cache.search.hit")."""
+    turn = _current_trace.get()
+    if turn is not None:
+        turn.count(name, value)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Records retriever, LLM and tool runs of a LangChain call as spans of `trace`."""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._runs = {}
+        self._streaming = set()
+
+    def _start(self, run_id, **attrs):
+        self._runs[run_id] = (time.perf_counter(), attrs)
+
+    def _end(self, name, run_id):
+        start, attrs = self._runs.pop(run_id, (None, {}))
+        if start is not None:
+            self.trace.add_span(name, start, time.perf_counter(), **attrs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self._runs and run_id not in self._streaming:
+            self._streaming.add(run_id)
+            self.trace.add_span("llm.first_token", self._runs[run_id][0], time.perf_counter())
+        self.trace.count("tokens.streamed")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._streaming.discard(run_id)
+        self._end("llm", run_id)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        if not usage:
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens += metadata.get("input_tokens", 0)
+                    completion_tokens += metadata.get("output_tokens", 0)
+        if prompt_tokens or completion_tokens:
+            self.trace.count("tokens.prompt", prompt_tokens)
+            self.trace.count("tokens.completion", completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._streaming.discard(run_id)
+        self._end("llm", run_id)
+        self.trace.count("errors.llm")
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end("retrieve", run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end("retrieve", run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, tool=(serialized or {}).get("name") or kwargs.get("name"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end("tool", run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end("tool", run_id)
+        self.trace.count("errors.tool")
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve METRICS on http://host:port/metrics from a background thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = METRICS.render().encode()
+            self.send_response(200 if self.path == "/metrics" else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
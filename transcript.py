@@ -0,0 +1,119 @@
+import os
+import time
+import uuid
+import sqlite3
+import weakref
+import functools
+import threading
+
+
+class Message:
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+
+
+class SpillStore:
+    """SQLite file holding the older messages of every transcript in this process.
+
+    Rows are removed when their transcript is cleared or garbage collected, and
+    rows left behind by a crashed process expire after `ttl` seconds.
+    """
+
+    def __init__(self, path='.cache/transcripts.db', ttl=24 * 3600):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "transcript TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+            "created REAL NOT NULL, PRIMARY KEY (transcript, seq))"
+        )
+        self._conn.execute("DELETE FROM messages WHERE created < ?", (time.time() - ttl,))
+        self._conn.commit()
+
+    def write(self, transcript_id, first_seq, messages):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (transcript, seq, role, content, created) VALUES (?, ?, ?, ?, ?)",
+                [(transcript_id, first_seq + i, m.role, m.content, now) for i, m in enumerate(messages)]
+            )
+            self._conn.commit()
+
+    def read(self, transcript_id, start, stop):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content FROM messages WHERE transcript = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (transcript_id, start, stop)
+            ).fetchall()
+        return [Message(role, content) for role, content in rows]
+
+    def delete(self, transcript_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE transcript = ?", (transcript_id,))
+            self._conn.commit()
+
+
+@functools.lru_cache(maxsize=None)
+def spill_store(path='.cache/transcripts.db'):
+    return SpillStore(path)
+
+
+class Transcript:
+    """Append-only chat messages of one session, with old messages spilled to disk.
+
+    The newest `max_in_memory` messages are kept as slotted records; beyond
+    that, the oldest `spill_batch` are moved to the shared SpillStore in one
+    write. `window(start, stop)` reads any range back, so rendering the last
+    few messages costs the same however long the conversation is.
+    """
+
+    def __init__(self, max_in_memory=200, spill_batch=100, store=None):
+        self.id = uuid.uuid4().hex
+        self.max_in_memory = max_in_memory
+        self.spill_batch = spill_batch
+        self._store = store
+        self._messages = []
+        self._spilled = 0
+        self._finalizer = None
+
+    def __len__(self):
+        return self._spilled + len(self._messages)
+
+    def __iter__(self):
+        return iter(self.window(0))
+
+    def append(self, role, content):
+        self._messages.append(Message(role, content))
+        if len(self._messages) > self.max_in_memory:
+            self._spill()
+
+    def _spill(self):
+        store = self._store or spill_store()
+        if self._finalizer is None:
+            # drop this transcript's rows once the session lets go of it
+            self._finalizer = weakref.finalize(self, store.delete, self.id)
+        batch = self._messages[:self.spill_batch]
+        store.write(self.id, self._spilled, batch)
+        del self._messages[:len(batch)]
+        self._spilled += len(batch)
+
+    def window(self, start, stop=None):
+        """Messages [start, stop) in order, read from disk where they were spilled."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(start, 0)
+        messages = []
+        if start < self._spilled:
+            messages = (self._store or spill_store()).read(self.id, start, min(stop, self._spilled))
+        return messages + self._messages[max(start - self._spilled, 0):max(stop - self._spilled, 0)]
+
+    def clear(self):
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+        self._messages = []
+        self._spilled = 0
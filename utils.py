@@ -1,14 +1,20 @@
 import os
-import openai
+import clients
+import gateway
+import tracing
+import warmup
+import chatbots
 import streamlit as st
-from datetime import datetime
+from memory import TokenBudgetMemory
+from transcript import Transcript
+from response_cache import ResponseCache, CachedChatModel
 from streamlit.logger import get_logger
-from langchain_openai import ChatOpenAI
-from langchain_community.chat_models import ChatOllama
-from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 
 logger = get_logger('Langchain-Chatbot')
 
+# messages rendered per rerun, older ones are paged in with "Load earlier messages"
+HISTORY_WINDOW = 20
+
 #decorator
 def enable_chat_history(func):
     if os.environ.get("OPENAI_API_KEY"):
@@ -18,23 +24,103 @@ def enable_chat_history(func):
         if "current_page" not in st.session_state:
             st.session_state["current_page"] = current_page
         if st.session_state["current_page"] != current_page:
-            try:
-                st.cache_resource.clear()
-                del st.session_state["current_page"]
-                del st.session_state["messages"]
-            except:
-                pass
+            # release only this session's page objects, shared models and indexes stay warm
+            release_page_resources()
+            st.session_state["current_page"] = current_page
+            st.session_state.pop("messages", None)
+            st.session_state.pop("history_window", None)
 
         # to show chat history on ui
         if "messages" not in st.session_state:
-            st.session_state["messages"] = [{"role": "assistant", "content": "How can I help you?"}]
-        for msg in st.session_state["messages"]:
-            st.chat_message(msg["role"]).write(msg["content"])
+            st.session_state["messages"] = Transcript()
+            st.session_state["messages"].append("assistant", "How can I help you?")
+        show_chat_history(st.session_state["messages"])
 
     def execute(*args, **kwargs):
-        func(*args, **kwargs)
+        # pages opened directly, without Home.py, start it too
+        warmup.start_background()
+        start_metrics_server()
+        # one trace per rerun, LangChain runs and pipeline stages report to it
+        with tracing.trace(func.__qualname__.split(".")[0]) as turn:
+            func(*args, **kwargs)
+        show_trace(turn)
     return execute
 
+def show_chat_history(messages):
+    """Render the last messages of the conversation, so a rerun costs the same at any length."""
+    window = st.session_state.setdefault("history_window", HISTORY_WINDOW)
+    start = max(len(messages) - window, 0)
+    if start:
+        st.button(
+            f"Load earlier messages ({start:,} more)",
+            on_click=lambda: st.session_state.update(history_window=window + HISTORY_WINDOW)
+            )
+    for msg in messages.window(start):
+        st.chat_message(msg.role).write(msg.content)
+
+@st.cache_resource
+def start_metrics_server():
+    # Prometheus endpoint shared by all sessions, only when TRACE_METRICS_PORT is set
+    port = os.environ.get("TRACE_METRICS_PORT")
+    return tracing.serve_metrics(int(port)) if port else None
+
+def show_trace(turn):
+    """Sidebar panel with the stage timings, tokens and cache hit rates of the last answered turn."""
+    if any(name == "llm" for name, *_ in turn.spans):
+        st.session_state["last_trace"] = turn
+    if not st.sidebar.toggle("Show turn timings", key="TRACE_PANEL"):
+        return
+    last = st.session_state.get("last_trace")
+    if last is None:
+        st.sidebar.caption("Timings show up after the first answer.")
+        return
+    with st.sidebar.expander(f"Last turn: {last.duration:.2f}s", expanded=True):
+        rows = [f"| {name} | {calls} | {seconds * 1000:,.1f} |" for name, (calls, seconds) in last.breakdown().items()]
+        st.markdown("\n".join(["| stage | calls | ms |", "|---|--:|--:|", *rows]))
+        tokens = {name.split(".", 1)[1]: value for name, value in last.counters.items() if name.startswith("tokens.")}
+        if tokens:
+            st.caption("Tokens: " + ", ".join(f"{name} {value:,}" for name, value in tokens.items()))
+        rates = last.cache_hit_rates()
+        if rates:
+            st.caption("Cache hit rate: " + ", ".join(f"{name} {rate:.0%}" for name, rate in rates.items()))
+
+def page_resource(key, factory, version=None):
+    """Per-session object owned by the current page, e.g. a chain or its memory.
+
+    Created with `factory()` on first use and kept across reruns until the user
+    switches to another page or it is released explicitly. It is replaced when
+    `version` changes, e.g. an agent built for another LLM.
+    """
+    resources = st.session_state.setdefault("page_resources", {})
+    if key not in resources or resources[key][0] != version:
+        # drop the old one first, it may hold a client that was closed since
+        resources.pop(key, None)
+        resources[key] = (version, factory())
+    return resources[key][1]
+
+def release_page_resources(*keys):
+    """Drop the given page resources of this session, or all of them when no keys are given."""
+    if not keys:
+        st.session_state.pop("page_resources", None)
+        return
+    resources = st.session_state.get("page_resources", {})
+    for key in keys:
+        resources.pop(key, None)
+
+def conversation_memory(llm, **kwargs):
+    """Token bounded memory of this session's conversation on the current page.
+
+    Older turns are summarized with `llm` once the history outgrows the budget,
+    see memory.TokenBudgetMemory. The number of history tokens sent with the
+    last prompt is shown in the sidebar.
+    """
+    memory = page_resource("memory", lambda: TokenBudgetMemory(llm=llm, **kwargs))
+    # follow the LLM selected in the sidebar
+    memory.llm = llm
+    if memory.prompt_tokens:
+        st.sidebar.caption(f"History tokens in last prompt: {memory.prompt_tokens[-1]:,} / {memory.max_token_limit:,}")
+    return memory
+
 def display_msg(msg, author):
     """Method to display message on the UI
 
@@ -42,7 +128,7 @@ def display_msg(msg, author):
         msg (str): message to display
         author (str): author of the message -user/assistant
     """
-    st.session_state.messages.append({"role": author, "content": msg})
+    st.session_state.messages.append(author, msg)
     st.chat_message(author).write(msg)
 
 def choose_custom_openai_key():
@@ -57,13 +143,11 @@ def choose_custom_openai_key():
         st.info("Obtain your key from this link: https://platform.openai.com/account/api-keys")
         st.stop()
 
+    import openai
+
     model = "gpt-4o-mini"
     try:
-        client = openai.OpenAI(api_key=openai_api_key)
-        available_models = [{"id": i.id, "created":datetime.fromtimestamp(i.created)} for i in client.models.list() if str(i.id).startswith("gpt")]
-        available_models = sorted(available_models, key=lambda x: x["created"])
-        available_models = [i["id"] for i in available_models]
-
+        available_models = clients.list_openai_models(openai_api_key)
         model = st.sidebar.selectbox(
             label="Model",
             options=available_models,
@@ -78,7 +162,13 @@ def choose_custom_openai_key():
         st.stop()
     return model, openai_api_key
 
-def configure_llm():
+def configure_llm(response_cache=False):
+    """LLM selected in the sidebar.
+
+    Args:
+        response_cache (bool): offer the user to answer repeated questions from
+            the shared response cache, see response_cache.ResponseCache
+    """
     available_llms = ["gpt-4o-mini","llama3.2:3b","use your openai api key"]
     llm_opt = st.sidebar.radio(
         label="LLM",
@@ -86,24 +176,38 @@ def configure_llm():
         key="SELECTED_LLM"
         )
 
+    # clients are shared across reruns and sessions, see clients.get_chat_model
     if llm_opt == "llama3.2:3b":
-        llm = ChatOllama(model="llama3.2", base_url=st.secrets["OLLAMA_ENDPOINT"])
+        # overflow to OpenAI while the Ollama host is busy
+        fallback = ("openai", "gpt-4o-mini", st.secrets["OPENAI_API_KEY"]) if gateway.FALLBACK_QUEUE_DEPTH is not None else None
+        llm = clients.get_chat_model("ollama", "llama3.2", base_url=st.secrets["OLLAMA_ENDPOINT"], fallback=fallback)
     elif llm_opt == "gpt-4o-mini":
-        llm = ChatOpenAI(model_name=llm_opt, temperature=0, streaming=True, api_key=st.secrets["OPENAI_API_KEY"])
+        llm = clients.get_chat_model("openai", llm_opt, api_key=st.secrets["OPENAI_API_KEY"])
     else:
         model, openai_api_key = choose_custom_openai_key()
-        llm = ChatOpenAI(model_name=model, temperature=0, streaming=True, api_key=openai_api_key)
+        llm = clients.get_chat_model("openai", model, api_key=openai_api_key)
+
+    if response_cache and st.sidebar.checkbox("Reuse answers to similar questions", key="RESPONSE_CACHE"):
+        llm = CachedChatModel(llm=llm, response_cache=configure_response_cache())
     return llm
 
 def print_qa(cls, question, answer):
     log_str = "\nUsecase: {}\nQuestion: {}\nAnswer: {}\n" + "------"*10
     logger.info(log_str.format(cls.__name__, question, answer))
 
-@st.cache_resource
 def configure_embedding_model():
-    embedding_model = FastEmbedEmbeddings(model_name="BAAI/bge-small-en-v1.5")
-    return embedding_model
+    # shared by all sessions, see chatbots.embedding_model
+    return chatbots.embedding_model()
+
+@st.cache_resource
+def configure_response_cache():
+    return ResponseCache(embeddings=configure_embedding_model())
+
+# sidebar widgets shared by the pages; Streamlit drops a widget's value when a page
+# without it runs, writing it back keeps the choice across page switches
+SHARED_WIDGET_KEYS = ("SELECTED_LLM", "SELECTED_OPENAI_API_KEY", "SELECTED_OPENAI_MODEL", "RESPONSE_CACHE", "TRACE_PANEL")
 
 def sync_st_session():
-    for k, v in st.session_state.items():
-        st.session_state[k] = v
\ No newline at end of file
+    for k in SHARED_WIDGET_KEYS:
+        if k in st.session_state:
+            st.session_state[k] = st.session_state[k]
\ No newline at end of file
@@ -0,0 +1,360 @@
+import os
+import json
+import uuid
+import shutil
+import tracing
+import numpy as np
+from lexical import BM25Index
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+
+# rows scored per block for compact dtypes, bounds the float32 temporary
+_SCORE_BLOCK = 16384
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _quantize(vectors, dtype):
+    """Unit vectors stored as `dtype`, with per-vector scales for int8 (None otherwise)."""
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(dtype), None
+
+
+def _mmr_select(query_scores, candidate_vectors, k, lambda_mult):
+    """Indices of the MMR selection among candidates sorted by query similarity."""
+    # track each candidate's max similarity to the selected set incrementally
+    selected = [0]
+    max_sim = candidate_vectors @ candidate_vectors[0]
+    for _ in range(min(k, len(candidate_vectors)) - 1):
+        mmr_scores = lambda_mult * query_scores - (1 - lambda_mult) * max_sim
+        mmr_scores[selected] = -np.inf
+        idx = int(np.argmax(mmr_scores))
+        selected.append(idx)
+        max_sim = np.maximum(max_sim, candidate_vectors @ candidate_vectors[idx])
+    return selected
+
+
+class ChunkFile:
+    """Read-only sequence of the Documents in a docs.jsonl file.
+
+    Only the line offsets are kept in memory, the file is memory-mapped and a
+    Document is parsed when it is accessed, e.g. for the top-k hits of a query.
+    """
+
+    __slots__ = ("offsets", "_data")
+
+    def __init__(self, path, offsets):
+        self.offsets = offsets
+        self._data = np.memmap(path, dtype=np.uint8, mode='r') if len(offsets) > 1 else None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        record = json.loads(self._data[self.offsets[i]:self.offsets[i + 1]].tobytes())
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class NumpyVectorStore(VectorStore):
+    """Vector store keeping all embeddings in one contiguous matrix.
+
+    Vectors are L2 normalised on insert, so cosine similarity is a single
+    matrix-vector product. They are kept as float32, or more compactly as
+    float16 or int8 with a per-vector scale (`dtype`). A store saved with
+    `save` can be reopened with `load`, which memory-maps the matrix read-only
+    so every session (and process) loading the same corpus shares the same
+    pages; documents are then read from disk only when they are returned.
+
+    A BM25 index of the documents (`lexical_index`) is saved next to the
+    vectors, or built on first use for stores that were never saved.
+    """
+
+    def __init__(self, embedding, vectors=None, documents=None, ids=None, lexical_index=None,
+                 dtype="float32", scales=None):
+        self.embedding = embedding
+        self.dtype = str(vectors.dtype) if vectors is not None else dtype
+        self.vectors = vectors
+        self.scales = scales
+        self.documents = documents if documents is not None else []
+        self.ids = ids if ids is not None else []
+        # writable backing arrays with spare rows, so appends are amortised O(batch)
+        self._buffer = None
+        self._scale_buffer = None
+        self._lexical_index = lexical_index
+
+    @property
+    def lexical_index(self):
+        if self._lexical_index is None:
+            with tracing.span("index.bm25", documents=len(self.documents)):
+                self._lexical_index = BM25Index.from_texts([doc.page_content for doc in self.documents])
+        return self._lexical_index
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _make_mutable(self):
+        # loaded stores keep documents on disk and ids in an array
+        if not isinstance(self.documents, list):
+            self.documents = list(self.documents)
+        if not isinstance(self.ids, list):
+            self.ids = [str(i) for i in self.ids]
+
+    def add_vectors(self, vectors, documents, ids=None):
+        if not documents:
+            return []
+        with tracing.span("index", documents=len(documents)):
+            return self._add_vectors(vectors, documents, ids)
+
+    def _add_vectors(self, vectors, documents, ids):
+        self._make_mutable()
+        ids = ids or [uuid.uuid4().hex for _ in documents]
+        vectors, scales = _quantize(_normalize(vectors), self.dtype)
+        n, m = len(self.ids), len(vectors)
+        if self._buffer is None or n + m > len(self._buffer):
+            # a read-only memory-mapped matrix is copied here, never written to
+            capacity = max(2 * (n + m), 1024)
+            self._buffer = np.empty((capacity, vectors.shape[1]), dtype=vectors.dtype)
+            if n:
+                self._buffer[:n] = self.vectors
+            if scales is not None:
+                self._scale_buffer = np.empty(capacity, dtype=np.float32)
+                if n:
+                    self._scale_buffer[:n] = self.scales
+        self._buffer[n:n + m] = vectors
+        self.vectors = self._buffer[:n + m]
+        if scales is not None:
+            self._scale_buffer[n:n + m] = scales
+            self.scales = self._scale_buffer[:n + m]
+        self.documents.extend(documents)
+        self.ids.extend(ids)
+        self._lexical_index = None
+        return ids
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        return self.add_vectors(self.embedding.embed_documents(texts), documents, ids)
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        self._make_mutable()
+        ids = set(ids)
+        keep = np.array([i not in ids for i in self.ids], dtype=bool)
+        self.vectors = self._buffer = self.vectors[keep]
+        if self.scales is not None:
+            self.scales = self._scale_buffer = self.scales[keep]
+        self.documents = [d for d, k in zip(self.documents, keep) if k]
+        self.ids = [i for i, k in zip(self.ids, keep) if k]
+        self._lexical_index = None
+        return True
+
+    def get_by_ids(self, ids, /):
+        position = {str(i): p for p, i in enumerate(self.ids)}
+        return [self.documents[position[i]] for i in ids if i in position]
+
+    def get_vectors(self, indices):
+        """Float32 (dequantised) vectors at `indices`."""
+        vectors = self.vectors[indices].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[indices][..., None]
+        return vectors
+
+    def _scores(self, query):
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ query
+        scores = np.empty(len(self.vectors), dtype=np.float32)
+        for start in range(0, len(scores), _SCORE_BLOCK):
+            block = self.vectors[start:start + _SCORE_BLOCK].astype(np.float32)
+            scores[start:start + _SCORE_BLOCK] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def _top_k(self, embedding, k):
+        if not len(self.ids):
+            return np.array([], dtype=int), np.array([], dtype=np.float32)
+        scores = self._scores(_normalize(embedding))
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        top, scores = self._top_k(embedding, k)
+        return [(self.documents[i], float(s)) for i, s in zip(top, scores)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        candidates, query_scores = self._top_k(embedding, fetch_k)
+        if not len(candidates):
+            return []
+        selected = _mmr_select(query_scores, self.get_vectors(candidates), k, lambda_mult)
+        return [self.documents[candidates[i]] for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        embedding = self.embedding.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(embedding, k, fetch_k, lambda_mult)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, **kwargs):
+        store = cls(embedding, dtype=kwargs.get("dtype", "float32"))
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def save(self, folder):
+        """Write the store to `folder` atomically, so readers never see a partial index."""
+        tmp_folder = f"{folder}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(tmp_folder)
+        vectors = self.vectors if self.vectors is not None else np.zeros((0, 0), dtype=self.dtype)
+        np.save(os.path.join(tmp_folder, 'vectors.npy'), vectors)
+        if self.scales is not None:
+            np.save(os.path.join(tmp_folder, 'scales.npy'), self.scales)
+        np.save(os.path.join(tmp_folder, 'ids.npy'), np.array([str(i) for i in self.ids]))
+        offsets = [0]
+        with open(os.path.join(tmp_folder, 'docs.jsonl'), 'wb') as f:
+            for id_, doc in zip(self.ids, self.documents):
+                line = (json.dumps({"id": str(id_), "page_content": doc.page_content, "metadata": doc.metadata}) + '\n').encode('utf-8')
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(tmp_folder, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+        self.lexical_index.save(os.path.join(tmp_folder, 'bm25'))
+        try:
+            os.rename(tmp_folder, folder)
+        except OSError:
+            # another process saved the same corpus first
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    @classmethod
+    def load(cls, folder, embedding):
+        """Open a saved store with its matrix memory-mapped read-only and documents read on access."""
+        with tracing.span("load.store"):
+            return cls._load(folder, embedding)
+
+    @classmethod
+    def _load(cls, folder, embedding):
+        vectors = np.load(os.path.join(folder, 'vectors.npy'), mmap_mode='r')
+        scales_path = os.path.join(folder, 'scales.npy')
+        scales = np.load(scales_path, mmap_mode='r') if os.path.exists(scales_path) else None
+        docs_path = os.path.join(folder, 'docs.jsonl')
+        if os.path.exists(os.path.join(folder, 'offsets.npy')):
+            ids = np.load(os.path.join(folder, 'ids.npy'), mmap_mode='r')
+            documents = ChunkFile(docs_path, np.load(os.path.join(folder, 'offsets.npy'), mmap_mode='r'))
+        else:
+            # saved before documents were read lazily
+            documents, ids = [], []
+            with open(docs_path, encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    ids.append(record["id"])
+                    documents.append(Document(page_content=record["page_content"], metadata=record["metadata"]))
+        # stores saved before the lexical index existed build it on first use
+        lexical_folder = os.path.join(folder, 'bm25')
+        lexical_index = BM25Index.load(lexical_folder) if os.path.exists(lexical_folder) else None
+        return cls(embedding, vectors if len(ids) else None, documents, ids, lexical_index, scales=scales)
+
+
+class SegmentedVectorStore(VectorStore):
+    """Vector store made of one NumpyVectorStore segment per source.
+
+    Adding or removing a source only touches that source's segment, so the cost
+    of a change does not depend on the size of the rest of the corpus. Segments
+    can be shared between sessions, e.g. memory-mapped stores of the same file.
+    """
+
+    def __init__(self, embedding, segments=None):
+        self.embedding = embedding
+        self.segments = dict(segments or {})
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments.values())
+
+    def add_segment(self, source_id, segment):
+        self.segments[source_id] = segment
+
+    def remove_segment(self, source_id):
+        return self.segments.pop(source_id, None) is not None
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        source_id = kwargs.get("source_id", "default")
+        if source_id not in self.segments:
+            self.segments[source_id] = NumpyVectorStore(self.embedding)
+        return self.segments[source_id].add_texts(texts, metadatas, ids=ids)
+
+    def _top_k(self, embedding, k):
+        hits = []
+        for segment in self.segments.values():
+            top, scores = segment._top_k(embedding, k)
+            hits.extend((float(score), segment, int(i)) for i, score in zip(top, scores))
+        hits.sort(key=lambda hit: -hit[0])
+        return hits[:k]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        return [(segment.documents[i], score) for score, segment, i in self._top_k(embedding, k)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        hits = self._top_k(embedding, fetch_k)
+        if not hits:
+            return []
+        query_scores = np.array([score for score, _, _ in hits], dtype=np.float32)
+        candidate_vectors = np.stack([segment.get_vectors(i) for _, segment, i in hits])
+        selected = _mmr_select(query_scores, candidate_vectors, k, lambda_mult)
+        return [hits[i][1].documents[hits[i][2]] for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        embedding = self.embedding.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(embedding, k, fetch_k, lambda_mult)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, **kwargs):
+        store = cls(embedding)
+        store.add_texts(texts, metadatas, ids=ids, **kwargs)
+        return store
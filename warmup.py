@@ -0,0 +1,126 @@
+"""Load what the first request would otherwise wait for.
+
+Steps:
+    embeddings  load the FastEmbed model from EMBEDDING_MODEL_DIR, downloading it
+                there first unless HF_HUB_OFFLINE=1
+    prompts     parse the vendored prompts in assets/prompts
+    chains      import the chain, agent and SQL toolkit modules of the chatbots
+    sample_db   open Chinook.db and reflect its schema
+    providers   import the chat model provider(s) in LLM_PROVIDER
+
+Run it at image build time with --only embeddings to bake the model into the
+image, and at startup (python warmup.py, or start_background() from the app)
+so the first user doesn't pay for it.
+
+Usage:
+    python warmup.py
+    python warmup.py --only embeddings
+    python warmup.py --json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from streamlit.logger import get_logger
+
+logger = get_logger('Langchain-Chatbot')
+
+
+def warm_embeddings():
+    import chatbots
+    chatbots.embedding_model().embed_query("warm up")
+
+
+def warm_prompts():
+    from prompts import HUB_REFS, load_prompt
+    for name, hub_ref in HUB_REFS.items():
+        load_prompt(name, hub_ref)
+
+
+def warm_chains():
+    import tools  # noqa: F401
+    import ingestion  # noqa: F401
+    from langchain.agents import AgentExecutor, create_react_agent  # noqa: F401
+    from langchain.chains import ConversationChain, ConversationalRetrievalChain  # noqa: F401
+    from langchain_community.agent_toolkits import create_sql_agent  # noqa: F401
+
+
+def warm_sample_db():
+    import sqldb
+    sqldb.get_database(sqldb.SAMPLE_DB).get_table_info()
+
+
+def warm_providers():
+    # the Streamlit app offers both, the server uses LLM_PROVIDER
+    providers = os.environ.get("LLM_PROVIDER", "openai,ollama").split(",")
+    if "openai" in providers:
+        import openai  # noqa: F401
+        from langchain_openai import ChatOpenAI  # noqa: F401
+    if "ollama" in providers:
+        from langchain_community.chat_models import ChatOllama  # noqa: F401
+
+
+STEPS = {
+    "embeddings": warm_embeddings,
+    "prompts": warm_prompts,
+    "chains": warm_chains,
+    "sample_db": warm_sample_db,
+    "providers": warm_providers,
+}
+
+
+def warm_up(steps=None):
+    """Run the warm-up steps in order; a failing step is logged and skipped.
+
+    Returns:
+        dict: step -> {"seconds": float, "error": str or None}
+    """
+    results = {}
+    for name in steps or STEPS:
+        start = time.perf_counter()
+        error = None
+        try:
+            STEPS[name]()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Warm-up step {name} failed: {error}")
+        results[name] = {"seconds": time.perf_counter() - start, "error": error}
+    logger.info("Warm-up: " + ", ".join(f"{name} {r['seconds']:.2f}s" for name, r in results.items()))
+    return results
+
+
+_background = None
+_background_lock = threading.Lock()
+
+
+def start_background(steps=None):
+    """Warm up once per process in a daemon thread, unless WARMUP=0."""
+    global _background
+    if os.environ.get("WARMUP", "1") == "0":
+        return None
+    with _background_lock:
+        if _background is None:
+            _background = threading.Thread(target=warm_up, args=(steps,), name="warm-up", daemon=True)
+            _background.start()
+    return _background
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', nargs='+', choices=list(STEPS), help="steps to run, all by default")
+    parser.add_argument('--json', action='store_true', help="print the step timings as JSON")
+    args = parser.parse_args()
+
+    results = warm_up(args.only)
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for name, result in results.items():
+            print(f"  {name:<12} {result['seconds']:7.2f}s  {result['error'] or 'ok'}")
+    sys.exit(1 if any(r["error"] for r in results.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
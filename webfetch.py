@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import tempfile
+import requests
+import traceback
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit, urlunsplit
+from concurrent.futures import ThreadPoolExecutor
+
+
+def canonical_url(url):
+    """Normalise a url so the same page always maps to the same cache entries."""
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ''))
+
+
+class WebFetcher:
+    """Fetches pages through a reader service with a pooled HTTP session.
+
+    Requests share keep-alive connections, have a timeout and are retried with
+    exponential backoff. Responses are cached on disk per URL and revalidated
+    with ETag / Last-Modified, so an unchanged page costs a 304.
+
+    Args:
+        base_url (str): reader endpoint the page url is appended to, point it to
+            a local stub server for testing
+        cache_dir (str): folder for the per url response cache
+        timeout (float): seconds per request
+        max_workers (int): pages fetched concurrently
+        retries (int): retries for connection errors and 429/5xx responses
+        backoff_factor (float): base delay of the exponential backoff
+    """
+
+    def __init__(self, base_url="https://r.jina.ai/", cache_dir=".cache/web", timeout=30, max_workers=8, retries=3, backoff_factor=0.5):
+        self.base_url = base_url
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.max_workers = max_workers
+        os.makedirs(cache_dir, exist_ok=True)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"]
+        )
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers['User-Agent'] = 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:88.0) Gecko/20100101 Firefox/88.0'
+
+    def _cache_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def _read_cache(self, url):
+        try:
+            with open(self._cache_path(url), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_cache(self, url, entry):
+        # a temp file of its own, sessions may fetch the same url at once
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._cache_path(url))
+        except OSError:
+            # the page was fetched, only the next revalidation is lost
+            traceback.print_exc()
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def fetch(self, url):
+        cached = self._read_cache(url)
+        headers = {}
+        if cached and cached.get("etag"):
+            headers['If-None-Match'] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers['If-Modified-Since'] = cached["last_modified"]
+
+        try:
+            response = self.session.get(self.base_url + url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and cached:
+                return cached["content"]
+            response.raise_for_status()
+        except Exception:
+            traceback.print_exc()
+            # serve a stale copy rather than nothing
+            return cached["content"] if cached else ""
+
+        content = response.text
+        self._write_cache(url, {
+            "url": url,
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified'),
+            "content": content,
+        })
+        return content
+
+    def fetch_all(self, urls):
+        """Fetch `urls` concurrently, returns a dict of url -> content, "" for pages that could not be fetched."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(urls, executor.map(self.fetch, urls)))